@@ -0,0 +1,38 @@
+"""
+Measure the time taken to compile a query with about 100k nodes (triples,
+terms and filter expressions) with a fresh compiler.
+
+Usage: python benchmarks/compile_large.py [triples]
+
+"""
+from __future__ import print_function
+import sys
+import timeit
+from rdflib import Namespace
+from sparqlquery.sparql.compiler import SelectCompiler
+from sparqlquery.sparql.helpers import v, op, optional
+from sparqlquery.sparql.queryforms import Select
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+
+
+def build(count):
+    triples = [(v['s%d' % (i % 100,)], FOAF['p%d' % (i % 50,)], v['o%d' % (i,)])
+               for i in range(count)]
+    filters = [(v['o%d' % (i,)] > i) & op.bound(v['s%d' % (i % 100,)])
+               for i in range(0, count, 10)]
+    return Select([v.s0]).where(*triples).where(
+        optional(*triples[:count // 10])
+    ).filter(*filters)
+
+
+def run(count):
+    query = build(count)
+    prefix_map = {FOAF: 'foaf'}
+    best = min(timeit.repeat(
+        lambda: SelectCompiler(prefix_map).compile(query), number=1, repeat=5))
+    print('%d triples: %.3f s' % (count, best))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,44 @@
+"""
+Measure the time taken to import sparqlquery and to compile a first query
+in a fresh interpreter.
+
+Usage: python benchmarks/import_time.py [runs]
+
+"""
+from __future__ import print_function
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOURCE = """
+from __future__ import print_function
+import time
+start = time.time()
+import rdflib
+rdflib_done = time.time()
+from sparqlquery import Select, v, is_a
+import_done = time.time()
+Select([v.x]).where((v.x, is_a, v.type)).compile()
+compile_done = time.time()
+print(rdflib_done - start, import_done - rdflib_done,
+      compile_done - import_done)
+"""
+
+
+def run(runs):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    timings = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', SOURCE],
+                                         env=env)
+        timings.append([float(value) for value in output.split()])
+    for i, label in enumerate(['import rdflib', 'import sparqlquery',
+                               'first compile']):
+        best = min(timing[i] for timing in timings)
+        print('%-20s %8.2f ms' % (label, best * 1000))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
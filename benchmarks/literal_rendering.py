@@ -0,0 +1,46 @@
+"""
+Measure the throughput of rendering plain Python values and rdflib terms
+with `ExpressionCompiler`, compared with rendering them as `Literal`s.
+
+Usage: python benchmarks/literal_rendering.py [count]
+
+"""
+from __future__ import print_function
+import sys
+import timeit
+from datetime import datetime, timedelta
+from rdflib import Literal, Namespace
+from sparqlquery.sparql.compiler import ExpressionCompiler
+from sparqlquery.sparql.helpers import v
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+
+
+def values(count):
+    start = datetime(2000, 1, 1)
+    return {
+        'int': [i for i in range(count)],
+        'float': [i / 3.0 for i in range(count)],
+        'str': [u'name %d' % (i % 100,) for i in range(count)],
+        'datetime': [start + timedelta(hours=i) for i in range(count)],
+        'uri': [FOAF['person%d' % (i % 100,)] for i in range(count)],
+    }
+
+
+def run(count):
+    prefix_map = {FOAF: 'foaf'}
+    for name, items in sorted(values(count).items()):
+        literals = [item if hasattr(item, 'n3') else Literal(item)
+                    for item in items]
+        compiler = ExpressionCompiler(prefix_map)
+        plain = min(timeit.repeat(
+            lambda: compiler.compile(v.x.in_(*items)), number=1, repeat=5))
+        wrapped = min(timeit.repeat(
+            lambda: ExpressionCompiler(prefix_map).compile(
+                v.x.in_(*literals)), number=1, repeat=5))
+        print('%-10s %10.0f values/s %10.0f literals/s (uncached)' %
+              (name, count / plain, count / wrapped))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,76 @@
+"""
+Measure the time taken by the mapper to bind instances from result rows,
+with `Mapper.bind_results` and with `Mapper.bind_instance` called on each
+row (as `bind_results` used to).
+
+Usage: python benchmarks/mapper_hydration.py [rows]
+
+"""
+from __future__ import print_function
+import sys
+import timeit
+from datetime import datetime, timedelta
+from rdflib import Literal, Namespace, URIRef
+from sparqlquery.mapper import mapper
+from sparqlquery.mapper.properties import Property
+from sparqlquery.sparql.helpers import XSD
+
+PTREC = Namespace('tag:info@semanticdb.ccf.org,2007:PatientRecordTerms#')
+
+
+class Event(object):
+    pass
+
+
+MAPPER = mapper(Event, PTREC.Event, properties={
+    'type': Property(PTREC.hasType),
+    'start': Property(PTREC.hasDateTimeMin),
+    'end': Property(PTREC.hasDateTimeMax),
+    'sequence': Property(PTREC.hasSequence),
+    'label': Property(PTREC.hasLabel),
+})
+
+
+def select():
+    variables = [name for name, property in Event._manager]
+    return MAPPER.select.project(variables, append=True)
+
+
+def rows(select, count):
+    start = datetime(1999, 3, 1)
+    values = {
+        'type': lambda i: PTREC['Event_%d' % (i % 10,)],
+        'start': lambda i: Literal(start + timedelta(hours=i)),
+        'end': lambda i: Literal(start + timedelta(hours=i + 1)),
+        'sequence': lambda i: Literal(i),
+        'label': lambda i: Literal(u'event %d' % (i,), datatype=XSD.string),
+    }
+    result = []
+    for i in range(count):
+        row = [URIRef('http://example.org/event/%d' % (i,))]
+        row.extend(values[str(name)](i) for name in select.projection[1:])
+        result.append(tuple(row))
+    return result
+
+
+def bind_instances(select, results):
+    for result in results:
+        instance = MAPPER.new_instance()
+        MAPPER.bind_instance(None, instance, dict(zip(select.projection,
+                                                      result)))
+
+
+def run(count):
+    query = select()
+    results = rows(query, count)
+    for label, function in [
+            ('bind_results()', lambda: list(MAPPER.bind_results(
+                None, query, results))),
+            ('bind_instance() per row', lambda: bind_instances(query,
+                                                               results))]:
+        best = min(timeit.repeat(function, number=1, repeat=3))
+        print('%-24s %8.2f us/row' % (label, best / count * 1e6))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
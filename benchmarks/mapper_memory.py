@@ -0,0 +1,72 @@
+"""
+Measure the memory taken by mapped instances bound from result rows, with
+the dict state of classes mapped with `mapper()` and the slotted list state
+of declarative classes.
+
+Each layout is measured in a fresh interpreter, as the growth of its
+maximum resident set size; the values themselves are shared between all
+instances, so the difference is the cost of the per-instance state.
+
+Usage: python benchmarks/mapper_memory.py [instances]
+
+"""
+from __future__ import print_function
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOURCE = """
+from __future__ import print_function
+import sys
+import resource
+from rdflib import Literal, Namespace, URIRef
+from sparqlquery.mapper import mapper
+from sparqlquery.mapper.declarative import Subject
+from sparqlquery.mapper.properties import Property
+
+PTREC = Namespace('tag:info@semanticdb.ccf.org,2007:PatientRecordTerms#')
+PROPERTIES = ['type', 'start', 'end', 'sequence', 'label']
+
+
+class Event(object):
+    pass
+
+mapper(Event, PTREC.Event, properties=dict(
+    (name, Property(PTREC[name])) for name in PROPERTIES))
+
+
+class DeclarativeEvent(Subject):
+    RDF_TYPE = PTREC.Event
+    type = Property(PTREC.type)
+    start = Property(PTREC.start)
+    end = Property(PTREC.end)
+    sequence = Property(PTREC.sequence)
+    label = Property(PTREC.label)
+
+
+class_ = {'dict': Event, 'slots': DeclarativeEvent}[sys.argv[1]]
+count = int(sys.argv[2])
+mapped = class_._mapper
+select = mapped.select.project(PROPERTIES, append=True)
+values = tuple(Literal(i) for i in range(len(PROPERTIES)))
+ids = [URIRef('http://example.org/event/%d' % (i,)) for i in range(count)]
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+instances = list(mapped.bind_results(None, select,
+                                     ((id,) + values for id in ids)))
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print((after - before) * 1024.0 / count)
+"""
+
+
+def run(count):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    for layout in ('dict', 'slots'):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SOURCE, layout, str(count)], env=env)
+        print('%-6s %8.1f bytes/instance' % (layout, float(output)))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,83 @@
+"""
+Measure the time taken to produce the query of the ptrec example for one
+cohort line: building and compiling it, compiling it once built, binding
+the values of a prepared query, and calling its generated binder.
+
+Usage: python benchmarks/prepared_binding.py [count]
+
+"""
+from __future__ import print_function
+import sys
+import timeit
+from datetime import datetime, timedelta
+from rdflib import Literal, Namespace
+from sparqlquery.sparql.helpers import v, param, is_a, XSD
+from sparqlquery.sparql.queryforms import Select
+
+PTREC = Namespace('tag:info@semanticdb.ccf.org,2007:PatientRecordTerms#')
+DNODE = Namespace('http://www.clevelandclinic.org/heartcenter/ontologies/'
+                  'DataNodes.owl#')
+PREFIX_MAP = {PTREC: 'ptrec', DNODE: 'dnode'}
+
+
+def build(ccfid, surg_min, surg_max, index):
+    return Select([v.event, v.start_min, v.start_max]).where(
+        v.record[is_a: PTREC.PatientRecord,
+                 DNODE.contains: v.patient,
+                 DNODE.contains: v.event],
+        v.patient[is_a: PTREC.Patient,
+                  PTREC.hasCCFID: ccfid],
+        v.event[is_a: PTREC.Event_management_operation,
+                DNODE.contains: v.start],
+        v.start[is_a: PTREC.EventStartDate,
+                PTREC.hasDateTimeMin: v.start_min,
+                PTREC.hasDateTimeMax: v.start_max]
+    ).filter(
+        v.start_min >= surg_min, v.start_max < surg_max
+    ).order_by(v.start_min).limit(1).offset(index)
+
+
+def cohort(count):
+    start = datetime(1999, 3, 1)
+    # Offsets start at 1: a bound OFFSET 0 is rendered, a literal one not.
+    return [(Literal('%08d' % (i,), datatype=XSD.string),
+             start + timedelta(days=i), start + timedelta(days=i + 1),
+             i % 3 + 1)
+            for i in range(count)]
+
+
+def run(count):
+    lines = cohort(count)
+    template = build(param.ccfid, param.surg_min, param.surg_max, param.index)
+    prepared = template.prepare(PREFIX_MAP)
+    generated = template.prepare(PREFIX_MAP, generate=True).function
+    built = [build(*line) for line in lines]
+    assert generated(*lines[0]) == built[0].compile(PREFIX_MAP)
+
+    def build_and_compile():
+        for line in lines:
+            build(*line).compile(PREFIX_MAP)
+
+    def compile_built():
+        for query in built:
+            query.compile(PREFIX_MAP)
+
+    def bind():
+        for ccfid, surg_min, surg_max, index in lines:
+            prepared.bind(ccfid=ccfid, surg_min=surg_min, surg_max=surg_max,
+                          index=index)
+
+    def call_generated():
+        for line in lines:
+            generated(*line)
+
+    for label, function in [('build and compile()', build_and_compile),
+                            ('compile() built query', compile_built),
+                            ('PreparedQuery.bind()', bind),
+                            ('generated binder', call_generated)]:
+        best = min(timeit.repeat(function, number=1, repeat=5))
+        print('%-24s %8.1f us/query' % (label, best / count * 1e6))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
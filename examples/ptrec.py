@@ -9,6 +9,7 @@ except ImportError:
 
 from sparqlquery import *
 from sparqlquery.sparql.helpers import subject
+from sparqlquery.sparql.registry import QueryRegistry
 from sparqlquery.mapper.properties import *
 from sparqlquery.mapper import *
 from sparqlquery.mapper.declarative import Subject
@@ -45,6 +46,29 @@ class Event(Subject):
         return "Event(%r)" % (self.type,)
 
 graph = ConjunctiveGraph()
+queries = QueryRegistry(PREFIX_MAP)
+
+@queries.query('index_event')
+def index_event_query():
+    """
+    Operation events of the patient `ccfid` starting between `surg_min` and
+    `surg_max`, skipping the first `index` of them.
+
+    """
+    return Select([v.event, v.start_min, v.start_max]).where(
+        v.record[is_a: PTREC.PatientRecord,
+                 DNODE.contains: v.patient,
+                 DNODE.contains: v.event],
+        v.patient[is_a: PTREC.Patient,
+                  PTREC.hasCCFID: param.ccfid],
+        v.event[is_a: PTREC.Event_management_operation,
+                DNODE.contains: v.start],
+        v.start[is_a: PTREC.EventStartDate,
+                PTREC.hasDateTimeMin: v.start_min,
+                PTREC.hasDateTimeMax: v.start_max]
+    ).filter(
+        v.start_min >= param.surg_min, v.start_max < param.surg_max
+    ).order_by(v.start_min).limit(1).offset(param.index)
 
 def get_index_event(cohort_line, graph=graph):
     """
@@ -71,25 +95,12 @@ def get_index_event(cohort_line, graph=graph):
     rdf_file = os.path.join(rdf_dir, '%s.rdf' % ccfid)
     graph.load(rdf_file, publicID=ccfid)
 
-    # Construct the query.
-    query = Select([v.event, v.start_min, v.start_max]).where(
-        v.record[is_a: PTREC.PatientRecord,
-                 DNODE.contains: v.patient,
-                 DNODE.contains: v.event],
-        v.patient[is_a: PTREC.Patient,
-                  PTREC.hasCCFID: Literal(ccfid, datatype=XSD.string)],
-        v.event[is_a: PTREC.Event_management_operation,
-                DNODE.contains: v.start],
-        v.start[is_a: PTREC.EventStartDate,
-                PTREC.hasDateTimeMin: v.start_min,
-                PTREC.hasDateTimeMax: v.start_max]
-    ).filter(
-        v.start_min >= surg_min, v.start_max < surg_max
-    ).order_by(v.start_min).limit(1).offset(index)
-
-    print(query.compile(PREFIX_MAP))
+    # The query is compiled on first use only.
+    parameters = dict(ccfid=Literal(ccfid, datatype=XSD.string),
+                      surg_min=surg_min, surg_max=surg_max, index=index)
+    print(queries.compile('index_event', **parameters))
     # Return the query results.
-    return query.execute(graph, PREFIX_MAP)
+    return queries.execute('index_event', graph, **parameters)
 
 def main():
     import sys, pprint
@@ -97,6 +108,7 @@ def main():
     res = get_index_event(" ".join(sys.argv[1:]))
     print(pprint.pformat(vars(res)))
     print(pprint.pformat([x for x in res]))
+    print(pprint.pformat(queries.stats()))
 
 if __name__ == "__main__":
     main()
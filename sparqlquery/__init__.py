@@ -1,7 +1,13 @@
+# Keep in sync with setup.py.
+__version__ = '0.2.2'
+
 import rdflib  # noqa
 from rdflib import ConjunctiveGraph, Namespace, Variable  # noqa
 from rdflib import URIRef, Literal, BNode  # noqa
 
+# The compiler and the mapper are imported on first use; keep them out of
+# this module so that `import sparqlquery` stays cheap (see
+# tests/test_imports.py and benchmarks/import_time.py).
 from sparqlquery.sparql.expressions import Expression  # noqa
 from sparqlquery.sparql.queryforms import *  # noqa
 from sparqlquery.sparql.helpers import *  # noqa
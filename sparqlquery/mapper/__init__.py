@@ -3,6 +3,8 @@ from sparqlquery.exceptions import InvalidRequestError
 from sparqlquery.sparql.queryforms import Select
 from sparqlquery.sparql.helpers import is_a
 from sparqlquery.mapper.properties import PropertyManager
+from sparqlquery.mapper.loading import add_related, relationship_loader
+from sparqlquery.mapper.loading import column_positions
 
 
 __all__ = ['Mapper', 'mapper', 'get_mapper']
@@ -16,10 +18,12 @@ class Mapper(object):
             identifier = Variable(class_.__name__)
         self.identifier = identifier
         
+        # The class's RDF type, stated by the instances a session inserts.
+        self.rdf_type = None
         if isinstance(type_or_select, Select):
             select = type_or_select
         else:
-            rdf_type = type_or_select
+            rdf_type = self.rdf_type = type_or_select
             select = Select([identifier], [(identifier, is_a, rdf_type)])
         
         if identifier not in select.projection:
@@ -34,22 +38,124 @@ class Mapper(object):
         self.class_._manager.update(properties)
     
     def new_instance(self):
-        return self.class_.__new__(self.class_)
+        instance = self.class_.__new__(self.class_)
+        if getattr(self.class_, '_layout', None) is None:
+            instance.__dict__['_state'] = {}
+        return instance
     
     def bind_instance(self, graph, instance, data):
         instance._id = data.pop(self.identifier)
-        for key, value in data.iteritems():
-            descriptor = self.class_._manager.get(key)
+        for name, value in data.iteritems():
+            descriptor = self.class_._manager.get(name)
             if descriptor is not None:
                 value = descriptor.to_python(graph, value)
-                descriptor.__set__(instance, value)
+                descriptor.set_value(instance, value)
     
-    def bind_results(self, graph, query, results):
-        for result in results:
-            data = dict(zip(query.projection, result))
-            instance = self.new_instance()
-            self.bind_instance(graph, instance, data)
-            yield instance
+    def binder(self, graph, positions, identity_map, loader=None):
+        """
+        Return a function returning the instance identified in a result row,
+        taken from `identity_map` or bound from the row (and added to
+        `loader`), or None if the identifier is unbound.
+
+        `positions` are the positions in rows of the identifier and property
+        variables.  Which descriptor each position goes to is worked out once
+        here, and the converter of each column once its first value that is
+        not None is seen (see `Term.converter()`), so binding a row only
+        reads it by position and assigns the converted values to the
+        instance's state.
+
+        """
+        class_ = self.class_
+        new_instance = self.new_instance
+        index = positions[self.identifier]
+        descriptors = [(positions[name], descriptor)
+                       for name, descriptor in class_._manager
+                       if name in positions and name != self.identifier]
+        setters = [(position, descriptor.state_key(),
+                    descriptor.converter(graph, None))
+                   for position, descriptor in descriptors]
+        # The columns whose converter is not resolved yet.
+        pending = range(len(setters))
+        
+        def resolve(row):
+            for i in list(pending):
+                position, descriptor = descriptors[i]
+                value = row[position]
+                if value is not None:
+                    setters[i] = (position, descriptor.state_key(),
+                                  descriptor.converter(graph, value))
+                    pending.remove(i)
+        
+        def bind(row):
+            id = row[index]
+            if id is None:
+                return None
+            key = (class_, id)
+            instance = identity_map.get(key)
+            if instance is None:
+                if pending:
+                    resolve(row)
+                instance = identity_map[key] = new_instance()
+                instance._id = id
+                state = instance._state
+                for position, state_key, convert in setters:
+                    state[state_key] = convert(row[position])
+                if loader is not None:
+                    loader.add(instance)
+            return instance
+        return bind
+    
+    def bind_results(self, graph, query, results, loader=None,
+                     identity_map=None, joined=()):
+        """
+        Return the instances bound from the `results` of `query`, one for
+        each distinct identifier.
+
+        Instances already in `identity_map` are returned as they are.
+        `joined` are the relationships whose related instances `query` also
+        selects, as pairs of the descriptor and its columns (see
+        `Relationship.pattern()`).
+
+        """
+        if identity_map is None:
+            identity_map = {}
+        instances = self._bind_results(graph, query, results, loader,
+                                       identity_map, joined)
+        if joined:
+            # The instances related to an instance may be in any row.
+            instances = iter(list(instances))
+        return instances
+    
+    def _bind_results(self, graph, query, results, loader, identity_map,
+                      joined):
+        positions = dict((variable, i)
+                         for i, variable in enumerate(query.projection))
+        index = positions[self.identifier]
+        bind = self.binder(graph, positions, identity_map, loader)
+        related_binders = []
+        for descriptor, columns in joined:
+            related = descriptor.class_._mapper
+            related_binders.append(related.binder(
+                graph, column_positions(positions, columns), identity_map,
+                relationship_loader(related, graph, identity_map)))
+        seen = set()
+        # The joined relationships set from these results, by identifier.
+        joining = {}
+        for row in results:
+            instance = bind(row)
+            id = row[index]
+            if id not in seen:
+                seen.add(id)
+                joining[id] = []
+                for i, (descriptor, columns) in enumerate(joined):
+                    if not descriptor.loaded(instance):
+                        descriptor.set_value(instance, [])
+                        joining[id].append(i)
+                yield instance
+            for i in joining[id]:
+                related = related_binders[i](row)
+                if related is not None:
+                    add_related(joined[i][0], instance, related)
 
 
 def mapper(class_, *args, **kwargs):
@@ -1,9 +1,55 @@
+"""
+Declarative mapping: subclasses of `Subject` declare their properties as
+`Term` class attributes, and are mapped to their `RDF_TYPE` if they have
+one.
+
+Instances of declarative classes keep the values of their properties in a
+`_state` list, with one position per property, instead of a dict keyed by
+descriptor.  Each class gets `__slots__` (unless it declares its own), so
+its instances have no `__dict__` either: a class whose instances need other
+attributes can declare `__slots__ = ('__dict__',)`, or name them.
+
+"""
+from copy import copy
 from sparqlquery.mapper import mapper
-from sparqlquery.mapper.properties import PropertyManager, Term
+from sparqlquery.mapper.properties import PropertyManager, Term, NO_VALUE
+
+
+def lay_out(cls, manager):
+    """
+    Return the properties of `cls` in the order of their values in the
+    `_state` of its instances, giving each its position.
+
+    Properties inherited from the first declarative base keep their
+    position; others, if laid out for another class already, are replaced
+    with a copy.
+
+    """
+    layout = []
+    for base in cls.__mro__[1:]:
+        if '_layout' in vars(base):
+            layout = list(base._layout)
+            break
+    for key, descriptor in sorted(manager):
+        index = descriptor.index
+        if index is not None and index < len(layout) and \
+                layout[index] is descriptor:
+            continue
+        if index is not None:
+            descriptor = copy(descriptor)
+            manager.add_property(key, descriptor)
+        descriptor.index = len(layout)
+        layout.append(descriptor)
+    return tuple(layout)
 
 
 class DeclarativeMeta(type):
+    def __new__(meta, name, bases, attrs):
+        attrs.setdefault('__slots__', ())
+        return super(DeclarativeMeta, meta).__new__(meta, name, bases, attrs)
+
     def __init__(cls, name, bases, attrs):
+        super(DeclarativeMeta, cls).__init__(name, bases, attrs)
         manager = cls._manager = PropertyManager(cls)
         for base in reversed(bases):
             if hasattr(base, '_manager'):
@@ -11,14 +57,16 @@ class DeclarativeMeta(type):
         for key, value in attrs.iteritems():
             if isinstance(value, Term):
                 manager.add_property(key, value)
+        cls._layout = lay_out(cls, manager)
         if hasattr(cls, 'RDF_TYPE'):
             mapper(cls, cls.RDF_TYPE)
 
 
 class Subject(object):
     __metaclass__ = DeclarativeMeta
-    
+    __slots__ = ('_id', '_state', '_loader', '_changes', '__weakref__')
+
     def __new__(cls, *args, **kwargs):
-        instance = object.__new__(cls, *args, **kwargs)
-        cls._mapper.setup_instance(instance)
+        instance = object.__new__(cls)
+        instance._state = [NO_VALUE] * len(cls._layout)
         return instance
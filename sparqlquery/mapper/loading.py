@@ -0,0 +1,172 @@
+"""
+Loading of the deferred properties and relationships of mapped instances.
+
+The instances bound from the results of a query share a `DeferredLoader`,
+which loads a deferred property for all of them at once, when it is first
+accessed on one of them.
+
+`load_related()` loads the instances related to a batch of instances by a
+`Relationship` with a single query, whose VALUES block binds the identifiers
+of the batch (see `matching()`).  Related instances are taken from (or added to) an identity
+map, so an instance related to several others is bound once.
+
+"""
+import weakref
+from rdflib import BNode
+from sparqlquery.mapper.properties import Relationship
+from sparqlquery.sparql.helpers import values
+from sparqlquery.sparql.queryforms import Select
+
+__all__ = ['DeferredLoader', 'load_related']
+
+
+class DeferredLoader(object):
+    """
+    Loads the `deferred` properties of the instances of `mapper`'s class
+    bound from the results of `select`.
+
+    """
+
+    def __init__(self, select, graph, mapper, deferred, identity_map=None):
+        self.select = select
+        self.graph = graph
+        self.mapper = mapper
+        self.deferred = set(deferred)
+        if identity_map is None:
+            identity_map = {}
+        self.identity_map = identity_map
+        self.instances = []
+
+    def add(self, instance):
+        instance._loader = self
+        self.instances.append(weakref.ref(instance))
+
+    def load(self, descriptor):
+        """
+        Load the values of `descriptor` for all the instances still alive, and
+        return whether it was deferred.
+
+        """
+        manager = self.mapper.class_._manager
+        name = manager.names.get(descriptor)
+        if name not in self.deferred:
+            return False
+        self.deferred.discard(name)
+        instances = [instance for instance in
+                     (ref() for ref in self.instances)
+                     if instance is not None]
+        if isinstance(descriptor, Relationship):
+            load_related(self.graph, self.mapper, self.select, instances,
+                         name, descriptor, self.identity_map)
+            return True
+        identifier = self.mapper.identifier
+        ids = set(instance._id for instance in instances)
+        patterns = matching(self.select, identifier, ids)
+        patterns.extend(descriptor.triples(identifier, name))
+        select = Select([identifier, name]).where(*patterns)
+        found = {}
+        for id, value in select.execute(self.graph):
+            found.setdefault(id, value)
+        for instance in instances:
+            if descriptor.loaded(instance):
+                continue
+            value = found.get(instance._id)
+            if value is None:
+                descriptor.set_value(instance, descriptor.default)
+            else:
+                descriptor.set_value(instance,
+                                     descriptor.to_python(self.graph, value))
+        return True
+
+
+def unordered(select):
+    """
+    Return `select` without solution modifiers, for queries matching their
+    results to instances by identifier.
+
+    """
+    return select._clone(_order_by=None, _limit=None, _offset=None)
+
+
+def matching(select, identifier, ids):
+    """
+    Return graph patterns binding `identifier` to the identifiers `ids` of
+    instances bound from the results of `select`.
+
+    Blank nodes cannot be bound in a VALUES block, so if any of `ids` is
+    one, the patterns match the identifiers `select` selects instead: with
+    its LIMIT and OFFSET, if it has any, in a subquery.
+
+    """
+    if not any(isinstance(id, BNode) for id in ids):
+        return [values(identifier, list(ids))]
+    if select._limit is None and select._offset is None:
+        return [unordered(select)._where]
+    return [select.project(identifier).distinct()]
+
+
+def relationship_loader(mapper, graph, identity_map):
+    """
+    Return a `DeferredLoader` of the relationships of `mapper`'s class for
+    instances bound from its select, or None if it has none.
+
+    """
+    names = [name for name, property in mapper.class_._manager
+             if isinstance(property, Relationship)]
+    if not names:
+        return None
+    return DeferredLoader(mapper.select, graph, mapper, names, identity_map)
+
+
+def column_positions(positions, columns):
+    """
+    Return the positions in rows of the identifier and property variables
+    of a related mapper, given the `positions` of the variables of a query
+    and the `columns` of a relationship in it (see `Relationship.pattern()`).
+
+    """
+    return dict((variable, positions[column]) for column, variable in columns)
+
+
+def add_related(relationship, instance, related):
+    """Add `related` to the instances related to `instance`."""
+    related_instances = relationship.__get__(instance, None)
+    if not any(value is related for value in related_instances):
+        related_instances.append(related)
+
+
+def load_related(graph, mapper, select, instances, name, relationship,
+                 identity_map):
+    """
+    Load the instances related to `instances` by `relationship` (the property
+    `name` of `mapper`'s class) with one query, and set them.
+
+    The query matches the instances with `matching()`, given `select`, the
+    query they were bound from.  Instances whose relationship is already
+    loaded are left as they are.
+
+    """
+    instances = [instance for instance in instances
+                 if not relationship.loaded(instance)]
+    if not instances:
+        return
+    batch = {}
+    for instance in instances:
+        relationship.set_value(instance, [])
+        batch.setdefault(instance._id, []).append(instance)
+    identifier = mapper.identifier
+    pattern, columns = relationship.pattern(identifier, name)
+    projection = [identifier] + [column for column, variable in columns]
+    patterns = matching(select, identifier, batch)
+    query = Select(projection).where(*(patterns + [pattern]))
+    related = relationship.class_._mapper
+    positions = dict((variable, i)
+                     for i, variable in enumerate(query.projection))
+    bind = related.binder(graph, column_positions(positions, columns),
+                          identity_map,
+                          relationship_loader(related, graph, identity_map))
+    parent = positions[identifier]
+    for row in query.execute(graph):
+        related_instance = bind(row)
+        for instance in batch.get(row[parent], ()):
+            add_related(relationship, instance, related_instance)
@@ -1,34 +1,128 @@
+import weakref
 from sparqlquery import Namespace, Literal, URIRef, Variable
-from sparqlquery.sparql.patterns import Triple
+from rdflib.term import Identifier
+from sparqlquery.exceptions import InvalidRequestError
+from sparqlquery.sparql.expressions import VariableExpression
+from sparqlquery.sparql.patterns import Triple, GroupGraphPattern
 
-__all__ = ['Term', 'Property', 'Label']
+__all__ = ['Term', 'Property', 'Label', 'Relationship']
 
 RDFS = Namespace('http://www.w3.org/2000/01/rdf-schema#')
 
 
+# The value of a property not set on an instance.
+NO_VALUE = object()
+
+# The instances with changes recorded (see `Term.__set__`), by their id(),
+# so that sessions go through them rather than their whole identity maps,
+# whatever the instances' own equality.
+changed_instances = weakref.WeakValueDictionary()
+
+
 class Term(object):
+    # The position of the value in the `_state` list of the instances of a
+    # declarative class (see `sparqlquery.mapper.declarative`), or None if
+    # instances keep their values in a `_state` dict, keyed by descriptor.
+    index = None
+    
     def __init__(self, predicate, default=None):
         self.predicate = predicate
         self.default = default
     
     def __get__(self, instance, owner):
         if instance is not None:
-            state = instance.__dict__.get('_state', {})
-            return state.get(self, self.default)
+            value = self.load_value(instance)
+            if value is NO_VALUE:
+                return self.default
+            return value
+        # On a mapped class, the variable the property is bound to in
+        # queries, to build constraints with.
+        manager = getattr(owner, '_manager', None)
+        if manager is not None and self in manager.names:
+            return VariableExpression(manager.names[self])
         return self
     
     def __set__(self, instance, value):
-        state = instance.__dict__.setdefault('_state', {})
-        state[self] = value
+        # Record the value the instance was loaded with, for the session to
+        # write the change (see `sparqlquery.mapper.session`).
+        changes = getattr(instance, '_changes', None)
+        if changes is None:
+            changes = instance._changes = {}
+            changed_instances[id(instance)] = instance
+        if self not in changes:
+            changes[self] = self.load_value(instance)
+        self.set_value(instance, value)
+    
+    def set_value(self, instance, value):
+        """Set `value` on `instance` without recording a change."""
+        if self.index is None:
+            instance.__dict__.setdefault('_state', {})[self] = value
+        else:
+            instance._state[self.index] = value
+    
+    def get_value(self, instance):
+        """Return the value set on `instance`, or `NO_VALUE`."""
+        if self.index is None:
+            return instance.__dict__.get('_state', {}).get(self, NO_VALUE)
+        return instance._state[self.index]
+    
+    def load_value(self, instance):
+        """
+        Return the value set on `instance`, loading it first if it was
+        deferred by the query the instance was loaded with, or `NO_VALUE`.
+
+        """
+        value = self.get_value(instance)
+        if value is NO_VALUE:
+            loader = getattr(instance, '_loader', None)
+            if loader is not None and loader.load(self):
+                value = self.get_value(instance)
+        return value
+    
+    def state_key(self):
+        """Return the key of this property in the `_state` of instances."""
+        if self.index is None:
+            return self
+        return self.index
+    
+    def loaded(self, instance):
+        """Return whether a value of this property is set on `instance`."""
+        return self.get_value(instance) is not NO_VALUE
     
     def to_python(self, graph, value):
         return value
     
+    def converter(self, graph, value):
+        """
+        Return a function converting the values of a result column, as
+        `to_python` does, given `value`, the first of them that is not None.
+
+        It is resolved once per column of the results of a query, so that
+        converting each value does not dispatch on its kind again.
+
+        """
+        to_python = self.to_python
+        return lambda value: to_python(graph, value)
+    
+    def to_rdf(self, value):
+        return value
+    
     def resolve_subject(self, graph, uri):
         return uri
     
     def triples(self, subject, object):
         yield Triple(subject, self.predicate, object)
+    
+    def data_triples(self, subject, value):
+        """
+        Return the triples stating `value` of this property of `subject`, as
+        tuples of terms.
+
+        """
+        if value is None or value is NO_VALUE:
+            return []
+        return [tuple(triple)
+                for triple in self.triples(subject, self.to_rdf(value))]
 
 
 class Property(Term):
@@ -43,6 +137,38 @@ class Property(Term):
             return self.resolve_subject(graph, value)
         else:
             return value
+    
+    def converter(self, graph, value):
+        to_python = self.to_python
+        if getattr(to_python, 'im_func', None) is not _to_python:
+            return super(Property, self).converter(graph, value)
+        if isinstance(value, Literal):
+            # rdflib parses typed literals into their Python value when it
+            # builds them; the value is None for lexical forms it could not
+            # parse and for unknown datatypes.
+            def convert(value):
+                if value.__class__ is Literal:
+                    python = value.value
+                    if python is not None:
+                        return python
+                return to_python(graph, value)
+            return convert
+        if isinstance(value, URIRef) and \
+                self.resolve_subject.im_func is Term.resolve_subject.im_func:
+            def convert(value):
+                if value.__class__ is URIRef:
+                    return value
+                return to_python(graph, value)
+            return convert
+        return super(Property, self).converter(graph, value)
+    
+    def to_rdf(self, value):
+        if isinstance(value, Identifier):
+            return value
+        return Literal(value)
+
+
+_to_python = Property.to_python.im_func
 
 
 class Label(Property):
@@ -53,19 +179,70 @@ class Label(Property):
 
 
 class Relationship(Property):
-    def __init__(self, class_, predicate):
+    """
+    A property whose value is the list of instances of `class_` that are
+    objects of `predicate`.
+
+    `loading` is how they are loaded with the instances having this
+    property: 'joined' in the same query, or 'batched' in one more query for
+    all of them.  Related instances are loaded with their properties, but
+    their own relationships are loaded when first accessed.
+
+    """
+    LOADING = ('joined', 'batched')
+    
+    def __init__(self, class_, predicate, loading='batched'):
+        if loading not in self.LOADING:
+            raise InvalidRequestError("Unknown loading strategy: %r." %
+                                      (loading,))
         self.class_ = class_
         self.predicate = predicate
+        self.loading = loading
+        self.default = None
     
     def __get__(self, instance, owner):
-        if instance is not None:
-            state = instance.__dict__.get('_state', {})
-            return state.get(self, [])
-        return self
+        value = super(Relationship, self).__get__(instance, owner)
+        if value is None:
+            return []
+        return value
     
-    def triples(self, subject, object):
-        related_mapper = self.class_._mapper
-        related_mapper.select._clone(variables=(related_mapper.identifier,))
+    def to_python(self, graph, value):
+        return value
+    
+    def data_triples(self, subject, value):
+        if value is None or value is NO_VALUE:
+            return []
+        return [tuple(triple) for related in value
+                for triple in self.triples(subject, related._id)]
+    
+    def pattern(self, subject, name):
+        """
+        Return a graph pattern relating `subject` to the instances of
+        `class_` with their properties, and its columns: pairs of a variable
+        of the pattern and the identifier or property variable of the
+        related mapper it is bound to.
+
+        The variables of the related mapper's select are prefixed with `name`
+        and two underscores, so that they do not clash with those of the
+        query `subject` is in.
+
+        """
+        from sparqlquery.sparql.canonical import rename, variables
+        related = self.class_._mapper
+        identifier = related.identifier
+        pattern = related.select._where._clone()
+        columns = [identifier]
+        for key, property in self.class_._manager:
+            if not isinstance(property, Relationship):
+                columns.append(key)
+                pattern.pattern(*property.triples(identifier, key))
+        names = dict((variable, Variable('%s__%s' % (name, variable)))
+                     for variable in variables(pattern))
+        pattern = GroupGraphPattern([
+            Triple(subject, self.predicate, names[identifier]),
+            rename(pattern, names)
+        ])
+        return pattern, [(names[column], column) for column in columns]
         
 
 class PropertyManager(object):
@@ -1,4 +1,10 @@
-from sparqlquery import Variable
+from sparqlquery import Variable, BNode
+from sparqlquery.exceptions import InvalidRequestError
+from sparqlquery.mapper.properties import Relationship
+from sparqlquery.mapper.loading import DeferredLoader, load_related
+from sparqlquery.sparql.queryforms import Ask, Select
+from sparqlquery.sparql.helpers import op
+from sparqlquery.sparql.canonical import variables
 
 
 class Query(object):
@@ -6,6 +12,9 @@ class Query(object):
         self.class_ = class_
         self.session = session
         self.select = class_._mapper.select
+        self.deferred = frozenset()
+        # Properties whose triples are in `select` already.
+        self.constrained = frozenset()
     
     def __iter__(self):
         return self.execute()
@@ -16,24 +25,243 @@ class Query(object):
         clone.__dict__.update(kwargs)
         return clone
     
-    def execute(self, graph=None):
+    def _get_graph(self, graph):
         if graph is None:
             graph = self.session.graph
+        return graph
+    
+    def _get_identity_map(self):
+        if self.session is None:
+            return {}
+        return self.session.identity_map
+    
+    def _paged(self):
+        return self.select._limit is not None or \
+            self.select._offset is not None
+    
+    def _identifiers(self, *variables):
+        """
+        Return a subquery of the distinct identifiers (and `variables`)
+        matching this query, with its solution modifiers.
+
+        """
+        identifier = self.class_._mapper.identifier
+        return self.select.project(identifier, *variables).distinct()
+    
+    def _select(self):
+        """
+        Return the select to add the property triples to, and the properties
+        whose triples it has.
+
+        If this query has a LIMIT or OFFSET, they apply to the identifiers
+        selected by a subquery, rather than to rows (of which there may be
+        several per instance).
+
+        """
+        if not self._paged():
+            return self.select, self.constrained
+        identifier = self.class_._mapper.identifier
+        order_by = self.select._order_by or ()
+        ordering = [variable for variable in variables(order_by)
+                    if variable != identifier]
+        select = Select([identifier], order_by=self.select._order_by)
+        return select.where(self._identifiers(*ordering)), frozenset()
+    
+    def execute(self, graph=None):
+        """
+        Return the instances matching this query in `graph` (or the
+        session's graph).
+
+        Related instances are loaded as their `Relationship` says: 'joined'
+        relationships in the same query, in an OPTIONAL group, and 'batched'
+        ones with one more query each, once all the instances are bound.
+
+        """
+        graph = self._get_graph(graph)
         # manager = self.class_._manager
         mapper = self.class_._mapper
-        variables = map(Variable, self.class_._manager.properties)
+        identity_map = self._get_identity_map()
+        select, constrained = self._select()
+        variables = []
         triples = []
+        patterns = []
+        joined = []
+        batched = []
         for name, property in self.class_._manager:
-            triples.extend(property.triples(mapper.identifier, Variable(name)))
-        select = self.select.project(variables, append=True).where(*triples)
+            if name in self.deferred:
+                continue
+            elif not isinstance(property, Relationship):
+                variables.append(name)
+                if name not in constrained:
+                    triples.extend(property.triples(mapper.identifier, name))
+            elif property.loading == 'joined':
+                pattern, columns = property.pattern(mapper.identifier, name)
+                variables.extend(column for column, variable in columns)
+                patterns.append(pattern)
+                joined.append((property, columns))
+            else:
+                batched.append((name, property))
+        select = select.project(variables, append=True).where(*triples)
+        for pattern in patterns:
+            select = select.where(pattern, optional=True)
         results = select.execute(graph)
-        return mapper.bind_results(graph, select, results)
+        loader = None
+        if self.deferred:
+            loader = DeferredLoader(self.select, graph, mapper, self.deferred,
+                                    identity_map)
+        instances = mapper.bind_results(graph, select, results, loader,
+                                        identity_map, joined)
+        if loader is not None:
+            # A deferred property is loaded for the instances bound when it
+            # is first accessed, so they must all be bound by then.
+            instances = iter(list(instances))
+        if batched:
+            instances = list(instances)
+            for name, relationship in batched:
+                load_related(graph, mapper, self.select, instances, name,
+                             relationship, identity_map)
+            instances = iter(instances)
+        return instances
+    
+    def count(self, graph=None):
+        """Return the number of distinct matching subjects.
+
+        Only the identifier is counted, at the store; no property columns
+        are fetched and no instances are constructed.
+
+        """
+        graph = self._get_graph(graph)
+        mapper = self.class_._mapper
+        count = op.count(mapper.identifier, distinct=True).as_(
+            Variable('count'))
+        if self._paged():
+            select = Select([count]).where(self._identifiers())
+        else:
+            select = self.select.project(count)
+        for result in select.execute(graph):
+            return result[0].toPython()
+        return 0
+    
+    def exists(self, graph=None):
+        """Return whether any subject matches, using an ASK query."""
+        graph = self._get_graph(graph)
+        if self._paged():
+            ask = Ask([self._identifiers()])
+        else:
+            ask = Ask(self.select._where._clone())
+        return bool(ask.execute(graph))
+
+    def _names(self, names):
+        properties = self.class_._manager.properties
+        names = set(map(Variable, names))
+        for name in names:
+            if name not in properties:
+                raise InvalidRequestError("%s has no property %r." %
+                                          (self.class_.__name__, str(name)))
+        return names
+
+    def load_only(self, *names):
+        """
+        Return a new `Query` loading only the properties named `names`; the
+        others are deferred (see `defer()`).
+
+        """
+        names = self._names(names)
+        properties = self.class_._manager.properties
+        return self._clone(deferred=frozenset(name for name in properties
+                                              if name not in names))
+
+    def defer(self, *names):
+        """
+        Return a new `Query` not loading the properties named `names`.
+
+        A deferred property is loaded when it is first accessed on one of
+        the instances returned by the query, for all of them at once.  Unlike
+        loaded properties, it does not exclude the instances without a value
+        for it.
+
+        """
+        return self._clone(deferred=self.deferred | self._names(names))
+    
+    def _constrain(self, select, constrained, expressions):
+        """
+        Add to `select` the triples of the properties used in `expressions`
+        that it does not have yet, and return it with the properties whose
+        triples it then has.
+
+        """
+        manager = self.class_._manager
+        identifier = self.class_._mapper.identifier
+        constrained = set(constrained)
+        triples = []
+        for variable in variables(expressions):
+            property = manager.properties.get(variable)
+            if property is not None and variable not in constrained and \
+                    not isinstance(property, Relationship):
+                constrained.add(variable)
+                triples.extend(property.triples(identifier, variable))
+        if triples:
+            select = select.where(*triples)
+        return select, frozenset(constrained)
     
     def filter(self, *constraints, **kwargs):
-        # manager = self.class_._manager
-        # mapper = self.class_._mapper
+        """
+        Return a new `Query` for the instances matching `constraints` and
+        with the property values in `kwargs`, both evaluated at the store.
+
+        Constraints are expressions on the mapped properties (the class
+        attributes, like `Person.name`, are the variables they are bound
+        to), added in a FILTER.  Keyword arguments name properties and are
+        matched with triple patterns; mapped instances match by identifier.
+        None and blank nodes (including the identifiers of instances) cannot
+        be matched this way, and raise `InvalidRequestError`.
+
+        """
+        manager = self.class_._manager
+        identifier = self.class_._mapper.identifier
         triples = []
-        for key, value in kwargs.iteritems():
-            property = self.class_._manager[key]
-            triples.extend(property.triples(self.class_))
-        return self._clone(select=self.select.filter())
+        for key in sorted(kwargs):
+            value = kwargs[key]
+            property = manager.properties.get(Variable(key))
+            if property is None:
+                raise InvalidRequestError("%s has no property %r." %
+                                          (self.class_.__name__, key))
+            if value is None:
+                raise InvalidRequestError("Cannot filter %s on None (%s); "
+                                          "use an expression on the property "
+                                          "instead." % (self.class_.__name__,
+                                                        key))
+            if hasattr(type(value), '_mapper'):
+                value = value._id
+            if isinstance(value, BNode):
+                # A blank node in a triple pattern matches like a variable.
+                raise InvalidRequestError("Cannot filter %s on a blank node "
+                                          "(%s=%r)." % (self.class_.__name__,
+                                                        key, value))
+            triples.extend(property.triples(identifier, value))
+        select = self.select.where(*triples)
+        select, constrained = self._constrain(select, self.constrained,
+                                              constraints)
+        if constraints:
+            select = select.filter(*constraints)
+        return self._clone(select=select, constrained=constrained)
+    
+    def order_by(self, *expressions):
+        """
+        Return a new `Query` ordering the instances by `expressions` (see
+        `filter()`).  Instances without a value of a property used in them
+        are not returned.
+
+        """
+        select, constrained = self._constrain(self.select, self.constrained,
+                                              expressions)
+        return self._clone(select=select.order_by(*expressions),
+                           constrained=constrained)
+    
+    def limit(self, limit):
+        """Return a new `Query` returning at most `limit` instances."""
+        return self._clone(select=self.select.limit(limit))
+    
+    def offset(self, offset):
+        """Return a new `Query` skipping the first `offset` instances."""
+        return self._clone(select=self.select.offset(offset))
@@ -1,10 +1,215 @@
+"""
+Sessions: the identity map of the instances loaded by their queries, and
+the unit of work writing changes to their graph.
+
+A session tracks the instances added to it (`add()`), those deleted from it
+(`delete()`) and the instances it loaded whose properties were set since
+(the `Term` descriptors record the value an instance had before its first
+change, and keep the instances with changes in `changed_instances`, which
+sessions go through instead of their identity maps).  `flush()` writes all of them with DELETE DATA and INSERT DATA
+updates of only the triples that changed (see
+`sparqlquery.sparql.diff.data_updates`), sent in as few requests as an
+`UpdateBatch` allows:
+
+    person = session.query(Person).filter(name="Alice").execute().next()
+    person.nick = "al"
+    session.delete(other)
+    session.flush()
+
+Values are written as the terms `to_rdf()` of their property makes of
+them, so a value loaded from a literal with a language tag, or with
+another lexical form of its datatype, is not matched when it is deleted.
+Blank nodes are inserted as their skolem IRIs, and cannot be deleted.
+Only the values of an instance are deleted with it, not the triples of
+other subjects referring to it.  Relationships record a change when a new
+list of related instances is set, not when their list is changed in place.
+
+"""
+from collections import OrderedDict
+from itertools import chain
+from rdflib import BNode
+from sparqlquery.exceptions import InvalidRequestError
 from sparqlquery.mapper.query import Query
+from sparqlquery.mapper.properties import NO_VALUE, changed_instances
+from sparqlquery.sparql.batch import UpdateBatch
+from sparqlquery.sparql.diff import DELETE, INSERT, data_updates
+from sparqlquery.sparql.helpers import is_a
 
 
 class Session(object):
-    def __init__(self, graph=None):
+    """
+    The instances of mapped classes loaded from and written to `graph`.
+
+    Each DELETE DATA or INSERT DATA update `flush()` makes has at most
+    `max_triples` triples.
+
+    """
+
+    def __init__(self, graph=None, max_triples=1000):
         self.identity_map = {}
         self.graph = graph
-    
+        self.max_triples = max_triples
+        self.new = OrderedDict()
+        self.deleted = OrderedDict()
+
     def query(self, class_):
         return Query(class_, self)
+
+    def _key(self, instance):
+        id = getattr(instance, '_id', None)
+        if id is None:
+            raise InvalidRequestError("%r has no identifier." % (instance,))
+        return (type(instance), id)
+
+    def add(self, instance):
+        """
+        Add `instance` to the instances to insert on `flush()`.
+
+        An instance the session loaded (or already flushed) is left as it
+        is, its changes being written anyway.  One deleted since is kept
+        among the deleted instances too, so that the values it was loaded
+        with are deleted and its current values inserted.
+
+        """
+        key = self._key(instance)
+        current = self.identity_map.get(key, instance)
+        if current is not instance:
+            raise InvalidRequestError("Another instance identified by %s is "
+                                      "in the session." % (key[1],))
+        if key in self.identity_map and key not in self.deleted:
+            return
+        self.identity_map[key] = instance
+        self.new[key] = instance
+
+    def delete(self, instance):
+        """Add `instance` to the instances to delete on `flush()`."""
+        key = self._key(instance)
+        if self.new.pop(key, None) is not None and key not in self.deleted:
+            del self.identity_map[key]
+        else:
+            self.deleted[key] = instance
+
+    def _changed(self):
+        """
+        Return the instances of the session set since they were loaded,
+        with the triples to delete and insert for each.
+
+        """
+        changed = []
+        for key, instance in self._tracked():
+            if instance._changes and \
+                    key not in self.new and key not in self.deleted:
+                deleted, inserted = changed_triples(instance)
+                if deleted or inserted:
+                    changed.append((instance, deleted, inserted))
+        return changed
+
+    def _tracked(self):
+        """
+        Return the instances of the session with changes recorded, with
+        their keys in the identity map.
+
+        """
+        tracked = []
+        for instance in changed_instances.values():
+            id = getattr(instance, '_id', None)
+            key = (type(instance), id)
+            if id is not None and self.identity_map.get(key) is instance:
+                tracked.append((key, instance))
+        return tracked
+
+    @property
+    def dirty(self):
+        """The instances of the session with changes to write."""
+        return [instance for instance, deleted, inserted in self._changed()]
+
+    def changes(self):
+        """
+        Return the triples `flush()` would delete and insert, as lists of
+        tuples of terms.
+
+        """
+        deleted = []
+        inserted = []
+        for instance, changed_deleted, changed_inserted in self._changed():
+            deleted.extend(changed_deleted)
+            inserted.extend(changed_inserted)
+        for instance in self.deleted.itervalues():
+            deleted.extend(instance_triples(instance, original=True))
+        for instance in self.new.itervalues():
+            inserted.extend(instance_triples(instance))
+        for triple in deleted:
+            if any(isinstance(term, BNode) for term in triple):
+                raise InvalidRequestError("Blank nodes cannot be deleted with "
+                                          "DELETE DATA: %r." % (triple,))
+        # Triples both deleted and inserted are left as they are, so that
+        # the updates do not depend on their order.
+        both = set(deleted) & set(inserted)
+        if both:
+            deleted = [triple for triple in deleted if triple not in both]
+            inserted = [triple for triple in inserted if triple not in both]
+        return deleted, inserted
+
+    def flush(self, graph=None):
+        """
+        Write the changes of the session's instances to `graph` (or the
+        session's graph), and forget them.
+
+        """
+        if graph is None:
+            graph = self.graph
+        deleted, inserted = self.changes()
+        changes = chain(((DELETE, triple) for triple in deleted),
+                        ((INSERT, triple) for triple in inserted))
+        with UpdateBatch(graph) as batch:
+            for update in data_updates(changes, self.max_triples):
+                batch.add(update)
+        for key, instance in self._tracked():
+            instance._changes = None
+            changed_instances.pop(id(instance), None)
+        for key in self.deleted:
+            if key not in self.new:
+                self.identity_map.pop(key, None)
+        self.new.clear()
+        self.deleted.clear()
+
+
+def changed_triples(instance):
+    """
+    Return the triples to delete and to insert for the properties set on
+    `instance` since it was loaded.
+
+    """
+    id = instance._id
+    deleted = []
+    inserted = []
+    for descriptor, original in instance._changes.iteritems():
+        old = descriptor.data_triples(id, original)
+        new = descriptor.data_triples(id, descriptor.get_value(instance))
+        deleted.extend(triple for triple in old if triple not in new)
+        inserted.extend(triple for triple in new if triple not in old)
+    return deleted, inserted
+
+
+def instance_triples(instance, original=False):
+    """
+    Return the triples stating the type and the property values of
+    `instance`, or, if `original` is true, the values it was loaded with.
+
+    Deferred values are loaded first.
+
+    """
+    class_ = type(instance)
+    id = instance._id
+    triples = []
+    rdf_type = class_._mapper.rdf_type
+    if rdf_type is not None:
+        triples.append((id, is_a, rdf_type))
+    changes = (original and getattr(instance, '_changes', None)) or {}
+    for name, descriptor in sorted(class_._manager):
+        value = changes.get(descriptor, NO_VALUE)
+        if value is NO_VALUE:
+            value = descriptor.load_value(instance)
+        triples.extend(descriptor.data_triples(id, value))
+    return triples
+
@@ -0,0 +1,94 @@
+"""
+Batches of updates executed together, in one request.
+
+SPARQL 1.1 Update requests may hold several operations separated by ';'.
+An `UpdateBatch` collects `SPARQLUpdateQuery`s (INSERT DATA, DELETE DATA,
+DELETE/INSERT WHERE...), compiles each as it is added, and sends them in one
+request under a single block of PREFIX declarations:
+
+    with UpdateBatch(graph, PREFIX_MAP) as batch:
+        for record in records:
+            batch.add(SPARQLUpdateQuery().insert(triples(record)))
+
+A batch flushes itself, sending the operations added so far, when adding
+one more would take it over `max_operations` operations or `max_size`
+characters; the operations of a request are executed in the order they
+were added, and requests in the order they were sent.
+
+"""
+from sparqlquery.sparql.compiler import get_compiler, join
+
+__all__ = ['UpdateBatch']
+
+
+class UpdateBatch(object):
+    """
+    Updates to execute on `graph`, compiled with `prefix_map`.
+
+    `requests` is the number of requests sent so far.  A batch used as a
+    context manager is flushed when the block exits without an exception.
+
+    """
+
+    def __init__(self, graph, prefix_map=None, max_operations=1000,
+                 max_size=1 << 20, compiler_class=None):
+        if compiler_class is None:
+            from sparqlquery.sparql.compiler import UpdateCompiler
+            compiler_class = UpdateCompiler
+        self.graph = graph
+        self.compiler = get_compiler(compiler_class, prefix_map)
+        self.max_operations = max_operations
+        self.max_size = max_size
+        self.requests = 0
+        self.operations = []
+        self._prologue = join(self.compiler.prefixes(), '\n')
+        self._size = len(self._prologue)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.flush()
+
+    def add(self, update):
+        """
+        Add `update` to the batch, first sending the operations added so far
+        if the batch would be too large with it.
+
+        """
+        compiled = self.compiler.compile(update, render_prefixes=False)
+        size = len(compiled) + 3
+        if self.operations and (
+                len(self.operations) >= self.max_operations or
+                self._size + size > self.max_size):
+            self.flush()
+        self.operations.append(compiled)
+        self._size += size
+        return self
+
+    def compile(self):
+        """Return the request of the operations added so far."""
+        return join([self._prologue, join(self.operations, ' ;\n')], '\n')
+
+    def flush(self):
+        """
+        Send the operations added so far in one request, if there are any.
+
+        If the request fails, the operations are kept, to be sent again by
+        the next `flush()`.
+
+        """
+        from sparqlquery.sparql.cache import invalidate
+        if not self.operations:
+            return
+        try:
+            self.graph.update(self.compile())
+        finally:
+            invalidate(self.graph)
+        self.operations = []
+        self._size = len(self._prologue)
+        self.requests += 1
@@ -0,0 +1,188 @@
+"""
+Caching query results per graph.
+
+A `ResultCache` stores the results of executing queries on graphs (or any
+other object with a `query()` method, like an endpoint handle), keyed by
+the query's fingerprint and the graph's version.  Pass one to
+`SPARQLQuery.execute()`:
+
+    cache = ResultCache(max_entries=256, ttl=60)
+    results = select.execute(graph, cache=cache)
+
+Every `SPARQLUpdateQuery.execute()` calls `invalidate()` on its graph,
+which bumps the graph's version and drops its results from every cache.
+Changes made to a graph by other means (like `Graph.add()`) are not
+tracked; call `invalidate()` after making them.
+
+Entries are evicted least recently used first, once there are more than
+`max_entries` of them or their estimated size exceeds `max_size` bytes, and
+expire `ttl` seconds after they were stored.
+
+"""
+import sys
+import time
+import threading
+import weakref
+from collections import OrderedDict
+from itertools import count
+
+__all__ = ['ResultCache', 'graph_version', 'invalidate', 'result_size']
+
+# Serial number and version of each graph seen, keyed by the graph's id
+# together with a weak reference to it: graphs compare by identifier, so
+# distinct graphs may be equal.  Graphs that cannot be weakly referenced are
+# kept alive while they are tracked, so that their id is not reused.
+_GRAPHS = {}
+_SERIALS = count()
+_LOCK = threading.Lock()
+
+# Caches to drop the results of invalidated graphs from.
+_CACHES = weakref.WeakSet()
+
+# Rough size of a triple in a CONSTRUCT or DESCRIBE result, in bytes.
+TRIPLE_SIZE = 400
+
+
+def _graph_state(graph):
+    key = id(graph)
+    entry = _GRAPHS.get(key)
+    if entry is not None and entry[0]() is graph:
+        return entry[1]
+    try:
+        ref = weakref.ref(graph, lambda ref: _forget(key, ref))
+    except TypeError:
+        ref = lambda: graph
+    state = [next(_SERIALS), 0]
+    _GRAPHS[key] = (ref, state)
+    return state
+
+
+def _forget(key, ref):
+    # Called when a graph is collected, maybe with `_LOCK` held.
+    entry = _GRAPHS.get(key)
+    if entry is not None and entry[0] is ref:
+        _GRAPHS.pop(key, None)
+
+
+def graph_version(graph):
+    """
+    Return a `(serial, version)` pair identifying the current contents of
+    `graph`, which changes whenever `invalidate(graph)` is called.
+
+    """
+    with _LOCK:
+        return tuple(_graph_state(graph))
+
+
+def invalidate(graph):
+    """Bump the version of `graph` and drop its results from every cache."""
+    with _LOCK:
+        state = _graph_state(graph)
+        state[1] += 1
+        serial = state[0]
+    for cache in list(_CACHES):
+        cache.discard_graph(serial)
+
+
+def result_size(result):
+    """Return a rough estimate of the memory used by `result`, in bytes."""
+    size = sys.getsizeof(result)
+    if getattr(result, 'type', None) == 'SELECT':
+        for row in result.bindings:
+            size += sys.getsizeof(row)
+            for value in row.itervalues():
+                size += sys.getsizeof(value)
+    elif getattr(result, 'graph', None) is not None:
+        size += len(result.graph) * TRIPLE_SIZE
+    return size
+
+
+class ResultCache(object):
+    """
+    A thread-safe cache of query results with LRU and TTL eviction.
+
+    `sizeof` estimates the size of a result in bytes (for `max_size`) and
+    `clock` returns the current time in seconds (for `ttl`).
+
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, max_size=None,
+                 sizeof=result_size, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.clock = clock
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Entries are (result, size, expiry time), least recently used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _CACHES.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, query, graph):
+        """Return the key of the results of `query` on `graph`."""
+        return graph_version(graph) + (query.fingerprint(),)
+
+    def execute(self, query, graph, prefix_map=None):
+        """
+        Return the cached results of `query` on `graph`, executing the query
+        and caching its results if there are none.
+
+        """
+        key = self.key(query, graph)
+        try:
+            return self.get(key)
+        except KeyError:
+            result = query.execute(graph, prefix_map)
+            self.set(key, result)
+            return result
+
+    def get(self, key):
+        """Return the result cached for `key`, or raise `KeyError`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and \
+                    entry[2] <= self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, result):
+        """Cache `result` for `key`, evicting other results as needed."""
+        size = self.sizeof(result)
+        if self.max_size is not None and size > self.max_size:
+            return
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, expires)
+            self.size += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_size is not None and self.size > self.max_size):
+                self._remove(next(iter(self._entries)))
+
+    def discard_graph(self, serial):
+        """Drop the results cached for the graph with `serial`."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == serial]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key)[1]
@@ -0,0 +1,181 @@
+"""
+Canonical forms of queries, so that logically identical queries compile to
+the same string (see `QueryCompiler.compile(query, canonical=True)`).
+
+`canonicalize()` returns a copy of a query in which:
+
+  * runs of consecutive triples in a graph pattern (which form a basic
+    graph pattern, whose order does not matter), the filters of each graph
+    pattern and the alternatives of each UNION are sorted;
+  * variables that are not part of the result (anything but the projected
+    variables and aliases of a SELECT or DESCRIBE query) are renamed ?v0,
+    ?v1... in the order `fingerprint` traverses the sorted query.
+
+Patterns are sorted by a digest of their structure that ignores the names
+of renamed variables, so the order does not depend on those names either.
+Patterns whose order matters (OPTIONAL groups, subqueries and nested
+groups relative to each other) are left in place.  Identical patterns that
+only differ in renamed variables keep their relative order, so reordering
+them may still change the canonical form.
+
+"""
+from rdflib import Variable
+from sparqlquery.sparql.expressions import AliasExpression, VariableExpression
+from sparqlquery.sparql.patterns import Triple, TriplesSameSubject
+from sparqlquery.sparql.patterns import TripleArray, GraphPattern
+from sparqlquery.sparql.patterns import UnionGraphPattern, CollectionPattern
+from sparqlquery.sparql.query import SPARQLQuery
+from sparqlquery.sparql.fingerprint import NODES, IGNORED, digest, parts
+from sparqlquery.sparql.fingerprint import snapshot, term_label
+
+__all__ = ['canonicalize']
+
+# Patterns that belong to a basic graph pattern and commute with each other.
+TRIPLES = (Triple, TriplesSameSubject, TripleArray)
+
+
+def visible_variables(query):
+    """
+    Return the variables that name the results of `query`, or None if all
+    of them do (as in `SELECT *`).
+
+    """
+    projection = getattr(query, 'projection', ())
+    if '*' in map(unicode, projection):
+        return None
+    visible = set()
+    for term in projection:
+        if isinstance(term, AliasExpression):
+            visible.add(term.alias)
+        else:
+            visible.update(variables(term))
+    return visible
+
+
+def variables(node):
+    """Return the variables in `node`, in order of first appearance."""
+    found = []
+    seen = set()
+    pending = [node]
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, Variable):
+            if obj not in seen:
+                seen.add(obj)
+                found.append(obj)
+        else:
+            pending.extend(reversed(parts(obj)[1]))
+    return found
+
+
+def graph_patterns(query):
+    """Return the graph patterns in `query`, each before those it contains."""
+    found = []
+    pending = [query]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, SPARQLQuery):
+            pending.extend(value for name, value in sorted(node.__dict__.items())
+                           if isinstance(value, GraphPattern))
+        else:
+            found.append(node)
+            pending.extend(pattern for pattern in node.patterns
+                           if isinstance(pattern, (GraphPattern, SPARQLQuery)))
+    return found
+
+
+def sort_patterns(graph_pattern, key):
+    """Sort the commuting patterns and the filters of `graph_pattern`."""
+    patterns = graph_pattern.patterns
+    if isinstance(graph_pattern, UnionGraphPattern):
+        patterns.sort(key=key)
+    else:
+        start = 0
+        for end in range(len(patterns) + 1):
+            if end == len(patterns) or not isinstance(patterns[end], TRIPLES):
+                patterns[start:end] = sorted(patterns[start:end], key=key)
+                start = end + 1
+    graph_pattern.filters.sort(key=key)
+    graph_pattern._changed()
+
+
+def rename(node, names):
+    """Return a copy of `node` with the variables in `names` renamed."""
+    copies = {}
+    # Keep every copied object alive so their ids are not reused.
+    seen = []
+    pending = [(node, None)]
+    while pending:
+        obj, members = pending.pop()
+        if members is None:
+            if id(obj) in copies:
+                continue
+            if isinstance(obj, VariableExpression):
+                name = obj.value
+                copy = VariableExpression(names.get(name, name))
+            elif isinstance(obj, Variable):
+                copy = names.get(obj, obj)
+            elif isinstance(obj, NODES):
+                members = [(name, value) for name, value in obj.__dict__.items()
+                           if name not in IGNORED]
+            elif isinstance(obj, (tuple, list)):
+                members = list(enumerate(obj))
+            else:
+                copy = obj
+            if members is not None:
+                pending.append((obj, members))
+                pending.extend((value, None) for name, value in members)
+                continue
+        else:
+            values = [copies[id(value)] for name, value in members]
+            if all(value is old for value, (name, old) in zip(values, members)):
+                copy = obj
+            elif isinstance(obj, NODES):
+                copy = obj.__class__.__new__(obj.__class__)
+                copy.__dict__.update(zip([name for name, value in members],
+                                         values))
+                if isinstance(copy, GraphPattern):
+                    for pattern in copy.patterns:
+                        copy._adopt(pattern)
+            elif isinstance(obj, CollectionPattern):
+                copy = CollectionPattern(values)
+            elif isinstance(obj, tuple):
+                copy = tuple(values)
+            else:
+                copy = values
+        copies[id(obj)] = copy
+        seen.append(obj)
+    return copies[id(node)]
+
+
+def canonicalize(query):
+    """Return a canonical copy of `query` (see the module documentation)."""
+    query = snapshot(query)
+    visible = visible_variables(query)
+
+    def label(obj):
+        if isinstance(obj, Variable) and visible is not None and \
+                obj not in visible:
+            return u'Variable'
+        return term_label(obj)
+
+    # Nested patterns are sorted first, and are not changed by sorting the
+    # patterns containing them, so their digests can be shared.
+    digests = {}
+    key = lambda node: digest(node, label, digests)
+    for graph_pattern in reversed(graph_patterns(query)):
+        sort_patterns(graph_pattern, key)
+
+    if visible is None:
+        return query
+    names = {}
+    count = 0
+    for variable in variables(query):
+        if variable not in visible:
+            name = Variable('v%d' % (count,))
+            while name in visible:
+                count += 1
+                name = Variable('v%d' % (count,))
+            names[variable] = name
+            count += 1
+    return rename(query, names)
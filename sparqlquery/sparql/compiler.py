@@ -11,32 +11,64 @@ Compiling is split between two compilers that both inherit from
 Compilers in this module typically have a method for each SPARQL clause
 or query component.  These methods read the `SPARQLQuery` instance and
 yield the necessary tokens for that clause or component.  Other methods
-then join the yielded tokens.
+then join the yielded tokens.  Nested expressions and graph patterns are
+yielded as `Operand` and `NestedPattern` placeholders and compiled from an
+explicit stack, so deeply nested trees do not hit the recursion limit.
 
-For example, `QueryCompiler.compile()` joins the tokens yielded by calling
-`QueryCompiler.clauses()`, which joins tokens yielded by methods like
-`QueryCompiler.prefixes()` and `QueryCompiler.query_form()`.
+For example, `QueryCompiler.compile()` joins the tokens yielded by
+`QueryCompiler.prefixes()` and `QueryCompiler.clauses()`, which joins tokens
+yielded by methods like `QueryCompiler.query_form()` and
+`QueryCompiler.where()`.
+
+Compilers keep no per-query state, so a single instance can be shared
+between threads and reused for nested subqueries.  `get_compiler()` returns
+such a shared instance for a given compiler class and prefix map.
+
+Each compiler class looks up how to compile a node in its `HANDLERS`
+mapping, by the node's class; `SPARQLCompiler.register()` adds handlers for
+other node classes.
+
+The tokens compiled for graph patterns, triples and filters are cached on
+those nodes (see `cached_fragment()`), so compiling a query cloned from an
+already compiled one only compiles the parts added since.
 
 """
-from operator import itemgetter
+import re
+from datetime import date, datetime
+from hashlib import sha1
+from inspect import getmro
+from operator import itemgetter, index
 from rdflib import Literal, URIRef, Namespace
 from rdflib.namespace import ClosedNamespace
-from sparqlquery.exceptions import InvalidRequestError
+from rdflib.term import Identifier
+from sparqlquery.exceptions import InvalidRequestError, CompileError
 from sparqlquery.sparql.expressions import ConditionalExpression
 from sparqlquery.sparql.expressions import ListExpression
 from sparqlquery.sparql.expressions import BinaryExpression, Expression
+from sparqlquery.sparql.expressions import AliasExpression, Parameter
 from sparqlquery.sparql import operators
-from sparqlquery.sparql.operators import FunctionCall
+from sparqlquery.sparql.operators import FunctionCall, Aggregate
 from sparqlquery.sparql.patterns import GroupGraphPattern, UnionGraphPattern
 from sparqlquery.sparql.patterns import GraphPattern, TriplesSameSubject
 from sparqlquery.sparql.patterns import GraphGraphPattern, Triple, CollectionPattern
-from sparqlquery.sparql.helpers import RDF, XSD, is_a
+from sparqlquery.sparql.patterns import TripleArray, InlineData
+from sparqlquery.sparql.query import SPARQLQuery
+from sparqlquery.sparql.canonical import canonicalize
+from sparqlquery.sparql.helpers import RDF, RDFS, XSD, is_a
 from sparqlquery.sparql.util import defrag, to_list
 
 __all__ = ['SPARQLCompiler', 'ExpressionCompiler', 'QueryCompiler',
            'SolutionModifierSupportingQueryCompiler',
            'ProjectionSupportingQueryCompiler', 'SelectCompiler',
-           'ConstructCompiler']
+           'ConstructCompiler', 'PreparedQuery', 'get_compiler']
+
+# Shared compiler instances, keyed by compiler class and prefix map.
+_COMPILERS = {}
+_MAX_COMPILERS = 256
+
+# Handlers resolved along the node class MRO, keyed by compiler class and
+# node class.
+_RESOLVED_HANDLERS = {}
 
 
 def join(tokens, sep=' '):
@@ -84,6 +116,226 @@ class PrefixMap(dict):
         self.uri_to_ns[namespace_to_uri(ns)] = prefix
 
 
+def _prefix_map_key(prefix_map):
+    if not prefix_map:
+        return frozenset()
+    return frozenset((type(namespace), namespace, prefix)
+                     for namespace, prefix in prefix_map.iteritems())
+
+
+def cached_fragment(compiler, node, key, compile_node, *args):
+    """
+    Return the tokens `compile_node(node, *args)` yields, reusing those cached
+    on `node` by the last call with the same `compiler` and `key`.
+
+    Nodes that cannot be cached (like plain tuples) are compiled every time.
+
+    """
+    fragment = getattr(node, '_fragment', None)
+    if fragment is not None and fragment[0] is compiler and fragment[1] == key:
+        return fragment[2]
+    tokens = list(compile_node(node, *args))
+    if hasattr(node, '_fragment'):
+        node._fragment = (compiler, key, tokens)
+    return tokens
+
+
+def get_compiler(compiler_class, prefix_map=None):
+    """
+    Return a shared `compiler_class` instance for `prefix_map`.
+
+    Instances are created on first use and reused by every later call with an
+    equal prefix map, from any thread.
+
+    """
+    key = (compiler_class, _prefix_map_key(prefix_map))
+    try:
+        return _COMPILERS[key]
+    except KeyError:
+        compiler = compiler_class(prefix_map)
+        if len(_COMPILERS) >= _MAX_COMPILERS:
+            _COMPILERS.clear()
+        return _COMPILERS.setdefault(key, compiler)
+
+
+# Parameters compile to their name between two Unicode noncharacters, which
+# `PreparedQuery` splits the compiled query on.  The first one tells the kind
+# of slot the parameter is in: a term, or an integer (LIMIT and OFFSET).
+PARAMETER = u'\ufdd0%s\ufdd1'
+INTEGER_PARAMETER = u'\ufdd2%s\ufdd1'
+PARAMETER_END = u'\ufdd1'
+PARAMETERS = re.compile(u'([\ufdd0\ufdd2])([^\ufdd1]*)\ufdd1')
+SLOTS = {u'\ufdd0': 'term', u'\ufdd2': 'integer'}
+# Code of the generated binder functions, by the layout of their slots.
+_BINDERS = {}
+
+UNQUOTED_DATATYPES = (XSD.double, XSD.integer, XSD.float, XSD.boolean)
+XSD_DATETIME = XSD.dateTime
+XSD_DATE = XSD.date
+
+
+# Renderers for plain Python values, producing the same tokens as compiling
+# `Literal(value)` without building the `Literal`.
+
+def render_integer(compiler, value):
+    return unicode(value)
+
+
+def render_float(compiler, value):
+    return unicode(value).lower()
+
+
+def render_boolean(compiler, value):
+    return value and u'true' or u'false'
+
+
+def render_string(compiler, value):
+    if isinstance(value, str):
+        try:
+            value = unicode(value)
+        except UnicodeDecodeError:
+            value = unicode(value, 'utf-8')
+    if '\n' in value:
+        return compiler.term(Literal(value))
+    return u'"%s"' % (value.replace('\\', '\\\\').replace('"', '\\"')
+                           .replace('\r', '\\r'),)
+
+
+def render_index(value):
+    # `index()` accepts integers only, so no other value can be rendered in
+    # LIMIT and OFFSET.
+    return unicode(index(value))
+
+
+def render_datetime(compiler, value):
+    return u'"%s"^^%s' % (value.isoformat(), compiler.term(XSD_DATETIME))
+
+
+def render_date(compiler, value):
+    return u'"%s"^^%s' % (value.isoformat(), compiler.term(XSD_DATE))
+
+
+class Operand(object):
+    """
+    Placeholder yielded by compiler methods for a nested expression, which
+    `ExpressionCompiler.compile()` replaces with the compiled expression.
+
+    Nested expressions are compiled from an explicit stack instead of by
+    recursion, so the depth of an expression tree is not limited by the
+    interpreter's recursion limit.
+
+    """
+    __slots__ = ('expression', 'bracketed')
+
+    def __init__(self, expression, bracketed=False):
+        self.expression = expression
+        self.bracketed = bracketed
+
+
+class Operands(object):
+    """
+    Placeholder yielded by compiler methods for a sequence of expressions,
+    replaced with the compiled expressions joined by `sep`.
+
+    """
+    __slots__ = ('expressions', 'sep')
+
+    def __init__(self, expressions, sep=', '):
+        self.expressions = expressions
+        self.sep = sep
+
+
+class NestedPattern(object):
+    """
+    Placeholder returned by graph pattern handlers for a nested graph pattern,
+    which `QueryCompiler.graph_pattern()` replaces with its tokens.
+
+    If `joined` is true, the tokens are joined into a single token; otherwise
+    if `more` is true, a period is added to the last token (unless it closes
+    a group).
+
+    """
+    __slots__ = ('pattern', 'braces', 'more', 'joined')
+
+    def __init__(self, pattern, braces, more=False, joined=False):
+        self.pattern = pattern
+        self.braces = braces
+        self.more = more
+        self.joined = joined
+
+
+# Expression handlers.
+
+def compile_conditional(compiler, expression):
+    return compiler.conditional(expression), ' '
+
+
+def compile_binary(compiler, expression):
+    return compiler.binary(expression), ' '
+
+
+def compile_list(compiler, expression):
+    return compiler.list(expression), ' '
+
+
+def compile_alias(compiler, expression):
+    return compiler.alias(expression), ''
+
+
+def compile_aggregate(compiler, expression):
+    return compiler.aggregate(expression), ''
+
+
+def compile_function(compiler, expression):
+    return compiler.function(expression), ''
+
+
+def compile_parameter(compiler, expression):
+    return compiler.parameter(expression)
+
+
+def compile_unary(compiler, expression):
+    return compiler.unary(expression), ''
+
+
+# Graph pattern handlers.
+
+def compile_triple_pattern(compiler, pattern, more):
+    return [add_period_if(join(compiler.triple(pattern)), more)]
+
+
+def compile_subquery_pattern(compiler, pattern, more):
+    return ['{', compiler.subquery(pattern), add_period_if('}', more)]
+
+
+def compile_triples_same_subject_pattern(compiler, pattern, more):
+    return [add_period_if(join(compiler.triples_same_subject(pattern)), more)]
+
+
+def compile_triple_array_pattern(compiler, pattern, more):
+    tokens = compiler.triple_array(pattern)
+    last = len(tokens) - 1
+    return [add_period_if(token, i < last or more)
+            for i, token in enumerate(tokens)]
+
+
+def compile_inline_data_pattern(compiler, pattern, more):
+    return [add_period_if(join(compiler.inline_data(pattern)), more)]
+
+
+def compile_union_pattern(compiler, pattern, more):
+    tokens = []
+    for i, alternative in enumerate(pattern.patterns):
+        if i:
+            tokens.append('UNION')
+        tokens.append(NestedPattern(alternative, True, joined=True))
+    return tokens
+
+
+def compile_group_pattern(compiler, pattern, more):
+    return [NestedPattern(pattern, False, more)]
+
+
 class SPARQLCompiler(object):
     """
     Base class for compiling Python representations of SPARQL concepts to
@@ -98,6 +350,8 @@ class SPARQLCompiler(object):
       concept and returns a string.
 
     """
+    HANDLERS = {}
+
     def __init__(self, prefix_map=None):
         if prefix_map is None:
             prefix_map = {}
@@ -106,6 +360,40 @@ class SPARQLCompiler(object):
     def compile(self, obj):
         raise NotImplementedError
 
+    @classmethod
+    def register(cls, node_class, handler):
+        """
+        Use `handler` to compile instances of `node_class` (and of its
+        subclasses without a handler of their own) with this compiler class
+        and its subclasses.
+
+        See the `HANDLERS` of each compiler class for the arguments handlers
+        receive and what they return.
+
+        """
+        if 'HANDLERS' not in vars(cls):
+            cls.HANDLERS = {}
+        cls.HANDLERS[node_class] = handler
+        _RESOLVED_HANDLERS.clear()
+
+    def handler(self, node):
+        """Return the handler for `node`, or None if there is none."""
+        key = (self.__class__, node.__class__)
+        try:
+            return _RESOLVED_HANDLERS[key]
+        except KeyError:
+            handler = None
+            for node_class in getmro(node.__class__):
+                for compiler_class in getmro(self.__class__):
+                    handlers = vars(compiler_class).get('HANDLERS', {})
+                    if node_class in handlers:
+                        handler = handlers[node_class]
+                        break
+                if handler is not None:
+                    break
+            _RESOLVED_HANDLERS[key] = handler
+            return handler
+
 
 class ExpressionCompiler(SPARQLCompiler):
     PRECEDENCE = {
@@ -118,6 +406,27 @@ class ExpressionCompiler(SPARQLCompiler):
         operators.invert: 5, operators.inv: 5
     }
     DEFAULT_PRECEDENCE = 6
+    # Plain Python values are rendered by exact type, without a `Literal`.
+    LITERAL_RENDERERS = {
+        int: render_integer, long: render_integer, float: render_float,
+        bool: render_boolean, str: render_string, unicode: render_string,
+        datetime: render_datetime, date: render_date
+    }
+    # Maximum number of rdflib terms whose rendered token is remembered.
+    TERM_CACHE_SIZE = 4096
+    # Handlers take the compiler and an expression and return either a
+    # string, or an iterable of tokens and `Operand`s with the separator to
+    # join them with.  Values without a handler are compiled as terms.
+    HANDLERS = {
+        ConditionalExpression: compile_conditional,
+        BinaryExpression: compile_binary,
+        ListExpression: compile_list,
+        AliasExpression: compile_alias,
+        Aggregate: compile_aggregate,
+        FunctionCall: compile_function,
+        Parameter: compile_parameter,
+        Expression: compile_unary
+    }
     OPERATORS = {
         operators.or_: '||', 'logical-or': '||',
         operators.and_: '&&', 'logical-and': '&&',
@@ -130,22 +439,76 @@ class ExpressionCompiler(SPARQLCompiler):
         operators.invert: '!', operators.inv: '!'
     }
 
+    def __init__(self, prefix_map=None):
+        super(ExpressionCompiler, self).__init__(prefix_map)
+        self.terms = {}
+
     def compile(self, expression, bracketed=False):
-        if not bracketed:
-            if isinstance(expression, ConditionalExpression):
-                return join(self.conditional(expression))
-            elif isinstance(expression, BinaryExpression):
-                return join(self.binary(expression))
-            elif isinstance(expression, ListExpression):
-                return join(self.list(expression))
-            elif isinstance(expression, FunctionCall):
-                return join(self.function(expression), '')
-            elif isinstance(expression, Expression):
-                return join(self.unary(expression), '')
+        nested = self.nested(expression, bracketed)
+        if not isinstance(nested, tuple):
+            return nested
+        # Each frame holds the tokens of an expression still being compiled,
+        # the separator to join them with, and the compiled tokens so far.
+        stack = [(iter(nested[0]), nested[1], [])]
+        handler = self.handler
+        while stack:
+            tokens, sep, compiled = stack[-1]
+            for token in tokens:
+                if isinstance(token, Operand):
+                    if token.bracketed:
+                        nested = self.bracketed(token.expression), ''
+                    else:
+                        nested = handler(token.expression)
+                        if nested is None:
+                            compiled.append(self.term(token.expression))
+                            continue
+                        nested = nested(self, token.expression)
+                    if isinstance(nested, tuple):
+                        stack.append((iter(nested[0]), nested[1], []))
+                        break
+                    compiled.append(nested)
+                elif isinstance(token, Operands):
+                    operands = [Operand(expr) for expr in token.expressions]
+                    stack.append((iter(operands), token.sep, []))
+                    break
+                else:
+                    compiled.append(token)
             else:
-                return self.term(expression)
-        else:
-            return join(self.bracketed(expression), '')
+                stack.pop()
+                if stack:
+                    stack[-1][2].append(join(compiled, sep))
+                else:
+                    return join(compiled, sep)
+
+    def nested(self, expression, bracketed=False):
+        """
+        Return the compiled `expression` if it is a term (or has a handler
+        returning a string), otherwise its tokens and separator.
+
+        """
+        if bracketed:
+            return self.bracketed(expression), ''
+        handler = self.handler(expression)
+        if handler is None:
+            return self.term(expression)
+        return handler(self, expression)
+
+    def operands(self, expression):
+        """
+        Return the operands of the conditional `expression`, with the operands
+        of nested conditionals of the same operator flattened into them.
+
+        """
+        operands = []
+        pending = list(reversed(expression.operands))
+        while pending:
+            operand = pending.pop()
+            if isinstance(operand, ConditionalExpression) and \
+                    operand.operator == expression.operator:
+                pending.extend(reversed(operand.operands))
+            else:
+                operands.append(operand)
+        return operands
 
     def get_precedence(self, obj):
         if isinstance(obj, Expression):
@@ -168,6 +531,31 @@ class ExpressionCompiler(SPARQLCompiler):
             return '%s:%s' % (prefix, fragment)
 
     def term(self, term, use_prefix=True):
+        """
+        Return the token for `term`.
+
+        Plain Python values are rendered through `LITERAL_RENDERERS`, and the
+        tokens of rdflib terms are remembered (up to `TERM_CACHE_SIZE`).
+
+        """
+        render = self.LITERAL_RENDERERS.get(type(term))
+        if render is not None:
+            return render(self, term)
+        if use_prefix and term is is_a:
+            return 'a'
+        key = (term, use_prefix)
+        try:
+            return self.terms[key]
+        except (KeyError, TypeError):
+            pass
+        token = self._term(term, use_prefix)
+        if isinstance(term, Identifier) and not getattr(term, 'language', None):
+            if len(self.terms) >= self.TERM_CACHE_SIZE:
+                self.terms.clear()
+            self.terms[key] = token
+        return token
+
+    def _term(self, term, use_prefix):
         if isinstance(term, (Namespace, ClosedNamespace)):
             term = URIRef(namespace_to_uri(term))
         if term is None:
@@ -177,11 +565,12 @@ class ExpressionCompiler(SPARQLCompiler):
         elif use_prefix and isinstance(term, URIRef):
             return self.uri(term)
         elif isinstance(term, Literal):
-            if term.datatype in (XSD.double, XSD.integer, XSD.float, XSD.boolean):
+            if term.datatype in UNQUOTED_DATATYPES:
                 return unicode(term).lower()
             elif use_prefix and term.datatype:  # Abbreviate datatype if possible
                 datatype_term = self.uri(term.datatype)
-                return '"%s"^^%s' % (term, datatype_term)
+                # The lexical form quoted and escaped as a plain literal's.
+                return '%s^^%s' % (Literal(unicode(term)).n3(), datatype_term)
         elif isinstance(term, Namespace):
             return unicode(term)
         return term.n3()
@@ -197,60 +586,175 @@ class ExpressionCompiler(SPARQLCompiler):
 
     def bracketed(self, expression):
         yield '('
-        yield self.compile(expression, False)
+        yield Operand(expression)
         yield ')'
 
     def conditional(self, expression):
         operator = self.operator(expression.operator)
-        for i, expr in enumerate(expression.operands):
+        for i, expr in enumerate(self.operands(expression)):
             if i:
                 yield operator
             bracketed = self.precedence_lt(expr, expression)
-            yield self.compile(expr, bracketed)
+            yield Operand(expr, bracketed)
 
     def binary(self, expression):
         left_bracketed = self.precedence_lt(expression.left, expression)
         right_bracketed = self.precedence_lt(expression.right, expression)
-        yield self.compile(expression.left, left_bracketed)
+        yield Operand(expression.left, left_bracketed)
         yield self.operator(expression.operator)
-        yield self.compile(expression.right, right_bracketed)
+        yield Operand(expression.right, right_bracketed)
 
     def list(self, expression, inverted=False):
-        yield self.compile(expression.comp)
+        yield Operand(expression.comp)
         if expression.inverted:
             yield 'NOT'
         yield 'IN'
         yield '('
-        yield join([self.compile(item) for item in expression.items], ', ')
+        yield Operands(expression.items)
         yield ')'
 
     def function(self, expression):
         yield self.operator(expression.operator)
         yield '('
-        yield join([self.compile(arg) for arg in expression.arg_list], ', ')
+        yield Operands(expression.arg_list)
+        yield ')'
+
+    def aggregate(self, expression):
+        yield self.operator(expression.operator)
+        yield '('
+        if expression.distinct:
+            yield 'DISTINCT '
+        if expression.arg_list:
+            yield Operands(expression.arg_list)
+        else:
+            yield '*'
+        if expression.separator is not None:
+            yield '; SEPARATOR=%s' % (self.term(unicode(expression.separator)),)
         yield ')'
 
+    def alias(self, expression):
+        yield '('
+        yield Operand(expression.expression)
+        yield ' AS '
+        yield Operand(expression.alias)
+        yield ')'
+
+    def parameter(self, expression):
+        return PARAMETER % (expression.name,)
+
     def unary(self, expression):
         if expression.operator:
             yield self.operator(expression.operator)
-        yield self.compile(expression.value)
+        yield Operand(expression.value)
 
 
 class QueryCompiler(SPARQLCompiler):
+    # Handlers take the compiler, a pattern nested in a graph pattern and
+    # whether more patterns or filters follow it, and return a list of tokens
+    # and `NestedPattern`s.
+    HANDLERS = {
+        Triple: compile_triple_pattern,
+        SPARQLQuery: compile_subquery_pattern,
+        TriplesSameSubject: compile_triples_same_subject_pattern,
+        TripleArray: compile_triple_array_pattern,
+        InlineData: compile_inline_data_pattern,
+        UnionGraphPattern: compile_union_pattern,
+        GraphPattern: compile_group_pattern
+    }
+
+    # The only prefixes declared and used by canonical queries.
+    CANONICAL_PREFIX_MAP = {RDF: 'rdf', RDFS: 'rdfs', XSD: 'xsd'}
+
     def __init__(self, prefix_map=None, expression_compiler=ExpressionCompiler):
         super(QueryCompiler, self).__init__(prefix_map)
         if not isinstance(expression_compiler, ExpressionCompiler):
             expression_compiler = expression_compiler(self.prefix_map)
         self.expression_compiler = expression_compiler
 
-    def compile(self, query, render_prefixes=True):
+    def compile(self, query, render_prefixes=True, canonical=False):
         """Compile `query` and return the resulting string.
 
         `query` is a `sparqlquery.sparql.query.SPARQLQuery` instance.
 
+        If `render_prefixes` is false, the PREFIX declarations are omitted
+        (as for subqueries).
+
+        If `canonical` is true, compile the canonical form of `query` (see
+        `sparqlquery.sparql.canonical`) with `CANONICAL_PREFIX_MAP` instead of
+        this compiler's prefix map, so that queries differing only in
+        variable names, triple order or prefixes compile to the same string.
+
+        """
+        if canonical:
+            compiler = get_compiler(type(self), self.CANONICAL_PREFIX_MAP)
+            return compiler.compile(canonicalize(query), render_prefixes)
+        output = self._compile(query, render_prefixes)
+        if PARAMETER_END in output:
+            raise CompileError("Cannot compile a query with parameters; "
+                               "use prepare() instead.")
+        return output
+
+    def prepare(self, query, render_prefixes=True, generate=False):
         """
-        self.render_prefixes = render_prefixes
-        return join(self.clauses(query), '\n')
+        Compile `query`, which may contain `Parameter`s, and return a
+        `PreparedQuery` binding their values.
+
+        If `generate` is true, the `PreparedQuery` binds values with a Python
+        function generated for the query (see `PreparedQuery.generate()`).
+
+        """
+        return self.prepared(query, self.template(query, render_prefixes),
+                             generate)
+
+    def template(self, query, render_prefixes=True):
+        """
+        Compile `query`, which may contain `Parameter`s, and return the
+        resulting string, with its parameters marked.
+
+        """
+        return self._compile(query, render_prefixes)
+
+    def prepared(self, query, template, generate=False):
+        """
+        Return the `PreparedQuery` of `query`, given `template`, the string
+        `template()` returned for it.
+
+        """
+        parts = PARAMETERS.split(template)
+        slots = [SLOTS[marker] for marker in parts[1::3]]
+        prepared = PreparedQuery(query, self, parts[::3], parts[2::3], slots)
+        if generate:
+            prepared.generate()
+        return prepared
+
+    def escaper(self, slot):
+        """Return the function rendering values in a `slot` of this kind."""
+        if slot == 'integer':
+            return render_index
+        renderers = self.expression_compiler.LITERAL_RENDERERS
+        expression = self.expression
+
+        def escape(value):
+            render = renderers.get(type(value))
+            if render is not None:
+                return render(self.expression_compiler, value)
+            return expression(value)
+        return escape
+
+    def _compile(self, query, render_prefixes):
+        clauses = join(self.clauses(query), '\n')
+        if render_prefixes:
+            return join([join(self.prefixes(), '\n'), clauses], '\n')
+        return clauses
+
+    def etag(self, query):
+        """
+        Return a hex digest of the canonical form of `query`, which is the
+        same for every query compiling to the same canonical string.
+
+        """
+        return sha1(self.compile(query, canonical=True).encode('utf-8')) \
+            .hexdigest()
 
     def expression(self, expression, bracketed=False):
         """
@@ -264,15 +768,13 @@ class QueryCompiler(SPARQLCompiler):
         return self.expression_compiler.compile(expression, bracketed)
 
     def clauses(self, query):
-        yield join(self.prefixes(), '\n')
         yield join(self.query_form(query))
         yield join(self.where(query))
 
     def prefixes(self):
-        if self.render_prefixes:
-            prefixes = sorted(self.prefix_map.iteritems(), key=itemgetter(1))
-            for namespace, prefix in prefixes:
-                yield join(self.prefix(prefix, namespace))
+        prefixes = sorted(self.prefix_map.iteritems(), key=itemgetter(1))
+        for namespace, prefix in prefixes:
+            yield join(self.prefix(prefix, namespace))
 
     def prefix(self, prefix, namespace):
         yield 'PREFIX'
@@ -296,7 +798,48 @@ class QueryCompiler(SPARQLCompiler):
         yield ")"
 
     def graph_pattern(self, graph_pattern, braces=True):
-        from sparqlquery.sparql.query import SPARQLQuery
+        """
+        Return the tokens for `graph_pattern`, compiling nested graph patterns
+        from an explicit stack and caching the tokens of each on it.
+
+        """
+        output = []
+        # Each frame holds a nested pattern still being compiled, its cache
+        # key, its remaining tokens and the compiled tokens so far.
+        stack = [(None, None, iter([NestedPattern(graph_pattern, braces)]),
+                  output)]
+        while stack:
+            nested, key, tokens, compiled = stack[-1]
+            for token in tokens:
+                if not isinstance(token, NestedPattern):
+                    compiled.append(token)
+                    continue
+                pattern = token.pattern
+                token_key = (token.braces, pattern._stamp())
+                fragment = pattern._fragment
+                if fragment is not None and fragment[0] is self and \
+                        fragment[1] == token_key:
+                    self._add_nested(compiled, token, fragment[2])
+                else:
+                    nested_tokens = self._graph_pattern(pattern, token.braces)
+                    stack.append((token, token_key, nested_tokens, []))
+                    break
+            else:
+                stack.pop()
+                if nested is not None:
+                    nested.pattern._fragment = (self, key, compiled)
+                    self._add_nested(stack[-1][3], nested, compiled)
+        return output
+
+    def _add_nested(self, tokens, nested, nested_tokens):
+        if nested.joined:
+            tokens.append(join(nested_tokens))
+        elif nested_tokens:
+            tokens.extend(nested_tokens)
+            if nested_tokens[-1] != '}':
+                tokens[-1] = add_period_if(tokens[-1], nested.more)
+
+    def _graph_pattern(self, graph_pattern, braces):
         if isinstance(graph_pattern, GroupGraphPattern):
             if graph_pattern.optional:
                 yield 'OPTIONAL'
@@ -307,38 +850,37 @@ class QueryCompiler(SPARQLCompiler):
             braces = True
         if braces:
             yield '{'
-        patterns = list(graph_pattern.patterns)
-        filters = list(graph_pattern.filters)
-        while patterns:
-            pattern = patterns.pop(0)
-            if isinstance(pattern, Triple):
-                yield add_period_if(join(self.triple(pattern)), bool(patterns or filters))
-            elif isinstance(pattern, SPARQLQuery):
-                yield '{'
-                yield pattern.compile(prefix_map=self.prefix_map,
-                                      render_prefixes=False)
-                yield add_period_if('}', bool(patterns or filters))
-            elif isinstance(pattern, TriplesSameSubject):
-                yield add_period_if(join(self.triples_same_subject(pattern)), bool(patterns or filters))
-            elif isinstance(pattern, UnionGraphPattern):
-                for i, alternative in enumerate(pattern.patterns):
-                    if i:
-                        yield 'UNION'
-                    yield join(self.graph_pattern(alternative, True))
-            elif isinstance(pattern, GraphPattern):
-                tokens = list(self.graph_pattern(pattern, False))
-                for token in tokens:
-                    if token is not tokens[-1]:
-                        yield token
-                    else:
-                        yield add_period_if(token, bool(token != '}' and (patterns or filters)))
-        while filters:
-            filter = filters.pop(0)
-            yield add_period_if(join(self.filter(filter)), bool(filters))
+        filters = graph_pattern.filters
+        last = len(graph_pattern.patterns) - 1
+        for i, pattern in enumerate(graph_pattern.patterns):
+            handler = self.handler(pattern)
+            if handler is None:
+                raise CompileError("Cannot compile pattern: %r" % (pattern,))
+            for token in handler(self, pattern, bool(i < last or filters)):
+                yield token
+        last = len(filters) - 1
+        for i, filter in enumerate(filters):
+            yield add_period_if(join(self.filter(filter)), i < last)
         if braces:
             yield '}'
 
+    def subquery(self, query):
+        """
+        Compile the nested `query` without prefixes, with the shared compiler
+        for its query form and this compiler's prefix map.
+
+        """
+        compiler_class = query._get_compiler_class()
+        if compiler_class is type(self):
+            compiler = self
+        else:
+            compiler = get_compiler(compiler_class, self.prefix_map)
+        return compiler.compile(query, render_prefixes=False)
+
     def triple(self, triple):
+        return cached_fragment(self, triple, None, self._triple)
+
+    def _triple(self, triple):
         subject, predicate, object = triple
         if isinstance(subject, CollectionPattern):
             yield join(self.collection_pattern(subject))
@@ -352,7 +894,37 @@ class QueryCompiler(SPARQLCompiler):
         else:
             yield self.expression(object)
 
+    def triple_array(self, triples):
+        return cached_fragment(self, triples, None, self._triple_array)
+
+    def _triple_array(self, triples):
+        for triple in triples:
+            yield join(self._triple(triple))
+
+    def inline_data(self, data):
+        return cached_fragment(self, data, None, self._inline_data)
+
+    def _inline_data(self, data):
+        yield 'VALUES'
+        expression = self.expression
+        if len(data.variables) == 1:
+            yield expression(data.variables[0])
+            yield '{'
+            for value, in data.rows:
+                yield value is None and 'UNDEF' or expression(value)
+        else:
+            yield '(%s)' % (join(map(expression, data.variables)),)
+            yield '{'
+            for row in data.rows:
+                yield '(%s)' % (join(value is None and 'UNDEF' or
+                                     expression(value) for value in row),)
+        yield '}'
+
     def triples_same_subject(self, triples):
+        return cached_fragment(self, triples, None,
+                               self._triples_same_subject)
+
+    def _triples_same_subject(self, triples):
         yield self.expression(triples.subject)
         yield join(self.predicate_object_list(triples.predicate_object_list))
 
@@ -367,8 +939,18 @@ class QueryCompiler(SPARQLCompiler):
                 yield self.expression(object)
 
     def filter(self, filter):
+        return cached_fragment(self, filter, None, self._filter)
+
+    def _filter(self, filter):
         yield 'FILTER'
-        constraint = filter.constraint
+        yield self.constraint(filter.constraint)
+
+    def constraint(self, constraint):
+        """
+        Compile a FILTER or HAVING `constraint` and return the resulting
+        string, bracketed unless it is a function call.
+
+        """
         bracketed = False
         while isinstance(constraint, ConditionalExpression):
             if len(constraint.operands) == 1:
@@ -377,12 +959,111 @@ class QueryCompiler(SPARQLCompiler):
                 break
         if not isinstance(constraint, FunctionCall):
             bracketed = True
-        yield self.expression(constraint, bracketed)
+        return self.expression(constraint, bracketed)
+
+
+class PreparedQuery(object):
+    """
+    A compiled query with `Parameter`s, whose values are given when it is
+    compiled with `bind()` or executed with `execute()`.
+
+    `segments` are the parts of the compiled query between parameters,
+    `names` the names of the parameters between them and `slots` the kinds
+    of slot they are in ('term' or 'integer'), which tell how their values
+    are rendered.  `parameters` are the distinct names, in order.
+
+    """
+
+    def __init__(self, query, compiler, segments, names, slots=None):
+        self.query = query
+        self.compiler = compiler
+        self.segments = segments
+        self.names = names
+        if slots is None:
+            slots = ['term'] * len(names)
+        self.slots = slots
+        self.parameters = []
+        for name in names:
+            if name not in self.parameters:
+                self.parameters.append(name)
+        self.escapers = [compiler.escaper(slot) for slot in slots]
+        self.function = None
+
+    def __repr__(self):
+        return "PreparedQuery(<%s %s>)" % (self.query.__class__.__name__,
+                                           ', '.join(sorted(self.parameters)))
+
+    def bind(self, **values):
+        """Return the compiled query with the given parameter values."""
+        if self.function is not None:
+            try:
+                args = [values[name] for name in self.parameters]
+            except KeyError as error:
+                raise InvalidRequestError("No value for parameter %r." %
+                                          (error.args[0],))
+            return self.function(*args)
+        segments = self.segments
+        escapers = self.escapers
+        output = [segments[0]]
+        for i, name in enumerate(self.names):
+            try:
+                value = values[name]
+            except KeyError:
+                raise InvalidRequestError("No value for parameter %r." %
+                                          (name,))
+            output.append(escapers[i](value))
+            output.append(segments[i + 1])
+        return u''.join(output)
+
+    def generate(self):
+        """
+        Generate, set as `function` and return a function taking the values
+        of `parameters` positionally and returning the compiled query.
+
+        The function joins the static segments and the values rendered by
+        the escaper of their slot, without looking at the query again.  Its
+        code only depends on where each parameter is used, so it is shared by
+        the queries of the same shape.
+
+        """
+        if self.function is not None:
+            return self.function
+        arguments = dict((name, 'p%d' % (i,))
+                         for i, name in enumerate(self.parameters))
+        # Each parameter is rendered once per kind of slot it is in.
+        rendered = {}
+        lines = []
+        tokens = ['s0']
+        for i, (name, slot) in enumerate(zip(self.names, self.slots)):
+            key = (name, slot)
+            if key not in rendered:
+                rendered[key] = 'r%d' % (i,)
+                lines.append('    r%d = e%d(%s)' % (i, i, arguments[name]))
+            tokens.append(rendered[key])
+            tokens.append('s%d' % (i + 1,))
+        source = 'def bind(%s):\n%s\n    return join((%s,))\n' % (
+            ', '.join('p%d' % (i,) for i in range(len(self.parameters))),
+            ''.join(line + '\n' for line in lines), ', '.join(tokens))
+        code = _BINDERS.get(source)
+        if code is None:
+            code = _BINDERS.setdefault(
+                source, compile(source, '<prepared query>', 'exec'))
+        namespace = {'join': u''.join}
+        for i, segment in enumerate(self.segments):
+            namespace['s%d' % (i,)] = segment
+        for i, escaper in enumerate(self.escapers):
+            namespace['e%d' % (i,)] = escaper
+        exec(code, namespace)
+        self.function = namespace['bind']
+        return self.function
+
+    def execute(self, graph, **values):
+        """Execute the query on `graph` with the given parameter values."""
+        return self.query._execute(graph, self.bind(**values))
 
 
 class SolutionModifierSupportingQueryCompiler(QueryCompiler):
     def clauses(self, query):
-        yield join(self.prefixes(), '\n')
         yield join(self.query_form(query))
         yield join(self.where(query))
         yield join(self.order_by(query))
@@ -398,12 +1079,19 @@ class SolutionModifierSupportingQueryCompiler(QueryCompiler):
     def limit(self, query):
         if query._limit is not None:
             yield 'LIMIT'
-            yield query._limit
+            yield self.modifier(query._limit)
 
     def offset(self, query):
-        if query._offset not in (0, None):
+        # `in` would compare a `Parameter` with `Expression.__eq__`.
+        if isinstance(query._offset, Parameter) or \
+                query._offset not in (0, None):
             yield 'OFFSET'
-            yield query._offset
+            yield self.modifier(query._offset)
+
+    def modifier(self, value):
+        if isinstance(value, Parameter):
+            return INTEGER_PARAMETER % (value.name,)
+        return value
 
 
 class ProjectionSupportingQueryCompiler(SolutionModifierSupportingQueryCompiler):
@@ -422,6 +1110,30 @@ class ProjectionSupportingQueryCompiler(SolutionModifierSupportingQueryCompiler)
 
 
 class SelectCompiler(ProjectionSupportingQueryCompiler):
+    def clauses(self, query):
+        yield join(self.query_form(query))
+        yield join(self.where(query))
+        yield join(self.group_by(query))
+        yield join(self.having(query))
+        yield join(self.order_by(query))
+        yield join(self.limit(query))
+        yield join(self.offset(query))
+
+    def group_by(self, query):
+        if query._group_by:
+            yield 'GROUP BY'
+            compiler = self.expression_compiler
+            for expression in query._group_by:
+                precedence = compiler.get_precedence(expression)
+                bracketed = isinstance(expression, ListExpression) or \
+                    precedence < compiler.DEFAULT_PRECEDENCE
+                yield self.expression(expression, bracketed)
+
+    def having(self, query):
+        if query._having is not None:
+            yield 'HAVING'
+            yield self.constraint(query._having)
+
     def projection(self, query):
         if query._distinct:
             yield 'DISTINCT'
@@ -454,8 +1166,6 @@ class ConstructCompiler(SolutionModifierSupportingQueryCompiler):
 class UpdateCompiler(QueryCompiler):
     def clauses(self, query):
         try:
-            yield join(self.prefixes(), '\n')
-
             if not query._where:
                 assert query._insert or query._delete, 'Update query has to include insert or delete clause'
                 if query._insert:
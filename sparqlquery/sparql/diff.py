@@ -0,0 +1,170 @@
+"""
+Minimal updates turning one graph into another.
+
+`diff()` compares two graphs (or any iterables of triples) with sets of
+their triples; `diff_ntriples()` compares two graphs serialized as sorted
+N-Triples, line by line, so that neither needs to be held in memory:
+
+    $ rdfpipe -o nt old.rdf | LC_ALL=C sort > old.nt
+
+Both yield changes, pairs of `DELETE` or `INSERT` and a triple, which
+`data_updates()` turns into DELETE DATA and INSERT DATA updates of at most
+`max_triples` triples each, and `sync()` executes with an `UpdateBatch`:
+
+    sync(store, diff_ntriples(open('old.nt'), open('new.nt')))
+
+Blank nodes cannot be matched by DELETE DATA, and a blank node inserted
+with INSERT DATA is a new one in every update, so the updates state them
+as their skolem IRIs (see `rdflib.BNode.skolemize`); a graph synced this
+way holds skolem IRIs instead of the blank nodes.  This relies on blank
+nodes keeping their identifiers between the old and the new graph, as they
+do in a graph changed in place or in files written by the same process.
+
+"""
+from rdflib import BNode
+from rdflib.plugins.parsers.ntriples import NTriplesParser, r_nodeid
+from sparqlquery.sparql.batch import UpdateBatch
+from sparqlquery.sparql.query import SPARQLUpdateQuery
+
+__all__ = ['DELETE', 'INSERT', 'diff', 'diff_ntriples', 'sorted_ntriples',
+           'data_updates', 'sync']
+
+DELETE = 'delete'
+INSERT = 'insert'
+
+
+def diff(old, new):
+    """
+    Yield the changes from the triples of `old` to those of `new`, in no
+    particular order.
+
+    """
+    old = set(old)
+    new = set(new)
+    for triple in old - new:
+        yield DELETE, triple
+    for triple in new - old:
+        yield INSERT, triple
+
+
+def sorted_ntriples(graph):
+    """Return the lines of `graph` serialized as N-Triples, sorted."""
+    return sorted(line for line in graph.serialize(format='nt').splitlines()
+                  if line.strip())
+
+
+def diff_ntriples(old, new):
+    """
+    Yield the changes from the triples of `old` to those of `new`, two
+    iterables of N-Triples lines sorted as byte strings (as by
+    `sorted_ntriples()` or `LC_ALL=C sort`), in the order of their lines.
+
+    """
+    parser = NTriplesLineParser()
+    old = unique_lines(old)
+    new = unique_lines(new)
+    a = next(old, None)
+    b = next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a < b):
+            yield DELETE, parser.parse_line(a)
+            a = next(old, None)
+        elif a is None or b < a:
+            yield INSERT, parser.parse_line(b)
+            b = next(new, None)
+        else:
+            a = next(old, None)
+            b = next(new, None)
+
+
+def unique_lines(lines):
+    """Yield the sorted `lines` once each, without blank and comment lines."""
+    previous = None
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#') and line != previous:
+            yield line
+            previous = line
+
+
+class NTriplesLineParser(NTriplesParser):
+    """
+    Parses single N-Triples lines, keeping the identifiers of blank nodes
+    (rdflib's parser replaces them with new ones).
+
+    """
+
+    def __init__(self):
+        NTriplesParser.__init__(self, sink=self)
+        self._triple = None
+
+    def triple(self, subject, predicate, object):
+        self._triple = (subject, predicate, object)
+
+    def nodeid(self):
+        if self.peek('_'):
+            return BNode(self.eat(r_nodeid).group(1))
+        return False
+
+    def parse_line(self, line):
+        if isinstance(line, str):
+            line = line.decode('utf-8')
+        self.line = line
+        self.parseline()
+        return self._triple
+
+
+def skolemize(triple, authority=None):
+    """Return `triple` with its blank nodes replaced by skolem IRIs."""
+    if not any(isinstance(term, BNode) for term in triple):
+        return triple
+    if authority is None:
+        return tuple(term.skolemize() if isinstance(term, BNode) else term
+                     for term in triple)
+    return tuple(term.skolemize(authority) if isinstance(term, BNode) else
+                 term for term in triple)
+
+
+def data_updates(changes, max_triples=1000, authority=None):
+    """
+    Yield DELETE DATA and INSERT DATA updates of at most `max_triples`
+    triples each making `changes`, with blank nodes skolemized with
+    `authority`.
+
+    A triple is never both deleted and inserted, so the updates may be
+    executed in any order; deleted and inserted triples are gathered into
+    updates separately, as they come.
+
+    """
+    chunks = {DELETE: [], INSERT: []}
+    for kind, triple in changes:
+        chunk = chunks[kind]
+        chunk.append(skolemize(triple, authority))
+        if len(chunk) >= max_triples:
+            yield data_update(kind, chunk)
+            chunks[kind] = []
+    for kind in (DELETE, INSERT):
+        if chunks[kind]:
+            yield data_update(kind, chunks[kind])
+
+
+def data_update(kind, triples):
+    if kind == DELETE:
+        return SPARQLUpdateQuery(delete_pattern=triples)
+    return SPARQLUpdateQuery(insert_pattern=triples)
+
+
+def sync(graph, changes, prefix_map=None, max_triples=1000, authority=None,
+         **kwargs):
+    """
+    Make `changes` to `graph` with the `data_updates()` of them, and return
+    the number of requests it took.
+
+    Other keyword arguments are passed to the `UpdateBatch` executing the
+    updates, compiled with `prefix_map`.
+
+    """
+    with UpdateBatch(graph, prefix_map, **kwargs) as batch:
+        for update in data_updates(changes, max_triples, authority):
+            batch.add(update)
+    return batch.requests
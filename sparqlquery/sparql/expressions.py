@@ -3,7 +3,8 @@ import operator
 from rdflib import Variable
 
 __all__ = ['Expression', 'BinaryExpression', 'ConditionalExpression',
-           'VariableExpressionConstructor', 'and_', 'or_']
+           'AliasExpression', 'Parameter', 'VariableExpressionConstructor',
+           'ParameterConstructor', 'and_', 'or_']
 
 unary = lambda op: lambda self: Expression(self, op)
 binary = lambda op: lambda self, other: BinaryExpression(op, self, other)
@@ -33,6 +34,7 @@ class Expression(object):
     def _clone(self, **kwargs):
         clone = self.__class__.__new__(self.__class__)
         clone.__dict__.update(self.__dict__)
+        clone.__dict__.pop('_digest', None)
         clone.__dict__.update(kwargs)
         return clone
 
@@ -45,8 +47,8 @@ class Expression(object):
         return self._clone(datatype=datatype)
 
     def compile(self, prefix_map=None):
-        from sparqlquery.sparql.compiler import ExpressionCompiler
-        return ExpressionCompiler(prefix_map).compile(self)
+        from sparqlquery.sparql.compiler import ExpressionCompiler, get_compiler
+        return get_compiler(ExpressionCompiler, prefix_map).compile(self)
 
     # Special operators.
 
@@ -100,6 +102,12 @@ class Expression(object):
     def not_in(self, *items):
         return ListExpression(self, items, inverted=True)
 
+    # Projection alias.
+
+    def as_(self, alias):
+        """Emulates (expression AS ?alias)."""
+        return AliasExpression(self, alias)
+
 
 class BinaryExpression(Expression):
     def __init__(self, operator, left, right):
@@ -133,6 +141,29 @@ class ConditionalExpression(Expression):
         return "ConditionalExpression(%r, %r)" % (self.operator, self.operands)
 
 
+class AliasExpression(Expression):
+    def __init__(self, expression, alias):
+        super(AliasExpression, self).__init__(None, None)
+        if isinstance(alias, basestring):
+            alias = Variable(alias)
+        self.expression = expression
+        self.alias = alias
+
+    def __repr__(self):
+        return "AliasExpression(%r, %r)" % (self.expression, self.alias)
+
+
+class Parameter(Expression):
+    """A value given when executing a prepared query (see `prepare`)."""
+
+    def __init__(self, name):
+        super(Parameter, self).__init__(None)
+        self.name = name
+
+    def __repr__(self):
+        return "Parameter(%r)" % (self.name,)
+
+
 def and_(*operands):
     return ConditionalExpression(operator.and_, operands)
 
@@ -176,3 +207,14 @@ class VariableExpressionConstructor(object):
 
     def __getitem__(self, name):
         return self(name)
+
+
+class ParameterConstructor(object):
+    def __call__(self, name):
+        return Parameter(name)
+
+    def __getattr__(self, name):
+        return self(name)
+
+    def __getitem__(self, name):
+        return self(name)
@@ -0,0 +1,193 @@
+"""
+Structural fingerprints and frozen snapshots of queries.
+
+`fingerprint()` hashes a canonical traversal of a query, graph pattern or
+expression: each node is digested from its class, its attributes and the
+digests of its children, so two trees have the same fingerprint exactly
+when they are built the same way, whatever their identity.  Unlike
+`Expression.__eq__`, which builds a `BinaryExpression`, this gives
+structural equality that caches can rely on.
+
+Digests are memoized on nodes that are never modified in place
+(expressions, triples and filters) and, keyed by `GraphPattern._stamp()`,
+on graph patterns.  Queries themselves are not memoized, since update
+queries can be modified in place.
+
+Trees are traversed from an explicit stack, so deeply nested expressions
+and patterns do not hit the recursion limit.
+
+"""
+import types
+from datetime import date, datetime, time
+from decimal import Decimal
+from hashlib import sha1
+from rdflib.term import Identifier
+from sparqlquery.sparql.expressions import Expression
+from sparqlquery.sparql.patterns import Triple, TriplesSameSubject
+from sparqlquery.sparql.patterns import TripleArray, Filter, GraphPattern
+from sparqlquery.sparql.patterns import CollectionPattern, InlineData
+from sparqlquery.sparql.query import SPARQLQuery
+
+__all__ = ['fingerprint', 'structurally_equal', 'snapshot']
+
+# Nodes that are never modified in place and can keep their digest.
+IMMUTABLE = (Expression, Triple, TriplesSameSubject, Filter)
+
+# Nodes digested from their instance attributes.
+NODES = IMMUTABLE + (TripleArray, InlineData, GraphPattern, SPARQLQuery)
+
+# Instance attributes that cache state rather than describe the node.
+IGNORED = frozenset(['_digest', '_fragment', '_version', '_parents',
+                     '_initialized'])
+
+SCALARS = (bool, int, long, float, Decimal, datetime, date, time)
+
+
+def term_label(obj):
+    """Return the label of `obj` if it is a term or value, else None."""
+    if obj is None:
+        return u'None'
+    elif isinstance(obj, Identifier):
+        return u'%s:%s' % (type(obj).__name__, obj.n3())
+    elif isinstance(obj, unicode):
+        return u'text:%s' % (obj,)
+    elif isinstance(obj, str):
+        return u'text:%s' % (obj.decode('utf-8', 'replace'),)
+    elif isinstance(obj, bool):
+        return u'bool:%r' % (obj,)
+    elif isinstance(obj, (int, long)):
+        return u'int:%d' % (obj,)
+    elif isinstance(obj, SCALARS):
+        return u'%s:%r' % (type(obj).__name__, obj)
+    elif isinstance(obj, (types.BuiltinFunctionType, types.FunctionType)):
+        return u'function:%s' % (obj.__name__,)
+    return None
+
+
+def parts(obj, label=term_label):
+    """Return the label of `obj` and the list of its children."""
+    leaf = label(obj)
+    if leaf is not None:
+        return leaf, ()
+    elif isinstance(obj, NODES):
+        names = sorted(name for name in obj.__dict__ if name not in IGNORED)
+        node = u'%s(%s)' % (type(obj).__name__, u','.join(names))
+        return node, [obj.__dict__[name] for name in names]
+    elif isinstance(obj, (tuple, list)):
+        if isinstance(obj, CollectionPattern):
+            name = u'CollectionPattern'
+        else:
+            name = u'sequence'
+        return u'%s[%d]' % (name, len(obj)), list(obj)
+    raise TypeError("Cannot fingerprint %r." % (obj,))
+
+
+def memoized(obj):
+    """Return the digest memoized on `obj`, or None."""
+    if isinstance(obj, IMMUTABLE):
+        return obj.__dict__.get('_digest')
+    elif isinstance(obj, GraphPattern):
+        memo = obj.__dict__.get('_digest')
+        if memo is not None and memo[0] == obj._stamp():
+            return memo[1]
+    return None
+
+
+def memoize(obj, digest):
+    if isinstance(obj, IMMUTABLE):
+        obj._digest = digest
+    elif isinstance(obj, GraphPattern):
+        obj._digest = (obj._stamp(), digest)
+
+
+def digest(node, label=None, digests=None):
+    """
+    Return the binary digest of `node` (see `fingerprint`).
+
+    A `label` function other than `term_label` may label terms and values
+    differently; the resulting digests are not memoized on nodes.
+    `digests` maps the ids of nodes already digested (and kept alive by the
+    caller) to their digest.
+
+    """
+    memo = label is None
+    label = label or term_label
+    if digests is None:
+        digests = {}
+    # Keep every digested object alive so their ids are not reused.
+    seen = []
+    pending = [(node, None)]
+    while pending:
+        obj, children = pending.pop()
+        if children is None:
+            if id(obj) in digests:
+                continue
+            value = memo and memoized(obj) or None
+            if value is None:
+                name, children = parts(obj, label)
+                if children:
+                    pending.append((obj, (name, children)))
+                    pending.extend((child, None) for child in children)
+                    continue
+                value = sha1(name.encode('utf-8')).digest()
+                if memo:
+                    memoize(obj, value)
+        else:
+            name, children = children
+            hasher = sha1(name.encode('utf-8'))
+            for child in children:
+                hasher.update(digests[id(child)])
+            value = hasher.digest()
+            if memo:
+                memoize(obj, value)
+        digests[id(obj)] = value
+        seen.append(obj)
+    return digests[id(node)]
+
+
+def fingerprint(node):
+    """
+    Return a hex digest of the structure of `node`, which may be a query,
+    graph pattern, triple, filter or expression.
+
+    Nodes built the same way get the same fingerprint.  Terms and values
+    are compared by type and value, so `Literal(1)` and `1` differ, as do
+    two queries that only differ in variable names.
+
+    """
+    return digest(node).encode('hex')
+
+
+def structurally_equal(node, other):
+    """Return whether `node` and `other` have the same fingerprint."""
+    return digest(node) == digest(other)
+
+
+def snapshot(query):
+    """
+    Return a copy of `query` that shares no graph pattern or subquery with
+    it, so that later changes to one do not affect the other.
+
+    """
+    copy = query._clone()
+    pending = [copy]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, SPARQLQuery):
+            # `_clone` only copies some of the query's graph patterns (like
+            # `_where`), not others (like a CONSTRUCT template).
+            for name, value in node.__dict__.items():
+                if isinstance(value, GraphPattern):
+                    value = value._clone()
+                    setattr(node, name, value)
+                    pending.append(value)
+        else:
+            for i, pattern in enumerate(node.patterns):
+                if isinstance(pattern, (GraphPattern, SPARQLQuery)):
+                    adopted = getattr(pattern, '_where', pattern)
+                    adopted._parents.discard(node)
+                    pattern = pattern._clone()
+                    node.patterns[i] = pattern
+                    node._adopt(pattern)
+                    pending.append(pattern)
+    return copy
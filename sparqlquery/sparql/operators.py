@@ -2,7 +2,7 @@ from operator import or_, and_, pos, neg, inv, invert
 from operator import eq, ne, lt, gt, le, ge, add, sub, mul, div, truediv
 from sparqlquery.sparql.expressions import Expression, BinaryExpression
 
-__all__ = ['Operator', 'FunctionCall', 'OperatorConstructor',
+__all__ = ['Operator', 'FunctionCall', 'Aggregate', 'OperatorConstructor',
            'BuiltinOperatorConstructor']
 
 not_ = invert
@@ -28,6 +28,18 @@ class FunctionCall(Expression):
         return "FunctionCall(%r, %r)" % (self.operator, self.arg_list)
 
 
+class Aggregate(FunctionCall):
+    def __init__(self, operator, arg_list, distinct=False, separator=None):
+        super(Aggregate, self).__init__(operator, arg_list)
+        self.distinct = distinct
+        self.separator = separator
+
+    def __repr__(self):
+        return "Aggregate(%r, %r, distinct=%r)" % (self.operator,
+                                                   self.arg_list,
+                                                   self.distinct)
+
+
 class OperatorConstructor(object):
     def __init__(self, namespace):
         self._namespace = namespace
@@ -92,6 +104,32 @@ class BuiltinOperatorConstructor(OperatorConstructor):
         params = [text, pattern] + (flags and [flags] or [])
         return Operator('regex')(*params)
 
+    # Aggregates.
+
+    def count(self, expression=None, distinct=False):
+        """COUNT(expression), or COUNT(*) if `expression` is omitted."""
+        arg_list = expression is not None and (expression,) or ()
+        return Aggregate('COUNT', arg_list, distinct=distinct)
+
+    def sum(self, expression, distinct=False):
+        return Aggregate('SUM', (expression,), distinct=distinct)
+
+    def avg(self, expression, distinct=False):
+        return Aggregate('AVG', (expression,), distinct=distinct)
+
+    def min(self, expression, distinct=False):
+        return Aggregate('MIN', (expression,), distinct=distinct)
+
+    def max(self, expression, distinct=False):
+        return Aggregate('MAX', (expression,), distinct=distinct)
+
+    def sample(self, expression, distinct=False):
+        return Aggregate('SAMPLE', (expression,), distinct=distinct)
+
+    def group_concat(self, expression, separator=None, distinct=False):
+        return Aggregate('GROUP_CONCAT', (expression,), distinct=distinct,
+                         separator=separator)
+
 
 class FunctionConstructor(object):
     def __call__(self, name):
@@ -1,7 +1,10 @@
 import warnings
+import weakref
+from itertools import izip
 from sparqlquery.sparql.expressions import and_
 
-__all__ = ['Triple', 'TriplesSameSubject', 'Filter', 'GraphPattern',
+__all__ = ['Triple', 'TriplesSameSubject', 'TripleArray', 'Filter',
+           'GraphPattern',
            'GroupGraphPattern', 'UnionGraphPattern', 'CollectionPattern',
            'union', 'optional', 'graph']
 
@@ -21,6 +24,8 @@ class CollectionPattern(tuple):
 
 
 class Triple(object):
+    _fragment = None
+
     def __init__(self, subject, predicate, object):
         self.subject = subject
         self.predicate = predicate
@@ -52,6 +57,8 @@ class TriplesBlock(object):
 
 
 class TriplesSameSubject(TriplesBlock):
+    _fragment = None
+
     def __init__(self, subject, predicate_object_list=()):
         self.subject = subject
         self.predicate_object_list = tuple(predicate_object_list)
@@ -59,6 +66,8 @@ class TriplesSameSubject(TriplesBlock):
     def _clone(self, **kwargs):
         clone = self.__class__.__new__(self.__class__)
         clone.__dict__.update(self.__dict__)
+        clone._fragment = None
+        clone.__dict__.pop('_digest', None)
         clone.__dict__.update(kwargs)
         return clone
     
@@ -87,7 +96,72 @@ class TriplesSameSubject(TriplesBlock):
         return self._clone(predicate_object_list=tuple(predicate_object_list))
 
 
+class TripleArray(TriplesBlock):
+    """
+    A block of triples stored as parallel lists of subjects, predicates and
+    objects, rather than as one `Triple` per item.
+
+    If `trusted` is true, `triples` must be 3-tuples (or rdflib triples) of
+    terms and are stored without conversion; otherwise each is converted with
+    `Triple.from_obj`.
+
+    """
+    _fragment = None
+
+    def __init__(self, triples=(), trusted=True):
+        if trusted:
+            triples = list(triples)
+            if triples:
+                subjects, predicates, objects = zip(*triples)
+            else:
+                subjects, predicates, objects = (), (), ()
+        else:
+            subjects, predicates, objects = [], [], []
+            for triple in triples:
+                triple = Triple.from_obj(triple)
+                subjects.append(triple.subject)
+                predicates.append(triple.predicate)
+                objects.append(triple.object)
+        self.subjects = list(subjects)
+        self.predicates = list(predicates)
+        self.objects = list(objects)
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def __iter__(self):
+        return izip(self.subjects, self.predicates, self.objects)
+
+    def __repr__(self):
+        return "TripleArray(<%d triples>)" % (len(self),)
+
+
+class InlineData(object):
+    """
+    A VALUES block binding `variables` to the terms of each of `rows` (None
+    leaves a variable unbound).
+
+    """
+    _fragment = None
+
+    def __init__(self, variables, rows):
+        from sparqlquery.sparql.util import to_variable, to_list
+        self.variables = tuple(map(to_variable, to_list(variables)))
+        self.rows = [tuple(row) for row in rows]
+        for row in self.rows:
+            if len(row) != len(self.variables):
+                raise ValueError("Expected %d values, got %r." %
+                                 (len(self.variables), row))
+
+    def __repr__(self):
+        return "InlineData(<%s, %d rows>)" % (
+            ' '.join(variable.n3() for variable in self.variables),
+            len(self.rows))
+
+
 class Filter(object):
+    _fragment = None
+
     def __init__(self, constraint):
         self.constraint = constraint
     
@@ -96,6 +170,13 @@ class Filter(object):
 
 
 class GraphPattern(object):
+    # Compiled fragments are cached per instance and keyed by `_stamp()`.
+    # Changing a pattern also changes the stamp of the patterns containing
+    # it (tracked weakly in `_parents`), so they are recompiled as well.
+    _fragment = None
+    _version = 0
+    _parents = None
+
     def __init__(self, patterns):
         self.patterns = []
         self.filters = []
@@ -104,10 +185,12 @@ class GraphPattern(object):
     def pattern(self, *patterns):
         from sparqlquery.sparql.query import SPARQLQuery
         for pattern in patterns:
-            if not isinstance(pattern, (Triple, SPARQLQuery,
-                                        TriplesBlock, GraphPattern)):
+            if not isinstance(pattern, (Triple, SPARQLQuery, TriplesBlock,
+                                        InlineData, GraphPattern)):
                 pattern = Triple.from_obj(pattern)
             self.patterns.append(pattern)
+            self._adopt(pattern)
+        self._changed()
     
     def filter(self, *constraints):
         constraints = list(constraints)
@@ -115,6 +198,37 @@ class GraphPattern(object):
             if isinstance(constraint, Filter):
                 constraints[i] = constraint.constraint
         self.filters.append(Filter(and_(*constraints)))
+        self._changed()
+    
+    def _adopt(self, pattern):
+        """Record this pattern as containing `pattern` (or its subquery)."""
+        if not isinstance(pattern, GraphPattern):
+            pattern = getattr(pattern, '_where', None)
+            if not isinstance(pattern, GraphPattern):
+                return
+        if pattern._parents is None:
+            pattern._parents = weakref.WeakSet()
+        pattern._parents.add(self)
+    
+    def _changed(self):
+        """Change the stamp of this pattern and of every one containing it."""
+        changed = set()
+        pending = [self]
+        while pending:
+            pattern = pending.pop()
+            if id(pattern) not in changed:
+                changed.add(id(pattern))
+                pattern._version += 1
+                if pattern._parents:
+                    pending.extend(pattern._parents)
+    
+    def _stamp(self):
+        """
+        Return a value that changes whenever this pattern, or any graph
+        pattern or subquery nested in it, is modified.
+
+        """
+        return (self._version, len(self.patterns), len(self.filters))
     
     def __nonzero__(self):
         return bool(self.patterns or self.filters)
@@ -130,15 +244,32 @@ class GraphPattern(object):
         clone.__dict__.update(self.__dict__)
         clone.patterns = self.patterns[:]
         clone.filters = self.filters[:]
+        clone._fragment = None
+        clone._parents = None
+        clone.__dict__.pop('_digest', None)
         clone.__dict__.update(kwargs)
+        for pattern in clone.patterns:
+            clone._adopt(pattern)
         return clone
     
+    @classmethod
+    def from_triples(cls, triples, trusted=True, **kwargs):
+        """
+        Return a new pattern containing `triples` as a single `TripleArray`.
+
+        If `trusted` is true, `triples` must be 3-tuples (or rdflib triples) of
+        terms, which are stored without conversion.
+
+        """
+        return cls([TripleArray(triples, trusted)], **kwargs)
+    
     @classmethod
     def from_obj(cls, obj, **kwargs):
         if isinstance(obj, GraphPattern):
             return obj._clone(**kwargs)
         else:
-            if isinstance(obj, (Triple, TriplesBlock, GraphPattern)):
+            if isinstance(obj, (Triple, TriplesBlock, InlineData,
+                                GraphPattern)):
                 obj = [obj]
             return cls(obj, **kwargs)
 
@@ -185,3 +316,15 @@ def graph(graph, *patterns):
 def filter(*filters):
     from sparqlquery.sparql.patterns import FilterGraphPattern
     return FilterGraphPattern(filters)
+
+
+def values(variables, rows):
+    """
+    Return a VALUES block binding `variables` to each of `rows`.  A single
+    variable may be given on its own, with `rows` being its values.
+
+    """
+    from sparqlquery.sparql.patterns import InlineData
+    if not isinstance(variables, (list, tuple)):
+        return InlineData([variables], [(value,) for value in rows])
+    return InlineData(variables, rows)
@@ -0,0 +1,190 @@
+"""
+A persistent cache of compiled queries, which processes can share.
+
+`CompiledQueryCache` stores compiled query strings in an sqlite database,
+keyed by a digest of the query's fingerprint, the compiler class, the
+compile options and a stamp of the prefix map and of the sparqlquery
+version:
+
+    cache = CompiledQueryCache('/var/cache/app/queries.db')
+    string = cache.compile(select, prefix_map)
+
+Queries with parameters are prepared with `prepare()`, which stores the
+template they are compiled to and returns a `PreparedQuery` made from it:
+
+    prepared = cache.prepare(template_query, prefix_map, generate=True)
+
+Queries compiled by another process (or a previous run) are read from the
+database instead of being compiled again; each process also keeps the
+strings it has read in memory.  Entries stamped with another sparqlquery
+version are never read, and `purge()` deletes them.
+
+Compilers customized with `SPARQLCompiler.register()` produce strings the
+key does not account for; use a separate database for them, or `clear()`
+it when they change.
+
+"""
+import os
+import sqlite3
+import threading
+from hashlib import sha1
+import sparqlquery
+from sparqlquery.sparql.compiler import namespace_to_uri
+
+__all__ = ['CompiledQueryCache', 'prefix_map_stamp']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS compiled (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    value TEXT NOT NULL
+)
+"""
+
+
+def prefix_map_stamp(prefix_map):
+    """Return a digest of the prefixes and namespaces in `prefix_map`."""
+    items = sorted(u'%s %s' % (prefix, namespace_to_uri(namespace))
+                   for namespace, prefix in (prefix_map or {}).iteritems())
+    return sha1(u'\n'.join(items).encode('utf-8')).hexdigest()
+
+
+class CompiledQueryCache(object):
+    """
+    A cache of compiled queries in the sqlite database at `path`.
+
+    Entries are stamped with `version`, which defaults to the version of
+    sparqlquery.
+
+    """
+    # Maximum number of compiled strings kept in memory.
+    MEMORY_SIZE = 4096
+
+    def __init__(self, path, version=sparqlquery.__version__):
+        self.path = path
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def __len__(self):
+        with self._lock:
+            cursor = self._connect().execute(
+                "SELECT COUNT(*) FROM compiled WHERE version = ?",
+                (self.version,))
+            return cursor.fetchone()[0]
+
+    def _connect(self):
+        # Connections are not shared with forked processes.
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute(SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def key(self, query, prefix_map=None, compiler_class=None, kind='query',
+            **options):
+        """
+        Return the key of `query` compiled with `compiler_class` and
+        `prefix_map`, for values of `kind` compiled with `options`.
+
+        """
+        if compiler_class is None:
+            compiler_class = query._get_compiler_class()
+        parts = [self.version, kind,
+                 '%s.%s' % (compiler_class.__module__, compiler_class.__name__),
+                 query.fingerprint(), prefix_map_stamp(prefix_map)]
+        parts.extend(sorted('%s=%r' % item for item in options.iteritems()))
+        return sha1('\n'.join(parts)).hexdigest()
+
+    def get(self, key):
+        """Return the value stored for `key`, or raise `KeyError`."""
+        with self._lock:
+            try:
+                value = self._memory[key]
+            except KeyError:
+                row = self._connect().execute(
+                    "SELECT value FROM compiled WHERE key = ? AND version = ?",
+                    (key, self.version)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    raise KeyError(key)
+                value = self._remember(key, row[0])
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store `value` for `key`."""
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO compiled (key, version, value) "
+                "VALUES (?, ?, ?)", (key, self.version, value))
+            self._remember(key, value)
+
+    def compile(self, query, prefix_map=None, compiler_class=None,
+                render_prefixes=True, canonical=False):
+        """
+        Return `query` compiled as by `SPARQLQuery.compile()`, from the cache
+        if it was compiled before.
+
+        """
+        key = self.key(query, prefix_map, compiler_class,
+                       render_prefixes=render_prefixes, canonical=canonical)
+        try:
+            return self.get(key)
+        except KeyError:
+            value = query.compile(prefix_map, compiler_class=compiler_class,
+                                  render_prefixes=render_prefixes,
+                                  canonical=canonical)
+            self.set(key, value)
+            return value
+
+    def prepare(self, query, prefix_map=None, compiler_class=None,
+                render_prefixes=True, generate=False):
+        """
+        Return `query` prepared as by `SPARQLQuery.prepare()`, from the
+        template in the cache if it was prepared before.
+
+        """
+        from sparqlquery.sparql.compiler import get_compiler
+        if compiler_class is None:
+            compiler_class = query._get_compiler_class()
+        compiler = get_compiler(compiler_class, prefix_map)
+        key = self.key(query, prefix_map, compiler_class, kind='template',
+                       render_prefixes=render_prefixes)
+        try:
+            template = self.get(key)
+        except KeyError:
+            template = compiler.template(query, render_prefixes)
+            self.set(key, template)
+        return compiler.prepared(query, template, generate)
+
+    def purge(self):
+        """Delete the entries stamped with other versions."""
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM compiled WHERE version != ?", (self.version,))
+
+    def clear(self):
+        """Delete every entry."""
+        with self._lock:
+            self._connect().execute("DELETE FROM compiled")
+            self._memory.clear()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def _remember(self, key, value):
+        if len(self._memory) >= self.MEMORY_SIZE:
+            self._memory.clear()
+        self._memory[key] = value
+        return value
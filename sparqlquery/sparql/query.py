@@ -4,7 +4,7 @@ from sparqlquery.sparql.util import to_variable, to_list
 
 
 __all__ = ['SPARQLQuery', 'SolutionModifierSupportingQuery',
-           'ProjectionSupportingQuery', 'SPARQLUpdateQuery']
+           'ProjectionSupportingQuery', 'SPARQLUpdateQuery', 'FrozenQuery']
 
 
 class SPARQLQuery(object):
@@ -60,30 +60,98 @@ class SPARQLQuery(object):
         clone._where.filter(*constraints)
         return clone
 
-    def execute(self, graph, prefix_map=None):
+    def execute(self, graph, prefix_map=None, cache=None):
         """Compile and execute this query on `graph`.
 
         If `prefix_map` is given, use it as a mapping from `rdflib.Namespace`
         instances to prefixed names to use in the compiled query.
 
+        If `cache` is given, it is a `sparqlquery.sparql.cache.ResultCache`
+        to return the results from if this query was already executed on
+        `graph` since it was last updated.
+
         """
-        return graph.query(unicode(self.compile(prefix_map)))
+        if cache is not None:
+            return cache.execute(self, graph, prefix_map)
+        return self._execute(graph, unicode(self.compile(prefix_map)))
+
+    def _execute(self, graph, compiled):
+        """Execute the `compiled` string of this query on `graph`."""
+        return graph.query(compiled)
 
     def _get_compiler_class(self):
         from sparqlquery.sparql.compiler import QueryCompiler
         return QueryCompiler
 
     def compile(self, prefix_map=None, compiler_class=None,
-                render_prefixes=True):
+                render_prefixes=True, canonical=False):
         """Compile this query and return the resulting string.
 
         If `prefix_map` is given, use it as a mapping from `rdflib.Namespace`
         instances to prefixed names to use in the compiled query.
 
+        The compiler is shared with every other query compiled with the same
+        `compiler_class` and an equal `prefix_map` (see `get_compiler`).
+
+        If `canonical` is true, compile the canonical form of this query
+        instead, ignoring `prefix_map` (see `QueryCompiler.compile`).
+
+        """
+        from sparqlquery.sparql.compiler import get_compiler
+        if compiler_class is None:
+            compiler_class = self._get_compiler_class()
+        compiler = get_compiler(compiler_class, prefix_map)
+        return compiler.compile(self, render_prefixes=render_prefixes,
+                                canonical=canonical)
+
+    def etag(self, compiler_class=None):
+        """
+        Return a hex digest of the canonical form of this query, suitable
+        as an HTTP cache validator (see `QueryCompiler.etag`).
+
+        """
+        from sparqlquery.sparql.compiler import get_compiler
+        if compiler_class is None:
+            compiler_class = self._get_compiler_class()
+        return get_compiler(compiler_class).etag(self)
+
+    def prepare(self, prefix_map=None, compiler_class=None,
+                render_prefixes=True, generate=False):
+        """Compile this query, which may contain parameters (see `param`),
+        and return a `PreparedQuery` to bind their values with.
+
+        If `generate` is true, a Python function binding the values is
+        generated for the query.
+
         """
-        compiler_class = self._get_compiler_class()
-        compiler = compiler_class(prefix_map)
-        return compiler.compile(self, render_prefixes=render_prefixes)
+        from sparqlquery.sparql.compiler import get_compiler
+        if compiler_class is None:
+            compiler_class = self._get_compiler_class()
+        compiler = get_compiler(compiler_class, prefix_map)
+        return compiler.prepare(self, render_prefixes=render_prefixes,
+                                generate=generate)
+
+    def fingerprint(self):
+        """Return a hex digest of the structure of this query.
+
+        Queries built the same way have the same fingerprint (see
+        `sparqlquery.sparql.fingerprint`).
+
+        """
+        from sparqlquery.sparql.fingerprint import fingerprint
+        return fingerprint(self)
+
+    def structurally_equal(self, other):
+        """Return whether `other` is a query built the same way as this one."""
+        from sparqlquery.sparql.fingerprint import structurally_equal
+        if isinstance(other, FrozenQuery):
+            other = other.query
+        return (isinstance(other, SPARQLQuery) and
+                structurally_equal(self, other))
+
+    def freeze(self):
+        """Return a hashable `FrozenQuery` snapshot of this query."""
+        return FrozenQuery(self)
 
 
 class SolutionModifierSupportingQuery(SPARQLQuery):
@@ -195,6 +263,13 @@ class SPARQLUpdateQuery(SPARQLQuery):
         # between absent delete and delete without arguments (empty_delete)
         self.empty_delete = False
 
+    def _clone(self, **kwargs):
+        clone = super(SPARQLUpdateQuery, self)._clone()
+        clone._delete = self._delete._clone()
+        clone._insert = self._insert._clone()
+        clone.__dict__.update(kwargs)
+        return clone
+
     def insert(self, pattern, return_clone=True):
         clone = self._clone() if return_clone else self
         if not isinstance(pattern, GroupGraphPattern):
@@ -213,8 +288,83 @@ class SPARQLUpdateQuery(SPARQLQuery):
         return clone
 
     def execute(self, graph, prefix_map=None):
-        graph.update(unicode(self.compile(prefix_map)))
+        """Compile and execute this update on `graph`.
+
+        Results cached for `graph` (see `sparqlquery.sparql.cache`) are
+        invalidated.
+
+        """
+        self._execute(graph, unicode(self.compile(prefix_map)))
+
+    def _execute(self, graph, compiled):
+        from sparqlquery.sparql.cache import invalidate
+        try:
+            graph.update(compiled)
+        finally:
+            invalidate(graph)
 
     def _get_compiler_class(self):
         from sparqlquery.sparql.compiler import UpdateCompiler
         return UpdateCompiler
+
+
+class FrozenQuery(object):
+    """
+    A hashable snapshot of a `SPARQLQuery`.
+
+    Frozen queries hash and compare by fingerprint, so they can be used as
+    dictionary keys.  The snapshot shares no graph pattern with the query it
+    was made from; use `thaw()` to get a query that can be built on.
+
+    """
+
+    def __init__(self, query):
+        from sparqlquery.sparql.fingerprint import snapshot
+        if isinstance(query, FrozenQuery):
+            query = query.query
+        self.query = snapshot(query)
+        self._fingerprint = None
+
+    def __repr__(self):
+        return "FrozenQuery(<%s %s>)" % (self.query.__class__.__name__,
+                                         self.fingerprint())
+
+    def __hash__(self):
+        return hash(self.fingerprint())
+
+    def __eq__(self, other):
+        return (isinstance(other, FrozenQuery) and
+                self.fingerprint() == other.fingerprint())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def fingerprint(self):
+        """Return a hex digest of the structure of the frozen query."""
+        if self._fingerprint is None:
+            self._fingerprint = self.query.fingerprint()
+        return self._fingerprint
+
+    def structurally_equal(self, other):
+        """Return whether `other` is a query built the same way as this one."""
+        return self.query.structurally_equal(other)
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        """Return a copy of the frozen query that can be built on."""
+        from sparqlquery.sparql.fingerprint import snapshot
+        return snapshot(self.query)
+
+    def compile(self, prefix_map=None, compiler_class=None,
+                render_prefixes=True, canonical=False):
+        return self.query.compile(prefix_map, compiler_class=compiler_class,
+                                  render_prefixes=render_prefixes,
+                                  canonical=canonical)
+
+    def etag(self, compiler_class=None):
+        return self.query.etag(compiler_class)
+
+    def execute(self, graph, prefix_map=None, cache=None):
+        return self.query.execute(graph, prefix_map, cache=cache)
@@ -1,4 +1,5 @@
 from sparqlquery.exceptions import InvalidRequestError
+from sparqlquery.sparql.expressions import and_
 from sparqlquery.sparql.query import SPARQLQuery
 from sparqlquery.sparql.query import SolutionModifierSupportingQuery
 from sparqlquery.sparql.query import ProjectionSupportingQuery
@@ -38,7 +39,8 @@ class Select(ProjectionSupportingQuery):
     query_form = 'SELECT'
 
     def __init__(self, projection, pattern=None, distinct=False,
-                 reduced=False, order_by=None, limit=None, offset=None):
+                 reduced=False, order_by=None, limit=None, offset=None,
+                 group_by=None, having=None):
         super(Select, self).__init__(projection, pattern, order_by=order_by,
                                      limit=limit, offset=offset)
         if distinct and reduced:
@@ -46,6 +48,8 @@ class Select(ProjectionSupportingQuery):
             raise InvalidRequestError(msg)
         self._distinct = distinct
         self._reduced = reduced
+        self._group_by = group_by
+        self._having = having
 
     def _get_compiler_class(self):
         from sparqlquery.sparql.compiler import SelectCompiler
@@ -72,6 +76,28 @@ class Select(ProjectionSupportingQuery):
         return self._clone(_reduced=flag,
                            _distinct=not flag and self._distinct)
 
+    def group_by(self, *expressions):
+        """Return a new `Select` with a GROUP BY clause.
+
+        Each argument may be a variable, a function call or an expression
+        (optionally aliased with `Expression.as_`).  If no arguments are
+        given, the query will not have a GROUP BY clause.
+
+        """
+        return self._clone(_group_by=expressions or None)
+
+    def having(self, *constraints):
+        """Return a new `Select` with a HAVING clause.
+
+        All constraints given in a single call to this method will be combined
+        (with '&&') into a single conditional expression.  If no arguments are
+        given, the query will not have a HAVING clause.
+
+        """
+        if constraints:
+            return self._clone(_having=and_(*constraints))
+        return self._clone(_having=None)
+
 
 class Describe(ProjectionSupportingQuery):
     """ Programmatically build a SPARQL DESCRIBE query. """
@@ -0,0 +1,174 @@
+"""
+A registry of named queries, compiled once on first use.
+
+Applications declare the queries they run at import time, as queries or
+as functions returning them, with `Parameter`s (see `param`) for the values
+that change between executions:
+
+    queries = QueryRegistry(PREFIX_MAP)
+    queries.register('patient', lambda: Select([v.patient]).where(
+        (v.patient, PTREC.hasCCFID, param.ccfid)))
+
+    results = queries.execute('patient', graph, ccfid=ccfid)
+
+Nothing is built or compiled until a query is first used; it is then
+prepared (see `SPARQLQuery.prepare`) exactly once, even when first used by
+several threads at the same time, and later executions only call the binder
+function generated for it with the parameter values.  Each `NamedQuery`
+counts its calls and the time spent compiling and executing it;
+`QueryRegistry.stats()` collects those counters.
+
+A registry given a `CompiledQueryCache` prepares its queries from the
+templates stored in it, so that processes sharing the cache compile each
+query once between them:
+
+    queries = QueryRegistry(PREFIX_MAP, cache=CompiledQueryCache(path))
+
+"""
+import threading
+from timeit import default_timer
+from sparqlquery.exceptions import InvalidRequestError
+from sparqlquery.sparql.query import SPARQLQuery
+
+__all__ = ['QueryRegistry', 'NamedQuery']
+
+
+class NamedQuery(object):
+    """
+    A query (or function returning a query) prepared on first use.
+
+    `calls` is the number of times it was compiled or executed,
+    `compile_time` the seconds spent preparing it and `execute_time` the
+    seconds spent binding its parameters and executing it.
+
+    """
+
+    def __init__(self, name, query, prefix_map=None, compiler_class=None,
+                 cache=None):
+        self.name = name
+        self.prefix_map = prefix_map
+        self.compiler_class = compiler_class
+        self.cache = cache
+        self.calls = 0
+        self.compile_time = 0.0
+        self.execute_time = 0.0
+        self._query = query
+        self._prepared = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "NamedQuery(%r)" % (self.name,)
+
+    @property
+    def query(self):
+        return self.prepare().query
+
+    def prepare(self):
+        """Return the `PreparedQuery`, preparing it on the first call."""
+        prepared = self._prepared
+        if prepared is None:
+            with self._lock:
+                prepared = self._prepared
+                if prepared is None:
+                    start = default_timer()
+                    query = self._query
+                    if not isinstance(query, SPARQLQuery):
+                        query = query()
+                    if self.cache is not None:
+                        prepared = self.cache.prepare(query, self.prefix_map,
+                                                      self.compiler_class,
+                                                      generate=True)
+                    else:
+                        prepared = query.prepare(self.prefix_map,
+                                                 self.compiler_class,
+                                                 generate=True)
+                    self.compile_time += default_timer() - start
+                    self._prepared = prepared
+        return prepared
+
+    def compile(self, **values):
+        """Return the compiled query with the given parameter values."""
+        prepared = self.prepare()
+        start = default_timer()
+        try:
+            return prepared.bind(**values)
+        finally:
+            self._count(default_timer() - start)
+
+    def execute(self, graph, **values):
+        """Execute the query on `graph` with the given parameter values."""
+        prepared = self.prepare()
+        start = default_timer()
+        try:
+            return prepared.execute(graph, **values)
+        finally:
+            self._count(default_timer() - start)
+
+    def stats(self):
+        return {'calls': self.calls, 'compile_time': self.compile_time,
+                'execute_time': self.execute_time}
+
+    def _count(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.execute_time += seconds
+
+
+class QueryRegistry(object):
+    """
+    Named queries compiled with `prefix_map` (unless registered with their
+    own), and prepared from `cache`, a `CompiledQueryCache`, if given.
+
+    """
+
+    def __init__(self, prefix_map=None, cache=None):
+        self.prefix_map = prefix_map
+        self.cache = cache
+        self.queries = {}
+
+    def __contains__(self, name):
+        return name in self.queries
+
+    def __getitem__(self, name):
+        try:
+            return self.queries[name]
+        except KeyError:
+            raise InvalidRequestError("No query named %r." % (name,))
+
+    def __iter__(self):
+        return iter(sorted(self.queries))
+
+    def register(self, name, query, prefix_map=None, compiler_class=None):
+        """
+        Register `query`, a query or a function returning one, as `name` and
+        return its `NamedQuery`.
+
+        """
+        if name in self.queries:
+            raise InvalidRequestError("A query named %r is already "
+                                      "registered." % (name,))
+        if prefix_map is None:
+            prefix_map = self.prefix_map
+        named = NamedQuery(name, query, prefix_map, compiler_class,
+                           self.cache)
+        self.queries[name] = named
+        return named
+
+    def query(self, name, prefix_map=None, compiler_class=None):
+        """Return a decorator registering a function returning a query."""
+        def register(function):
+            self.register(name, function, prefix_map, compiler_class)
+            return function
+        return register
+
+    # The name of the query is not `name`, a likely parameter name.
+    def compile(self, query_name, **values):
+        return self[query_name].compile(**values)
+
+    def execute(self, query_name, graph, **values):
+        return self[query_name].execute(graph, **values)
+
+    def stats(self):
+        """Return the counters of each query, by name."""
+        return dict((name, named.stats())
+                    for name, named in self.queries.iteritems())
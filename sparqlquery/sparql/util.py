@@ -1,6 +1,6 @@
 from rdflib import Variable
 
-from sparqlquery.sparql.expressions import Expression
+from sparqlquery.sparql.expressions import Expression, AliasExpression
 from sparqlquery.sparql.operators import FunctionCall
 
 
@@ -28,7 +28,7 @@ def to_qname(uri, prefix_map):
 
 
 def to_variable(obj):
-    if isinstance(obj, FunctionCall):
+    if isinstance(obj, (FunctionCall, AliasExpression)):
         return obj
     while isinstance(obj, Expression):
         obj = obj.value
@@ -0,0 +1,286 @@
+"""
+Materialized views of SELECT queries over rdflib graphs.
+
+`materialize(select, graph)` executes `select` once and then keeps its
+results up to date as triples are added to or removed from `graph`:
+
+    view = materialize(Select([v.name]).where((v.x, FOAF.name, v.name)),
+                       graph)
+    graph.add((alice, FOAF.name, Literal("Alice")))
+    assert (Literal("Alice"),) in view.rows
+
+The view hooks the `add`, `addN` and `remove` methods of the graph's store
+(rdflib's default store does not dispatch events for removed triples), so
+changes made through the graph, through other graphs sharing its store and
+through update queries are all seen.
+
+Only basic graph patterns are supported: triples, groups of triples and
+filters on the outermost group, projected by plain variables.  The results
+are kept as the number of solutions producing each projected row.  When a
+triple is added or removed, only the solutions using it are evaluated, by
+binding each triple pattern it matches in turn to the triple.
+
+"""
+import weakref
+from collections import Counter
+from rdflib import Variable, Literal
+from rdflib.graph import ConjunctiveGraph
+from rdflib.store import Store
+from rdflib.term import Identifier
+from sparqlquery.exceptions import NotSupportedError
+from sparqlquery.sparql.expressions import Expression, VariableExpression
+from sparqlquery.sparql.patterns import Triple, TriplesSameSubject
+from sparqlquery.sparql.patterns import GraphPattern, GroupGraphPattern
+from sparqlquery.sparql.queryforms import Select
+from sparqlquery.sparql.util import to_list
+
+__all__ = ['MaterializedView', 'materialize']
+
+
+def materialize(select, graph, prefix_map=None):
+    """Return a `MaterializedView` of the results of `select` on `graph`."""
+    return MaterializedView(select, graph, prefix_map)
+
+
+def to_term(obj):
+    """Return `obj` as an rdflib term (or variable)."""
+    if isinstance(obj, Expression):
+        if type(obj) not in (Expression, VariableExpression) or \
+                obj.operator is not None:
+            raise NotSupportedError("Cannot materialize term: %r" % (obj,))
+        if obj.language or obj.datatype:
+            return Literal(obj.value, lang=obj.language,
+                           datatype=obj.datatype)
+        obj = obj.value
+    if isinstance(obj, Identifier):
+        return obj
+    elif isinstance(obj, tuple) or obj is None:
+        raise NotSupportedError("Cannot materialize term: %r" % (obj,))
+    return Literal(obj)
+
+
+def basic_graph_pattern(select):
+    """
+    Return the triples (as tuples of terms) and filters of `select`, or raise
+    `NotSupportedError` if it is not a basic graph pattern.
+
+    """
+    for name in ('_order_by', '_limit', '_offset', '_group_by', '_having'):
+        if getattr(select, name, None):
+            raise NotSupportedError("Cannot materialize a query with %s." %
+                                    (name.strip('_').replace('_', ' '),))
+    where = select._where
+    triples = []
+    pending = [where]
+    while pending:
+        pattern = pending.pop()
+        if isinstance(pattern, Triple):
+            triples.append(tuple(map(to_term, pattern)))
+        elif isinstance(pattern, TriplesSameSubject):
+            subject = to_term(pattern.subject)
+            for predicate, objects in pattern.predicate_object_list:
+                for object in to_list(objects):
+                    triples.append((subject, to_term(predicate),
+                                    to_term(object)))
+        elif type(pattern) in (GraphPattern, GroupGraphPattern) and \
+                not getattr(pattern, 'optional', False) and \
+                (pattern is where or not pattern.filters):
+            pending.extend(reversed(pattern.patterns))
+        else:
+            raise NotSupportedError("Cannot materialize pattern: %r" %
+                                    (pattern,))
+    return triples, [filter.constraint for filter in where.filters]
+
+
+def match(pattern, triple):
+    """Return the bindings making `pattern` match `triple`, or None."""
+    bindings = {}
+    for term, value in zip(pattern, triple):
+        if isinstance(term, Variable):
+            if bindings.setdefault(term, value) != value:
+                return None
+        elif term != value:
+            return None
+    return bindings
+
+
+def substitute(pattern, solution):
+    return tuple(solution.get(term) if isinstance(term, Variable) else term
+                 for term in pattern)
+
+
+class StoreHook(object):
+    """
+    Wraps the methods adding and removing triples of a store, to tell the
+    views of graphs on that store which triples were added or removed.
+
+    """
+
+    def __init__(self, store):
+        self.views = weakref.WeakSet()
+        self.add = store.add
+        self.remove = store.remove
+        store.add = self.hooked_add
+        store.remove = self.hooked_remove
+        # The default `Store.addN` calls `add` for each triple.
+        if type(store).addN.im_func is not Store.addN.im_func:
+            self.addN = store.addN
+            store.addN = self.hooked_addN
+
+    @classmethod
+    def install(cls, store):
+        """Return the hook installed on `store`, installing one if needed."""
+        hook = getattr(store.add, '__self__', None)
+        if isinstance(hook, cls):
+            return hook
+        return cls(store)
+
+    def hooked_add(self, triple, context, quoted=False):
+        added = [(view, view.new([triple], context)) for view in self.views]
+        self.add(triple, context, quoted)
+        for view, triples in added:
+            view.added(triples)
+
+    def hooked_addN(self, quads):
+        quads = list(quads)
+        added = []
+        for view in self.views:
+            triples = []
+            for s, p, o, context in quads:
+                triples.extend(view.new([(s, p, o)], context))
+            added.append((view, triples))
+        self.addN(quads)
+        for view, triples in added:
+            view.added(triples)
+
+    def hooked_remove(self, triple, context=None):
+        for view in list(self.views):
+            view.removing(triple, context)
+        self.remove(triple, context)
+
+
+class MaterializedView(object):
+    """
+    The results of a SELECT query on an rdflib graph, kept up to date as the
+    graph changes.
+
+    `rows` holds the result rows, as tuples of terms in the order of
+    `variables`.  Call `close()` to stop updating the view.
+
+    """
+
+    def __init__(self, select, graph, prefix_map=None):
+        if not isinstance(select, Select) or '*' in map(unicode,
+                                                        select.projection):
+            raise NotSupportedError("Only SELECT queries projecting "
+                                    "variables can be materialized.")
+        self.triples, filters = basic_graph_pattern(select)
+        self.variables = list(select.projection)
+        for variable in self.variables:
+            if not isinstance(variable, Variable):
+                raise NotSupportedError("Cannot materialize projection: %r" %
+                                        (variable,))
+        self.distinct = select._distinct
+        self.graph = graph
+        # Every solution is selected, with all its variables, and projected
+        # when counted.
+        solution_variables = []
+        for pattern in self.triples:
+            for term in pattern:
+                if isinstance(term, Variable) and \
+                        term not in solution_variables:
+                    solution_variables.append(term)
+        solutions = Select(solution_variables).where(*self.triples)
+        if filters:
+            solutions = solutions.filter(*filters)
+        self.query = unicode(solutions.compile(prefix_map))
+        self.counts = Counter()
+        self.refresh()
+        self._hook = StoreHook.install(graph.store)
+        self._hook.views.add(self)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def rows(self):
+        if self.distinct:
+            return list(self.counts)
+        return list(self.counts.elements())
+
+    def refresh(self):
+        """Execute the query again and replace the results."""
+        self.counts = Counter()
+        self.count(self.graph.query(self.query), 1)
+
+    def close(self):
+        """Stop updating the results of this view."""
+        self._hook.views.discard(self)
+
+    def count(self, results, sign, triple=None, position=0, excluded=()):
+        """
+        Add `sign` to the count of the rows projected from `results`.
+
+        If `triple` is given, skip solutions where a triple pattern before
+        `position` or any triple pattern matches `triple` or one of the
+        `excluded` triples (solutions counted for those already).
+
+        """
+        for result in results:
+            solution = dict(zip(results.vars, result))
+            if triple is not None:
+                substituted = [substitute(pattern, solution)
+                               for pattern in self.triples]
+                if triple in substituted[:position] or \
+                        any(t in excluded for t in substituted):
+                    continue
+            row = tuple(solution.get(variable)
+                        for variable in self.variables)
+            self.counts[row] += sign
+            if self.counts[row] <= 0:
+                del self.counts[row]
+
+    def delta(self, triples, sign):
+        """
+        Add `sign` to the count of the solutions using `triples`, which must
+        all be in the graph.
+
+        """
+        counted = set()
+        for triple in triples:
+            for position, pattern in enumerate(self.triples):
+                bindings = match(pattern, triple)
+                if bindings is not None:
+                    results = self.graph.query(self.query,
+                                               initBindings=bindings)
+                    self.count(results, sign, triple, position, counted)
+            counted.add(triple)
+
+    def contains_context(self, context):
+        if isinstance(self.graph, ConjunctiveGraph) or context is None:
+            return True
+        identifier = getattr(context, 'identifier', context)
+        return identifier == self.graph.identifier
+
+    def new(self, triples, context):
+        """Return those of `triples` added to `context` that are new here."""
+        if not self.contains_context(context):
+            return []
+        return [triple for triple in triples if triple not in self.graph]
+
+    def added(self, triples):
+        self.delta(set(triples), 1)
+
+    def removing(self, pattern, context):
+        """Count out the solutions using triples about to be removed."""
+        if not self.contains_context(context):
+            return
+        triples = list(self.graph.triples(pattern))
+        if context is not None and isinstance(self.graph, ConjunctiveGraph):
+            # Triples in other contexts stay in the graph.
+            triples = [triple for triple in triples
+                       if len(list(self.graph.contexts(triple))) == 1]
+        self.delta(triples, -1)
@@ -0,0 +1,143 @@
+from nose.tools import assert_raises
+from rdflib import Graph, Literal, Namespace, URIRef
+from sparqlquery.sparql.queryforms import Select
+from sparqlquery.sparql.query import SPARQLUpdateQuery
+from sparqlquery.sparql.cache import ResultCache, graph_version, invalidate
+from sparqlquery.sparql.helpers import *
+import helpers
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+
+
+class Endpoint(object):
+    """A stand-in for an endpoint handle, counting the queries it runs."""
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(query)
+        return [len(self.queries)]
+
+    def update(self, query):
+        pass
+
+
+class Clock(object):
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+def select(name="Alice"):
+    return Select([v.x]).where((v.x, FOAF.name, name))
+
+
+class TestCachingResults:
+    def setup(self):
+        self.endpoint = Endpoint()
+        self.clock = Clock()
+        self.cache = ResultCache(max_entries=2, ttl=10, clock=self.clock,
+                                 sizeof=lambda result: 1)
+
+    def test_same_query_is_executed_once(self):
+        a = select().execute(self.endpoint, cache=self.cache)
+        b = select().execute(self.endpoint, cache=self.cache)
+        assert a is b
+        assert len(self.endpoint.queries) == 1
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_frozen_query_shares_results(self):
+        a = select().execute(self.endpoint, cache=self.cache)
+        assert select().freeze().execute(self.endpoint, cache=self.cache) is a
+
+    def test_different_graphs_have_different_results(self):
+        other = Endpoint()
+        select().execute(self.endpoint, cache=self.cache)
+        select().execute(other, cache=self.cache)
+        assert len(other.queries) == 1
+
+    def test_update_invalidates_results(self):
+        select().execute(self.endpoint, cache=self.cache)
+        SPARQLUpdateQuery().insert([(FOAF.a, FOAF.name, "Alice")]) \
+            .execute(self.endpoint)
+        assert len(self.cache) == 0
+        select().execute(self.endpoint, cache=self.cache)
+        assert len(self.endpoint.queries) == 2
+
+    def test_invalidate_bumps_graph_version(self):
+        version = graph_version(self.endpoint)
+        invalidate(self.endpoint)
+        assert graph_version(self.endpoint) == (version[0], version[1] + 1)
+
+    def test_least_recently_used_results_are_evicted(self):
+        select("Alice").execute(self.endpoint, cache=self.cache)
+        select("Bob").execute(self.endpoint, cache=self.cache)
+        select("Alice").execute(self.endpoint, cache=self.cache)
+        select("Carol").execute(self.endpoint, cache=self.cache)
+        assert len(self.cache) == 2
+        select("Alice").execute(self.endpoint, cache=self.cache)
+        assert len(self.endpoint.queries) == 3
+        select("Bob").execute(self.endpoint, cache=self.cache)
+        assert len(self.endpoint.queries) == 4
+
+    def test_results_expire(self):
+        select().execute(self.endpoint, cache=self.cache)
+        self.clock.time = 10
+        select().execute(self.endpoint, cache=self.cache)
+        assert len(self.endpoint.queries) == 2
+
+    def test_results_expire_at_time_zero(self):
+        cache = ResultCache(ttl=0, clock=self.clock, sizeof=lambda result: 1)
+        select().execute(self.endpoint, cache=cache)
+        select().execute(self.endpoint, cache=cache)
+        assert len(self.endpoint.queries) == 2
+
+    def test_results_are_evicted_over_max_size(self):
+        cache = ResultCache(max_size=2, sizeof=lambda result: 1)
+        for name in ("Alice", "Bob", "Carol"):
+            select(name).execute(self.endpoint, cache=cache)
+        assert (len(cache), cache.size) == (2, 2)
+        cache = ResultCache(max_size=0, sizeof=lambda result: 1)
+        select().execute(self.endpoint, cache=cache)
+        assert len(cache) == 0
+
+    def test_get_missing_key_raises_key_error(self):
+        assert_raises(KeyError, self.cache.get, 'missing')
+
+    def test_clear(self):
+        select().execute(self.endpoint, cache=self.cache)
+        self.cache.clear()
+        assert (len(self.cache), self.cache.size) == (0, 0)
+
+
+class TestCachingGraphResults:
+    def setup(self):
+        self.graph = helpers.graph('foaf-01.rdf')
+        self.cache = ResultCache()
+
+    def test_select_results_can_be_iterated_again(self):
+        query = Select([v.name]).where((v.x, FOAF.name, v.name))
+        rows = list(query.execute(self.graph, cache=self.cache))
+        assert rows
+        assert list(query.execute(self.graph, cache=self.cache)) == rows
+        assert self.cache.size > 0
+
+    def test_update_on_graph_refreshes_results(self):
+        query = Select([v.x]).where((v.x, FOAF.name, "Mary Jane"))
+        assert not list(query.execute(self.graph, cache=self.cache))
+        subject = URIRef('http://example.org/mj')
+        SPARQLUpdateQuery().insert([(subject, FOAF.name, "Mary Jane")]) \
+            .execute(self.graph)
+        assert len(query.execute(self.graph, cache=self.cache)) == 1
+
+    def test_graphs_with_the_same_identifier_have_different_results(self):
+        full = Graph(identifier=URIRef('urn:g'))
+        full.add((URIRef('urn:a'), FOAF.name, Literal("Alice")))
+        empty = Graph(identifier=URIRef('urn:g'))
+        query = select()
+        assert len(query.execute(full, cache=self.cache)) == 1
+        assert len(query.execute(empty, cache=self.cache)) == 0
+        assert graph_version(full) != graph_version(empty)
@@ -0,0 +1,102 @@
+from sparqlquery import Namespace
+from sparqlquery.sparql.patterns import *
+from sparqlquery.sparql.queryforms import Select, Ask, Construct
+from sparqlquery.sparql.compiler import QueryCompiler
+from sparqlquery.sparql.canonical import canonicalize
+from sparqlquery.sparql.helpers import *
+import helpers
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+
+
+def friends(person, friend, mbox):
+    return Select([v.name]).where(
+        (v[person], FOAF.name, v.name),
+        (v[person], FOAF.knows, v[friend]),
+        optional((v[friend], FOAF.mbox, v[mbox]))
+    ).filter(v.name != "Bob")
+
+
+class TestCanonicalizingQueries:
+    def test_variable_names_do_not_change_canonical_form(self):
+        a = friends('p', 'q', 'm').compile(canonical=True)
+        b = friends('person', 'friend', 'mbox').compile(canonical=True)
+        assert a == b
+
+    def test_triple_and_filter_order_do_not_change_canonical_form(self):
+        a = Select([v.name]).where(
+            (v.x, FOAF.name, v.name), (v.x, FOAF.age, v.age)
+        ).filter(v.age > 18).filter(v.name != "Bob")
+        b = Select([v.name]).where(
+            (v.y, FOAF.age, v.years), (v.y, FOAF.name, v.name)
+        ).filter(v.name != "Bob").filter(v.years > 18)
+        assert a.compile(canonical=True) == b.compile(canonical=True)
+        assert a.etag() == b.etag()
+
+    def test_prefix_map_does_not_change_canonical_form(self):
+        a = friends('p', 'q', 'm').compile({FOAF: 'foaf'}, canonical=True)
+        b = friends('p', 'q', 'm').compile({FOAF: 'f'}, canonical=True)
+        assert a == b
+        assert a.startswith('PREFIX rdf:')
+        assert 'foaf:' not in a
+
+    def test_union_alternatives_are_sorted(self):
+        a = Ask().where(union([(v.a, is_a, FOAF.Person)],
+                              [(v.a, FOAF.name, "Alice")]))
+        b = Ask().where(union([(v.a, FOAF.name, "Alice")],
+                              [(v.a, is_a, FOAF.Person)]))
+        assert a.etag() == b.etag()
+
+    def test_optional_patterns_are_not_reordered(self):
+        a = Select([v.x]).where(optional((v.x, FOAF.name, v.name)),
+                                (v.x, FOAF.age, v.age))
+        b = Select([v.x]).where((v.x, FOAF.age, v.age),
+                                optional((v.x, FOAF.name, v.name)))
+        assert a.etag() != b.etag()
+
+    def test_projected_variables_are_not_renamed(self):
+        select = Select([v.name, op.count(v.x).as_('total')]).where(
+            (v.x, FOAF.name, v.name)
+        ).group_by(v.name)
+        output = select.compile(canonical=True)
+        assert '(COUNT(?v0) AS ?total)' in output
+        assert 'GROUP BY ?name' in output
+
+    def test_renamed_variables_skip_projected_names(self):
+        select = Select([v.v0]).where((v.x, FOAF.knows, v.v0))
+        output = select.compile(canonical=True)
+        assert '?v1 <http://xmlns.com/foaf/0.1/knows> ?v0' in output
+
+    def test_select_star_keeps_variable_names(self):
+        select = Select('*').where((v.x, FOAF.name, v.name))
+        assert '?x' in select.compile(canonical=True)
+
+    def test_different_queries_have_different_etags(self):
+        assert friends('p', 'q', 'm').etag() != \
+            friends('p', 'q', 'm').limit(1).etag()
+
+    def test_canonicalizing_does_not_change_query(self):
+        template = GroupGraphPattern([(v.y, FOAF.name, v.name),
+                                      (v.x, FOAF.knows, v.y)])
+        query = Construct(template).where((v.y, FOAF.name, v.name),
+                                          (v.x, FOAF.knows, v.y))
+        before = query.compile()
+        canonical = canonicalize(query)
+        assert query.compile() == before
+        assert template.patterns[0].subject is v.y
+        assert canonical.compile() != before
+
+    def test_canonical_query_has_same_results(self):
+        graph = helpers.graph('foaf-02.rdf')
+        select = friends('p', 'q', 'm')
+        results = graph.query(select.compile(canonical=True))
+        assert len(results)
+        assert sorted(results) == sorted(select.execute(graph))
+
+    def test_compiler_uses_canonical_prefix_map(self):
+        compiler = QueryCompiler({FOAF: 'foaf'})
+        output = compiler.compile(Ask().where((v.x, FOAF.name, v.y)),
+                                  canonical=True)
+        prefixes = [line for line in output.split('\n')
+                    if line.startswith('PREFIX')]
+        assert len(prefixes) == len(QueryCompiler.CANONICAL_PREFIX_MAP)
@@ -1,6 +1,8 @@
 import re
+from datetime import date, datetime
 from nose.tools import assert_raises, assert_equal
 from rdflib import Variable, Namespace, Literal, URIRef
+from sparqlquery.exceptions import CompileError
 from sparqlquery.sparql.expressions import Expression
 from sparqlquery.sparql import operators
 from sparqlquery.sparql.operators import Operator, FunctionCall
@@ -444,3 +446,286 @@ FILTER (?x < 10)
             }
             """
         )
+
+
+class TestCompilingAggregate(CompilingExpressionBase):
+    def test_compiling_aggregate_outputs_function_syntax(self):
+        for name in ('sum', 'avg', 'min', 'max', 'sample'):
+            expr = getattr(op, name)(v.x)
+            output = self.compiler.compile(expr)
+            assert_equal(output, '%s(?x)' % name.upper())
+
+    def test_compiling_count_without_args_outputs_asterisk(self):
+        assert_equal(self.compiler.compile(op.count()), 'COUNT(*)')
+
+    def test_compiling_distinct_aggregate_outputs_distinct_keyword(self):
+        expr = op.count(v.x, distinct=True)
+        assert_equal(self.compiler.compile(expr), 'COUNT(DISTINCT ?x)')
+
+    def test_compiling_group_concat_outputs_separator(self):
+        expr = op.group_concat(v.name, separator=', ')
+        assert_equal(self.compiler.compile(expr),
+                     'GROUP_CONCAT(?name; SEPARATOR=", ")')
+
+    def test_compiling_alias_outputs_bracketed_as(self):
+        expr = op.count(v.x).as_(v.n)
+        assert_equal(self.compiler.compile(expr), '(COUNT(?x) AS ?n)')
+
+    def test_alias_name_can_be_string(self):
+        expr = (v.x + 1).as_('y')
+        assert_equal(self.compiler.compile(expr), '(?x + 1 AS ?y)')
+
+
+class TestCompilingSelectAggregates(CompilingSelectBase):
+    def test_compiling_aliased_projection(self):
+        select = Select([v.x, op.count(v.y).as_(v.n)])
+        assert tokens_equal(
+            self.compiler.compile(select), self.PREFIXES,
+            'SELECT ?x (COUNT(?y) AS ?n) WHERE { }'
+        )
+
+    def test_compiling_group_by_outputs_group_by_clause(self):
+        select = self.query.group_by(v.x, v.x + 1)
+        assert tokens_equal(
+            self.compiler.compile(select), self.PREFIXES,
+            'SELECT ?x WHERE { } GROUP BY ?x (?x + 1)'
+        )
+
+    def test_compiling_having_outputs_having_clause(self):
+        select = self.query.group_by(v.x).having(op.count(v.y) > 1)
+        assert tokens_equal(
+            self.compiler.compile(select), self.PREFIXES,
+            'SELECT ?x WHERE { } GROUP BY ?x HAVING (COUNT(?y) > 1)'
+        )
+
+    def test_compiling_clauses_in_order(self):
+        select = self.query.group_by(v.x).having(op.count(v.y) > 1) \
+            .order_by(v.x).limit(5)
+        assert tokens_equal(
+            self.compiler.compile(select), self.PREFIXES,
+            'SELECT ?x WHERE { } GROUP BY ?x HAVING (COUNT(?y) > 1)',
+            'ORDER BY ?x LIMIT 5'
+        )
+
+    def test_aggregate_executes_on_graph(self):
+        graph = helpers.graph('foaf-02.rdf')
+        select = Select([v.x, op.count(v.y).as_(v.n)]).where(
+            (v.x, FOAF.knows, v.y)
+        ).group_by(v.x)
+        results = list(select.execute(graph))
+        assert len(results) == 1
+        assert results[0][1].toPython() == 2
+
+
+class TestSharingCompilers:
+    def test_get_compiler_returns_shared_instance(self):
+        compiler = get_compiler(SelectCompiler, {FOAF: 'foaf'})
+        assert get_compiler(SelectCompiler, {FOAF: 'foaf'}) is compiler
+        assert get_compiler(SelectCompiler, {FOAF: 'f'}) is not compiler
+        assert get_compiler(QueryCompiler, {FOAF: 'foaf'}) is not compiler
+
+    def test_compile_does_not_keep_render_prefixes(self):
+        compiler = SelectCompiler({FOAF: 'foaf'})
+        select = Select([v.x]).where((v.x, FOAF.name, v.name))
+        with_prefixes = compiler.compile(select)
+        without_prefixes = compiler.compile(select, render_prefixes=False)
+        assert with_prefixes.startswith('PREFIX foaf:')
+        assert not without_prefixes.startswith('PREFIX')
+        assert_equal(compiler.compile(select), with_prefixes)
+
+    def test_subquery_reuses_compiler(self):
+        subquery = Select([v.x]).where((v.x, FOAF.name, v.name)).limit(1)
+        select = Select([v.x]).where(subquery)
+        assert tokens_equal(
+            select.compile({FOAF: 'foaf'}),
+            """
+            PREFIX foaf: <http://xmlns.com/foaf/0.1/>
+            SELECT ?x WHERE { { SELECT ?x WHERE { ?x foaf:name ?name } LIMIT 1 } }
+            """
+        )
+
+    def test_compiler_class_arg_is_used(self):
+        select = Select([v.x]).limit(1)
+        output = select.compile(compiler_class=QueryCompiler)
+        assert tokens_equal(output, 'SELECT WHERE { }')
+
+
+class TestCachingFragments(CompilingSelectBase):
+    def setup(self):
+        CompilingSelectBase.setup(self)
+        self.base = GroupGraphPattern([(v.x, FOAF.name, v.name)])
+        self.select = Select([v.x]).where(self.base)
+
+    def test_compiling_caches_fragments_on_patterns(self):
+        self.compiler.compile(self.select)
+        base = self.select._where.patterns[0]
+        assert base._fragment is not None
+        assert base._fragment[0] is self.compiler
+
+    def test_compiling_clone_reuses_unchanged_fragments(self):
+        self.compiler.compile(self.select)
+        base = self.select._where.patterns[0]
+        tokens = base._fragment[2]
+        clone = self.select.filter(v.x == 1)
+        self.compiler.compile(clone)
+        assert clone._where.patterns[0] is base
+        assert base._fragment[2] is tokens
+        assert clone._where._fragment is not self.select._where._fragment
+
+    def test_modified_nested_pattern_is_recompiled(self):
+        first = self.compiler.compile(self.select)
+        self.base.pattern((v.x, FOAF.mbox, v.mbox))
+        second = self.compiler.compile(self.select)
+        assert 'foaf:mbox' not in first
+        assert 'foaf:mbox' in second
+
+    def test_fragments_are_not_shared_between_compilers(self):
+        self.compiler.compile(self.select)
+        output = SelectCompiler({FOAF: 'f'}).compile(self.select)
+        assert 'f:name' in output
+        assert 'foaf:name' not in output
+
+    def test_cloned_update_does_not_modify_original(self):
+        query = SPARQLUpdateQuery().insert([(v.x, FOAF.name, v.name)])
+        query.compile()
+        query.insert([(v.x, FOAF.mbox, v.mbox)])
+        assert 'mbox' not in query.compile()
+
+
+class TestRenderingLiterals:
+    VALUES = [0, -5, 10 ** 30, 0.1, 1e20, True, False, 'abc', u'caf\xe9',
+              'a"b', 'a\\b', 'a\nb', 'a\rb', '',
+              datetime(2009, 1, 1, 12, 30), date(2009, 1, 1)]
+
+    def setup(self):
+        self.compiler = ExpressionCompiler({XSD: 'xsd'})
+
+    def test_plain_values_render_like_literals(self):
+        for value in self.VALUES:
+            assert_equal(self.compiler.term(value),
+                         self.compiler.term(Literal(value)))
+
+    def test_datetime_abbreviates_datatype(self):
+        output = self.compiler.term(datetime(2009, 1, 1, 12, 30))
+        assert_equal(output, '"2009-01-01T12:30:00"^^xsd:dateTime')
+
+    def test_rdflib_terms_are_remembered(self):
+        self.compiler.term(FOAF.name)
+        assert (FOAF.name, True) in self.compiler.terms
+
+    def test_is_a_is_not_confused_with_rdf_type(self):
+        compiler = ExpressionCompiler({RDF: 'rdf'})
+        assert_equal(compiler.term(RDF.type), 'rdf:type')
+        assert_equal(compiler.term(is_a), 'a')
+        assert_equal(compiler.term(RDF.type), 'rdf:type')
+
+    def test_term_cache_is_bounded(self):
+        self.compiler.TERM_CACHE_SIZE = 10
+        for i in range(25):
+            self.compiler.term(FOAF['name%d' % (i,)])
+        assert len(self.compiler.terms) <= 10
+
+
+class Today(Expression):
+    def __init__(self):
+        super(Today, self).__init__(None)
+
+
+class Bind(object):
+    def __init__(self, expression, variable):
+        self.expression = expression
+        self.variable = variable
+
+
+class TestRegisteringHandlers:
+    def test_expression_handler_compiles_custom_node(self):
+        class Compiler(ExpressionCompiler):
+            pass
+        Compiler.register(Today, lambda compiler, expr: 'NOW()')
+        assert_equal(Compiler().compile(Today() < v.x), 'NOW() < ?x')
+
+    def test_handlers_are_inherited_but_not_shared_with_base(self):
+        class Compiler(ExpressionCompiler):
+            pass
+        Compiler.register(Today, lambda compiler, expr: 'NOW()')
+        assert ExpressionCompiler().compile(Today()) != 'NOW()'
+
+    def test_pattern_handler_compiles_custom_pattern(self):
+        def compile_bind(compiler, pattern, more):
+            return ['BIND(%s AS %s)' % (compiler.expression(pattern.expression),
+                                        compiler.expression(pattern.variable))]
+
+        class Compiler(SelectCompiler):
+            pass
+        Compiler.register(Bind, compile_bind)
+        select = Select([v.y])
+        select._where.patterns.append(Bind(v.x + 1, v.y))
+        assert tokens_equal(Compiler().compile(select),
+                            'SELECT ?y WHERE { BIND(?x + 1 AS ?y) }')
+
+    def test_unknown_pattern_raises_compile_error(self):
+        select = Select([v.y])
+        select._where.patterns.append(Bind(v.x + 1, v.y))
+        assert_raises(CompileError, SelectCompiler().compile, select)
+
+
+class TestCompilingDeepTrees(CompilingSelectBase):
+    DEPTH = 5000
+
+    def test_compiling_long_or_chain(self):
+        expr = v.x == 0
+        for i in range(1, self.DEPTH):
+            expr = expr | (v.x == i)
+        output = ExpressionCompiler().compile(expr)
+        assert output.startswith('?x = 0 || ?x = 1 || ')
+        assert output.count('||') == self.DEPTH - 1
+
+    def test_flattening_keeps_brackets_between_operators(self):
+        expr = (v.a | v.b | v.c) & (v.d & v.e) & v.f
+        assert_equal(ExpressionCompiler().compile(expr),
+                     '(?a || ?b || ?c) && ?d && ?e && ?f')
+
+    def test_compiling_long_binary_chain(self):
+        expr = v.x
+        for i in range(self.DEPTH):
+            expr = expr + i
+        output = ExpressionCompiler().compile(expr)
+        assert output.startswith('?x + 0 + 1 + ')
+
+    def test_compiling_deeply_nested_patterns(self):
+        pattern = (v.x, FOAF.name, v.name)
+        for i in range(self.DEPTH // 5):
+            pattern = optional(pattern)
+        output = self.compiler.compile(Select([v.x]).where(pattern))
+        assert output.count('OPTIONAL') == self.DEPTH // 5
+
+    def test_compiling_deep_filter(self):
+        constraint = v.x == 0
+        for i in range(1, self.DEPTH):
+            constraint = constraint & (v.y != i)
+        output = self.compiler.compile(self.query.filter(constraint))
+        assert 'FILTER (?x = 0 && ?y != 1 && ' in output
+
+
+class TestCompilingTripleArray(CompilingSelectBase):
+    def test_compiling_outputs_period_separated_triples(self):
+        pattern = GroupGraphPattern.from_triples([
+            (v.x, FOAF.name, "Alice"), (v.x, FOAF.mbox, v.mbox)
+        ])
+        select = Select([v.x]).where(pattern).filter(v.x != 1)
+        assert_equal(self.compiler.compile(select, render_prefixes=False),
+                     u"""SELECT ?x
+WHERE {
+?x foaf:name "Alice" .
+?x foaf:mbox ?mbox .
+FILTER (?x != 1)
+}""")
+
+    def test_compiling_rdflib_graph_as_insert_data(self):
+        graph = helpers.graph('foaf-01.rdf')
+        query = SPARQLUpdateQuery().insert(
+            GroupGraphPattern.from_triples(graph)
+        )
+        output = query.compile({FOAF: 'foaf'})
+        assert output.count(' .') == len(graph) - 1
+        assert 'foaf:name "Peter Parker"' in output
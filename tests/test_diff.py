@@ -0,0 +1,90 @@
+from rdflib import Graph, BNode, Literal, Namespace
+from sparqlquery.sparql.diff import (DELETE, INSERT, diff, diff_ntriples,
+                                     sorted_ntriples, data_updates, sync)
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+EX = Namespace('http://example.org/')
+
+
+class UpdateCountingGraph(Graph):
+    """A graph keeping the updates it runs."""
+
+    def __init__(self, *args, **kwargs):
+        super(UpdateCountingGraph, self).__init__(*args, **kwargs)
+        self.updates = []
+
+    def update(self, update, *args, **kwargs):
+        self.updates.append(update)
+        return super(UpdateCountingGraph, self).update(update, *args, **kwargs)
+
+
+class TestDiffingGraphs:
+    def setup(self):
+        self.old = Graph()
+        self.bnode = BNode('address')
+        for name in ('alice', 'bob', 'carol'):
+            self.old.add((EX[name], FOAF.name, Literal(name.title())))
+        self.old.add((EX.alice, FOAF.based_near, self.bnode))
+        self.old.add((self.bnode, FOAF.name, Literal(u"Z\xfcrich")))
+        self.new = Graph()
+        for triple in self.old:
+            self.new.add(triple)
+        self.new.remove((EX.bob, FOAF.name, None))
+        self.new.add((EX.bob, FOAF.name, Literal("Robert")))
+        self.new.add((self.bnode, FOAF.name, Literal(u"Z\xfcri")))
+        self.expected = set([
+            (DELETE, (EX.bob, FOAF.name, Literal("Bob"))),
+            (INSERT, (EX.bob, FOAF.name, Literal("Robert"))),
+            (INSERT, (self.bnode, FOAF.name, Literal(u"Z\xfcri")))])
+
+    def test_diff_yields_changed_triples(self):
+        assert set(diff(self.old, self.new)) == self.expected
+        assert not list(diff(self.old, self.old))
+
+    def test_ntriples_diff_equals_diff(self):
+        changes = list(diff_ntriples(sorted_ntriples(self.old),
+                                     sorted_ntriples(self.new)))
+        assert set(changes) == self.expected
+        assert len(changes) == 3
+
+    def test_ntriples_diff_ignores_duplicates_and_comments(self):
+        lines = sorted_ntriples(self.old)
+        old = ['# old'] + lines[:1] + lines
+        assert not list(diff_ntriples(old, lines))
+
+    def test_updates_have_at_most_max_triples(self):
+        changes = [(INSERT, (EX[str(i)], FOAF.name, Literal(i)))
+                   for i in range(5)]
+        changes.append((DELETE, (EX.alice, FOAF.name, Literal("Alice"))))
+        updates = [update.compile() for update in data_updates(changes, 2)]
+        assert len(updates) == 4
+        assert [update.split()[0] for update in updates] == \
+            ['INSERT', 'INSERT', 'DELETE', 'INSERT']
+
+    def test_blank_nodes_are_skolemized(self):
+        changes = [(INSERT, (EX.alice, FOAF.based_near, self.bnode))]
+        update, = data_updates(changes, authority='http://example.org/')
+        assert '_:' not in update.compile()
+        assert '<http://example.org/.well-known/genid/' in update.compile()
+
+    def test_sync_makes_remote_graph_equal_new_graph(self):
+        remote = UpdateCountingGraph()
+        assert sync(remote, diff(Graph(), self.old)) == 1
+        assert sync(remote, diff(self.old, self.new), max_triples=1) == 1
+        assert len(remote.updates) == 2
+        assert remote.updates[1].count(' ;\n') == 2
+        skolem = self.bnode.skolemize()
+        assert set(remote.objects(skolem, FOAF.name)) == \
+            set([Literal(u"Z\xfcrich"), Literal(u"Z\xfcri")])
+        assert set(remote.objects(EX.bob, FOAF.name)) == \
+            set([Literal("Robert")])
+        assert len(remote) == len(self.new)
+
+    def test_sync_escapes_typed_literals(self):
+        code = Literal(u'say "hi"\\\nbye', datatype=EX.code)
+        remote = UpdateCountingGraph()
+        sync(remote, [(INSERT, (EX.alice, FOAF.nick, code))], {EX: 'ex'})
+        assert 'ex:code' in remote.updates[0]
+        assert list(remote.objects(EX.alice, FOAF.nick)) == [code]
+        sync(remote, [(DELETE, (EX.alice, FOAF.nick, code))], {EX: 'ex'})
+        assert len(remote) == 0
@@ -0,0 +1,115 @@
+from nose.tools import assert_raises
+from sparqlquery import Namespace, Literal
+from sparqlquery.sparql.patterns import *
+from sparqlquery.sparql.queryforms import Select, Ask
+from sparqlquery.sparql.query import SPARQLUpdateQuery, FrozenQuery
+from sparqlquery.sparql.fingerprint import fingerprint, structurally_equal
+from sparqlquery.sparql.helpers import *
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+
+
+def select():
+    return Select([v.name]).where(
+        (v.x, FOAF.name, v.name),
+        optional((v.x, FOAF.mbox, v.mbox))
+    ).filter(v.name != "Bob").order_by(v.name).limit(10)
+
+
+class TestFingerprintingQueries:
+    def test_queries_built_the_same_way_have_the_same_fingerprint(self):
+        assert select().fingerprint() == select().fingerprint()
+        assert select().structurally_equal(select())
+
+    def test_fingerprint_is_hex_digest(self):
+        assert len(select().fingerprint()) == 40
+        int(select().fingerprint(), 16)
+
+    def test_different_queries_have_different_fingerprints(self):
+        fingerprints = set([
+            select().fingerprint(),
+            select().limit(11).fingerprint(),
+            select().distinct().fingerprint(),
+            select().filter(v.name != "Alice").fingerprint(),
+            select().where((v.x, FOAF.age, v.age)).fingerprint(),
+            select().project(v.x).fingerprint(),
+            Ask().where((v.x, FOAF.name, v.name)).fingerprint(),
+        ])
+        assert len(fingerprints) == 7
+
+    def test_terms_are_compared_by_type(self):
+        one = Select([v.x]).where((v.x, FOAF.age, 1))
+        literal_one = Select([v.x]).where((v.x, FOAF.age, Literal(1)))
+        assert not one.structurally_equal(literal_one)
+
+    def test_changing_nested_pattern_changes_fingerprint(self):
+        nested = optional((v.x, FOAF.mbox, v.mbox))
+        query = Select([v.x]).where((v.x, FOAF.name, v.name), nested)
+        before = query.fingerprint()
+        query._where.patterns[-1].filter(v.mbox != "")
+        assert query.fingerprint() != before
+
+    def test_cloned_expression_is_not_memoized(self):
+        expression = v.name == "Bob"
+        fingerprint(expression)
+        assert fingerprint(expression._clone(right="Alice")) != \
+            fingerprint(expression)
+
+    def test_cloned_pattern_is_not_memoized(self):
+        pattern = GroupGraphPattern.from_obj([(v.x, FOAF.name, v.name)])
+        fingerprint(pattern)
+        assert fingerprint(pattern._clone(optional=True)) != \
+            fingerprint(pattern)
+        plain = Select([v.x]).where(pattern)
+        optional_ = Select([v.x]).where(
+            GroupGraphPattern.from_obj(pattern, optional=True))
+        assert plain.fingerprint() != optional_.fingerprint()
+        assert plain.freeze() != optional_.freeze()
+
+    def test_structurally_equal_rejects_other_objects(self):
+        assert not select().structurally_equal(None)
+        assert not structurally_equal(v.x, v.y)
+
+    def test_unknown_objects_cannot_be_fingerprinted(self):
+        assert_raises(TypeError, fingerprint, Triple(v.x, FOAF.name, object()))
+
+    def test_deeply_nested_patterns_can_be_fingerprinted(self):
+        pattern = GroupGraphPattern([(v.x, FOAF.name, v.name)])
+        for i in range(5000):
+            pattern = GroupGraphPattern([pattern])
+        assert fingerprint(Select([v.x]).where(pattern))
+
+    def test_update_queries_can_be_fingerprinted(self):
+        insert = SPARQLUpdateQuery().insert([(v.x, FOAF.name, "Alice")])
+        delete = SPARQLUpdateQuery().delete([(v.x, FOAF.name, "Alice")])
+        assert insert.fingerprint() != delete.fingerprint()
+
+
+class TestFreezingQueries:
+    def test_frozen_queries_can_be_used_as_keys(self):
+        cache = {select().freeze(): 'result'}
+        assert cache[select().freeze()] == 'result'
+        assert select().limit(1).freeze() not in cache
+
+    def test_frozen_query_is_not_affected_by_later_changes(self):
+        nested = optional((v.x, FOAF.mbox, v.mbox))
+        query = Select([v.x]).where((v.x, FOAF.name, v.name), nested)
+        frozen = query.freeze()
+        before = frozen.fingerprint()
+        query._where.patterns[-1].filter(v.mbox != "")
+        assert query.fingerprint() != before
+        assert frozen.query.fingerprint() == before
+
+    def test_frozen_query_compiles_like_query(self):
+        assert select().freeze().compile() == select().compile()
+
+    def test_freezing_frozen_query_returns_it(self):
+        frozen = select().freeze()
+        assert frozen.freeze() is frozen
+        assert FrozenQuery(frozen) == frozen
+
+    def test_thawed_query_can_be_built_on(self):
+        frozen = select().freeze()
+        query = frozen.thaw().where((v.x, FOAF.age, v.age))
+        assert query.fingerprint() != frozen.fingerprint()
+        assert frozen.thaw().structurally_equal(frozen)
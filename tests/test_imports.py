@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMPILE = """
+import sys
+from sparqlquery import *
+Select([v.x]).where((v.x, is_a, v.type)).filter(v.x != 1).compile()
+print(' '.join(sorted(name for name, module in sys.modules.items()
+                      if module is not None)))
+"""
+
+
+def loaded_modules(source):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.check_output([sys.executable, '-c', source], env=env)
+    return output.decode('ascii').split()
+
+
+class TestImportingPackage:
+    def setup(self):
+        self.modules = loaded_modules(COMPILE)
+
+    def test_compiling_does_not_import_sparql_plugins(self):
+        for name in self.modules:
+            assert not name.startswith('rdflib.plugins.sparql'), name
+
+    def test_compiling_does_not_import_mapper(self):
+        assert 'sparqlquery.mapper' not in self.modules
+
+    def test_importing_does_not_import_compiler(self):
+        modules = loaded_modules("import sys, sparqlquery\n"
+                                 "print(' '.join(sys.modules))")
+        assert 'sparqlquery.sparql.compiler' not in modules
@@ -1,13 +1,19 @@
 from nose.tools import assert_raises
 from sparqlquery import Namespace, ConjunctiveGraph, Variable, BNode, URIRef
+from sparqlquery import Literal
+from sparqlquery.exceptions import InvalidRequestError
+from rdflib import Graph
 from sparqlquery.mapper import Mapper, mapper
 from sparqlquery.mapper.properties import Property, Relationship
 from sparqlquery.mapper.query import Query
 from sparqlquery.mapper.session import Session
+from sparqlquery.mapper.declarative import Subject
+from sparqlquery.sparql.helpers import v, op, desc
 import helpers
 
 RDF = Namespace('http://www.w3.org/1999/02/22-rdf-syntax-ns#')
 FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+EX = Namespace('http://example.org/')
 
 class TestMapper:
     def setup(self):
@@ -41,6 +47,19 @@ class TestQuery:
         person = persons[0]
         assert type(person) is self.Person
 
+    def test_query_count_returns_number_of_subjects(self):
+        query = self.session.query(self.Person)
+        assert query.count() == 1
+        assert query.count(helpers.graph('foaf-02.rdf')) == 3
+
+    def test_query_count_does_not_bind_instances(self):
+        self.mapper.bind_results = None
+        assert self.session.query(self.Person).count() == 1
+
+    def test_query_exists(self):
+        assert self.session.query(self.Person).exists()
+        assert not self.session.query(self.Person).exists(helpers.graph())
+
 class TestMappedProperties:
     def setup(self):
         class Person(object):
@@ -69,11 +88,338 @@ class TestMappedProperties:
         assert person.name == "Peter Parker"
         assert person.mbox == URIRef("mailto:peter.parker@dailybugle.com")
 
+    def test_column_converters_handle_mixed_values(self):
+        XSD = Namespace('http://www.w3.org/2001/XMLSchema#')
+        rows = [(URIRef('tag:a'), None, None),
+                (URIRef('tag:b'), Literal(1), URIRef('tag:mbox')),
+                (URIRef('tag:c'), Literal('x', datatype=XSD.integer),
+                 Literal('mbox')),
+                (URIRef('tag:d'), URIRef('tag:name'), BNode('mbox'))]
+        positions = {Variable('Person'): 0, Variable('name'): 1,
+                     Variable('mbox'): 2}
+        bind = self.mapper.binder(None, positions, {})
+        values = [(person.name, person.mbox) for person in map(bind, rows)]
+        assert values == [(None, None), (1, URIRef('tag:mbox')),
+                          (u'x', u'mbox'),
+                          (URIRef('tag:name'), BNode('mbox'))]
+        assert type(values[2][0]) is unicode
+
+class CountingGraph(Graph):
+    """A graph counting the queries it runs."""
+
+    queries = 0
+
+    def query(self, *args, **kwargs):
+        self.queries += 1
+        return super(CountingGraph, self).query(*args, **kwargs)
+
+
 class TestMappedRelationships:
+    def setup(self):
+        self.graph = CountingGraph()
+        self.graph.load(helpers.resource('foaf-02.rdf'))
+        self.session = Session(self.graph)
+
+    def map_person(self, loading):
+        class Person(object):
+            pass
+        mapper(Person, FOAF.Person, properties={
+            'name': Property(FOAF.name),
+            'knows': Relationship(Person, FOAF.knows, loading)
+        })
+        return Person
+
+    def assert_related(self, persons):
+        persons = dict((person.name, person) for person in persons)
+        assert len(persons) == 3
+        knows = persons["Peter Parker"].knows
+        assert sorted(person.name for person in knows) == \
+            ["Aunt May", "Harry Osborn"]
+        assert persons["Harry Osborn"].knows == []
+        # Related instances come from the identity map.
+        assert any(person is persons["Harry Osborn"] for person in knows)
+
+    def test_joined_relationship_is_loaded_in_one_query(self):
+        persons = list(self.session.query(self.map_person('joined')))
+        assert self.graph.queries == 1
+        self.assert_related(persons)
+
+    def test_batched_relationship_is_loaded_in_one_more_query(self):
+        persons = list(self.session.query(self.map_person('batched')))
+        assert self.graph.queries == 2
+        self.assert_related(persons)
+
+    def test_batched_relationship_binds_uris_with_values(self):
+        Person = self.map_person('batched')
+        graph = CountingGraph()
+        people = [URIRef('http://example.org/%s' % (name,))
+                  for name in ('alice', 'bob', 'carol')]
+        for person, name in zip(people, ("Alice", "Bob", "Carol")):
+            graph.add((person, RDF.type, FOAF.Person))
+            graph.add((person, FOAF.name, Literal(name)))
+        graph.add((people[0], FOAF.knows, people[1]))
+        graph.add((people[0], FOAF.knows, people[2]))
+        graph.add((people[1], FOAF.knows, people[2]))
+        persons = dict((person.name, person)
+                       for person in Session(graph).query(Person))
+        assert graph.queries == 2
+        assert [person.name for person in persons["Bob"].knows] == ["Carol"]
+        assert len(persons["Alice"].knows) == 2
+        assert persons["Carol"].knows == []
+
+    def test_related_instances_load_their_relationships_on_access(self):
+        class Document(object):
+            pass
+        Person = self.map_person('batched')
+        mapper(Document, FOAF.Document, properties={
+            'maker': Relationship(Person, FOAF.maker, 'joined')
+        })
+        peter = BNode()
+        self.graph.add((peter, RDF.type, FOAF.Document))
+        for person in self.graph.subjects(FOAF.name, Literal("Peter Parker")):
+            self.graph.add((peter, FOAF.maker, person))
+        documents = list(self.session.query(Document))
+        assert self.graph.queries == 1
+        maker, = documents[0].maker
+        assert maker.name == "Peter Parker"
+        assert len(maker.knows) == 2
+        assert self.graph.queries == 2
+
+    def test_deferred_relationship_is_loaded_on_access(self):
+        persons = list(self.session.query(self.map_person('joined'))
+                       .defer('knows'))
+        assert self.graph.queries == 1
+        self.assert_related(persons)
+        assert self.graph.queries == 2
+
+    def test_unknown_loading_raises_error(self):
+        assert_raises(InvalidRequestError, Relationship, object, FOAF.knows,
+                      'lazy')
+
+
+class TestDeferredProperties:
     def setup(self):
         class Person(object):
             pass
         self.Person = Person
         self.mapper = mapper(Person, FOAF.Person, properties={
+            'name': Property(FOAF.name),
+            'mbox': Property(FOAF.mbox)
+        })
+        self.graph = CountingGraph()
+        self.graph.load(helpers.resource('foaf-02.rdf'))
+        self.session = Session(self.graph)
+
+    def test_load_only_projects_named_properties(self):
+        persons = list(self.session.query(self.Person).load_only('name'))
+        assert self.graph.queries == 1
+        assert sorted(person.name for person in persons) == \
+            ["Aunt May", "Harry Osborn", "Peter Parker"]
+        assert self.graph.queries == 1
+
+    def test_missing_deferred_value_does_not_exclude_instances(self):
+        assert not list(self.session.query(self.Person))
+        persons = list(self.session.query(self.Person).defer('mbox'))
+        assert len(persons) == 3
+        assert persons[0].mbox is None
+
+    def test_deferred_property_is_loaded_once_for_all_instances(self):
+        persons = list(self.session.query(self.Person).defer('name', 'mbox'))
+        assert self.graph.queries == 1
+        names = sorted(person.name for person in persons)
+        assert names == ["Aunt May", "Harry Osborn", "Peter Parker"]
+        assert self.graph.queries == 2
+
+    def record_queries(self, graph):
+        queries = []
+        query = graph.query
+        def record(*args, **kwargs):
+            result = query(*args, **kwargs)
+            queries.append((args[0], len(result)))
+            return result
+        graph.query = record
+        return queries
+
+    def test_deferred_property_is_loaded_for_listed_instances_only(self):
+        persons = list(self.session.query(self.Person).defer('name', 'mbox')
+                       .order_by(self.Person.name).limit(2))
+        queries = self.record_queries(self.graph)
+        assert [person.name for person in persons] == \
+            ["Aunt May", "Harry Osborn"]
+        (compiled, rows), = queries
+        assert rows == 2
+
+    def test_deferred_property_of_uris_is_loaded_with_values(self):
+        graph = Graph()
+        for name in ("alice", "bob", "carol"):
+            graph.add((EX[name], RDF.type, FOAF.Person))
+            graph.add((EX[name], FOAF.name, Literal(name.title())))
+        persons = list(Session(graph).query(self.Person).defer('name', 'mbox')
+                       .limit(2))
+        queries = self.record_queries(graph)
+        assert len(set(person.name for person in persons)) == 2
+        (compiled, rows), = queries
+        assert 'VALUES' in compiled and rows == 2
+
+    def test_deferred_property_read_while_iterating(self):
+        query = self.session.query(self.Person).defer('name', 'mbox')
+        names = sorted(person.name for person in query)
+        assert names == ["Aunt May", "Harry Osborn", "Peter Parker"]
+        assert self.graph.queries == 2
+        persons = self.session.query(self.Person).load_only('name')
+        assert sorted(person.name for person in persons) == names
+
+    def test_unknown_property_raises_error(self):
+        query = self.session.query(self.Person)
+        assert_raises(InvalidRequestError, query.defer, 'nick')
+        assert_raises(InvalidRequestError, query.load_only, 'nick')
+
+
+class TestFilteringQueries:
+    def setup(self):
+        class Person(object):
+            pass
+        self.Person = Person
+        mapper(Person, FOAF.Person, properties={
+            'name': Property(FOAF.name),
             'knows': Relationship(Person, FOAF.knows)
         })
+        self.graph = CountingGraph()
+        self.graph.load(helpers.resource('foaf-02.rdf'))
+        self.session = Session(self.graph)
+        self.query = self.session.query(Person)
+
+    def names(self, query):
+        return [person.name for person in query]
+
+    def test_class_attributes_are_property_variables(self):
+        assert self.Person.name is v.name
+        assert isinstance(self.Person._manager.get(Variable('name')),
+                          Property)
+
+    def test_keyword_filter_matches_property_value(self):
+        query = self.query.filter(name=Literal("Harry Osborn"))
+        assert self.names(query) == ["Harry Osborn"]
+        assert query.count() == 1
+
+    def test_keyword_filter_matches_related_instance(self):
+        graph = Graph()
+        for name in ("alice", "bob", "carol", "dave"):
+            graph.add((EX[name], RDF.type, FOAF.Person))
+            graph.add((EX[name], FOAF.name, Literal(name.title())))
+        graph.add((EX.alice, FOAF.knows, EX.bob))
+        graph.add((EX.carol, FOAF.knows, EX.dave))
+        query = Session(graph).query(self.Person)
+        bob, = query.filter(name=Literal("Bob"))
+        persons = list(query.filter(knows=bob).load_only('name'))
+        assert [person.name for person in persons] == ["Alice"]
+
+    def test_keyword_filter_on_none_raises_error(self):
+        assert_raises(InvalidRequestError, self.query.filter, name=None)
+
+    def test_keyword_filter_on_blank_node_raises_error(self):
+        harry, = self.query.filter(name=Literal("Harry Osborn"))
+        assert_raises(InvalidRequestError, self.query.filter, knows=harry)
+        assert_raises(InvalidRequestError, self.query.filter,
+                      knows=harry._id)
+
+    def test_expression_filter_is_evaluated_at_the_store(self):
+        query = self.query.filter(self.Person.name != "Harry Osborn")
+        assert sorted(self.names(query)) == ["Aunt May", "Peter Parker"]
+        assert query.count() == 2
+        assert not query.filter(self.Person.name == "Nobody").exists()
+
+    def test_filter_on_deferred_property(self):
+        query = self.query.defer('name').filter(
+            op.regex(self.Person.name, "^P"))
+        persons = list(query)
+        assert self.graph.queries == 2
+        assert [person.name for person in persons] == ["Peter Parker"]
+
+    def test_order_by_limit_and_offset_apply_to_instances(self):
+        query = self.query.order_by(self.Person.name)
+        assert self.names(query) == ["Aunt May", "Harry Osborn",
+                                     "Peter Parker"]
+        assert self.names(query.limit(2)) == ["Aunt May", "Harry Osborn"]
+        assert self.names(query.offset(1).limit(1)) == ["Harry Osborn"]
+        assert self.names(query.order_by(desc(self.Person.name))
+                          .offset(1)) == ["Harry Osborn", "Aunt May"]
+
+    def test_count_and_exists_apply_limit_and_offset(self):
+        assert self.query.limit(2).count() == 2
+        assert self.query.offset(2).count() == 1
+        assert not self.query.offset(3).exists()
+
+    def test_limit_counts_instances_rather_than_rows(self):
+        class Known(object):
+            pass
+        mapper(Known, FOAF.Person, properties={
+            'name': Property(FOAF.name),
+            'knows': Relationship(Known, FOAF.knows, 'joined')
+        })
+        query = self.session.query(Known).order_by(desc(Known.name))
+        peter, = query.limit(1)
+        assert len(peter.knows) == 2
+
+    def test_unknown_property_raises_error(self):
+        assert_raises(InvalidRequestError, self.query.filter, nick="Pete")
+
+
+class TestDeclarativeMapping:
+    def setup(self):
+        class Person(Subject):
+            RDF_TYPE = FOAF.Person
+            name = Property(FOAF.name)
+            mbox = Property(FOAF.mbox)
+        self.Person = Person
+        self.session = Session(helpers.graph('foaf-01.rdf'))
+
+    def test_instances_keep_values_in_slots(self):
+        person, = self.session.query(self.Person)
+        assert person.name == "Peter Parker"
+        assert person.mbox == URIRef("mailto:peter.parker@dailybugle.com")
+        assert not hasattr(person, '__dict__')
+        assert len(person._state) == 2
+        assert_raises(AttributeError, setattr, person, 'nick', "Spidey")
+
+    def test_unset_values_are_defaults(self):
+        person = self.Person()
+        assert person.name is None
+        person.name = "Mary Jane"
+        assert person.name == "Mary Jane"
+
+    def test_deferred_values_are_loaded_into_slots(self):
+        person, = self.session.query(self.Person).defer('mbox')
+        assert person.mbox == URIRef("mailto:peter.parker@dailybugle.com")
+
+    def test_subclasses_extend_layout(self):
+        class Agent(self.Person):
+            nick = Property(FOAF.nick)
+        manager = Agent._manager
+        assert manager.get(Variable('name')) is \
+            self.Person._manager.get(Variable('name'))
+        assert manager.get(Variable('nick')).index == 2
+        agent = Agent()
+        agent.nick = "Spidey"
+        assert (agent.name, agent.nick) == (None, "Spidey")
+
+    def test_shared_descriptors_are_copied(self):
+        name = self.Person._manager.get(Variable('name'))
+        class Organization(Subject):
+            label = name
+            homepage = Property(FOAF.homepage)
+        copied = Organization._manager.get(Variable('label'))
+        assert copied is not name
+        assert self.Person._layout[name.index] is name
+        assert Organization._layout[copied.index] is copied
+        organization = Organization()
+        organization.label = "Daily Bugle"
+        assert organization.label == "Daily Bugle"
+
+    def test_classes_can_declare_a_dict(self):
+        class Annotated(self.Person):
+            __slots__ = ('__dict__',)
+        annotated = Annotated()
+        annotated.note = "note"
+        annotated.name = "Peter"
+        assert (annotated.note, annotated.name) == ("note", "Peter")
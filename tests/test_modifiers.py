@@ -125,3 +125,39 @@ class TestAddingOrderByModifier:
         a = Variable('a')
         select = self.select.order_by(a)
         assert select is not self.select
+
+class TestAddingGroupByModifier:
+    def setup(self):
+        self.select = Select([])
+
+    def test_group_by_defaults_to_none(self):
+        assert self.select._group_by == None
+
+    def test_group_by_method(self):
+        a, b = Variable('a'), Variable('b')
+        select = self.select.group_by(a, b)
+        assert len(select._group_by) == 2
+        assert b in select._group_by
+        select = select.group_by()
+        assert select._group_by == None
+
+    def test_method_is_generative(self):
+        select = self.select.group_by(Variable('a'))
+        assert select is not self.select
+
+class TestAddingHavingModifier:
+    def setup(self):
+        self.select = Select([])
+
+    def test_having_defaults_to_none(self):
+        assert self.select._having is None
+
+    def test_having_method(self):
+        select = self.select.having(Variable('a'))
+        assert select._having is not None
+        select = select.having()
+        assert select._having is None
+
+    def test_method_is_generative(self):
+        select = self.select.having(Variable('a'))
+        assert select is not self.select
@@ -96,3 +96,32 @@ class TestAddingPredicateObjectList:
         triples = TriplesSameSubject(v.x)
         new_triples = triples[(FOAF.name, v.name)]
         assert new_triples is not triples
+
+class TestCreatingTripleArray:
+    def setup(self):
+        self.triples = [(Variable('x'), FOAF.name, "Alice"),
+                        (Variable('x'), FOAF.knows, Variable('y'))]
+
+    def test_trusted_triples_are_stored_as_parallel_lists(self):
+        triples = TripleArray(self.triples)
+        assert len(triples) == 2
+        assert triples.subjects == [Variable('x'), Variable('x')]
+        assert triples.predicates == [FOAF.name, FOAF.knows]
+        assert triples.objects == ["Alice", Variable('y')]
+
+    def test_iteration_yields_triples(self):
+        assert list(TripleArray(self.triples)) == self.triples
+
+    def test_untrusted_triples_are_converted(self):
+        triples = TripleArray([(Variable('x'), FOAF.name, ("Alice", "Bob"))],
+                              trusted=False)
+        assert isinstance(triples.objects[0], CollectionPattern)
+        assert_raises(TypeError, TripleArray, [1], trusted=False)
+
+    def test_empty_triples(self):
+        assert len(TripleArray([])) == 0
+
+    def test_from_triples_makes_graph_pattern(self):
+        pattern = GroupGraphPattern.from_triples(self.triples, optional=True)
+        assert pattern.optional
+        assert isinstance(pattern.patterns[0], TripleArray)
@@ -0,0 +1,110 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from nose.tools import assert_raises
+from rdflib import Namespace
+from sparqlquery.sparql.queryforms import Select
+from sparqlquery.sparql.compiler import SelectCompiler
+from sparqlquery.sparql.persistent import CompiledQueryCache
+from sparqlquery.sparql.registry import QueryRegistry
+from sparqlquery.sparql.helpers import *
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+
+COMPILE = """
+import sys
+from sparqlquery import *
+from sparqlquery.sparql.persistent import CompiledQueryCache
+from rdflib import Namespace
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+cache = CompiledQueryCache(sys.argv[1])
+cache.compile(Select([v.x]).where((v.x, FOAF.name, v.name)), {FOAF: 'foaf'})
+print('%d %d' % (cache.hits, cache.misses))
+"""
+
+
+def select():
+    return Select([v.x]).where((v.x, FOAF.name, v.name))
+
+
+class TestCachingCompiledQueries:
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'queries.db')
+        self.cache = CompiledQueryCache(self.path)
+
+    def teardown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_compile_returns_compiled_query(self):
+        output = self.cache.compile(select(), {FOAF: 'foaf'})
+        assert output == select().compile({FOAF: 'foaf'})
+        assert self.cache.compile(select(), {FOAF: 'foaf'}) == output
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_other_caches_read_compiled_queries(self):
+        self.cache.compile(select())
+        cache = CompiledQueryCache(self.path)
+        assert cache.compile(select()) == select().compile()
+        assert (cache.hits, cache.misses) == (1, 0)
+
+    def test_other_processes_read_compiled_queries(self):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        command = [sys.executable, '-c', COMPILE, self.path]
+        assert subprocess.check_output(command, env=env).split() == ['0', '1']
+        assert subprocess.check_output(command, env=env).split() == ['1', '0']
+
+    def test_key_depends_on_prefix_map_and_options(self):
+        keys = set([
+            self.cache.key(select()),
+            self.cache.key(select(), {FOAF: 'foaf'}),
+            self.cache.key(select(), {FOAF: 'f'}),
+            self.cache.key(select(), canonical=True),
+            self.cache.key(select(), compiler_class=SelectCompiler,
+                           kind='template'),
+            self.cache.key(select().limit(1)),
+        ])
+        assert len(keys) == 6
+
+    def test_entries_of_other_versions_are_ignored_and_purged(self):
+        self.cache.compile(select())
+        cache = CompiledQueryCache(self.path, version='0.0.0')
+        cache.compile(select())
+        assert cache.misses == 1
+        cache.purge()
+        assert len(cache) == 1
+        assert len(CompiledQueryCache(self.path)) == 0
+
+    def test_clear(self):
+        self.cache.compile(select())
+        self.cache.clear()
+        assert len(self.cache) == 0
+        assert_raises(KeyError, self.cache.get, self.cache.key(select()))
+
+    def test_prepared_templates_are_cached(self):
+        query = Select([v.x]).where((v.x, FOAF.name, param.name))
+        prepared = self.cache.prepare(query, {FOAF: 'foaf'})
+        cache = CompiledQueryCache(self.path)
+        cached = cache.prepare(query, {FOAF: 'foaf'}, generate=True)
+        assert (cache.hits, cache.misses) == (1, 0)
+        assert cached.function("Alice") == prepared.bind(name="Alice")
+        assert cached.bind(name="Alice") == query.prepare({FOAF: 'foaf'}) \
+            .bind(name="Alice")
+        assert self.cache.compile(select()) == select().compile()
+        assert len(cache) == 2
+
+    def test_registry_prepares_queries_from_cache(self):
+        queries = QueryRegistry({FOAF: 'foaf'}, cache=self.cache)
+        queries.register('named', Select([v.x]).where(
+            (v.x, FOAF.name, param.name)))
+        queries.compile('named', name="Alice")
+        queries = QueryRegistry({FOAF: 'foaf'},
+                                cache=CompiledQueryCache(self.path))
+        queries.register('named', Select([v.x]).where(
+            (v.x, FOAF.name, param.name)))
+        queries.compile('named', name="Bob")
+        assert queries.cache.hits == 1
@@ -0,0 +1,152 @@
+import threading
+from nose.tools import assert_raises
+from rdflib import Namespace, Literal, URIRef
+from sparqlquery.exceptions import CompileError, InvalidRequestError
+from sparqlquery.sparql.queryforms import Select
+from sparqlquery.sparql.query import SPARQLUpdateQuery
+from sparqlquery.sparql.cache import ResultCache
+from sparqlquery.sparql.registry import QueryRegistry
+from sparqlquery.sparql.helpers import *
+import helpers
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+
+
+def named(name):
+    return Select([v.x]).where((v.x, FOAF.name, name))
+
+
+class TestPreparingQueries:
+    def test_bound_query_equals_compiled_query(self):
+        query = named(param.name).filter(v.x != param.x) \
+            .limit(param.limit).offset(param.offset)
+        prepared = query.prepare({FOAF: 'foaf'})
+        output = named("Alice").filter(v.x != FOAF.a).limit(2).offset(4) \
+            .compile({FOAF: 'foaf'})
+        assert prepared.bind(name="Alice", x=FOAF.a, limit=2,
+                             offset=4) == output
+        assert sorted(set(prepared.names)) == ['limit', 'name', 'offset', 'x']
+
+    def test_parameter_can_be_used_twice(self):
+        prepared = Select([v.x]).where((v.x, FOAF.name, param.name),
+                                       (v.x, FOAF.nick, param.name)).prepare()
+        output = prepared.bind(name="Alice")
+        assert output.count('"Alice"') == 2
+
+    def test_compiling_query_with_parameters_raises_error(self):
+        assert_raises(CompileError, named(param.name).compile)
+
+    def test_missing_value_raises_error(self):
+        prepared = named(param.name).prepare()
+        assert_raises(InvalidRequestError, prepared.bind)
+        prepared.generate()
+        assert_raises(InvalidRequestError, prepared.bind)
+
+    def test_limit_and_offset_only_take_integers(self):
+        prepared = named("Alice").limit(param.limit).prepare()
+        assert_raises(TypeError, prepared.bind, limit="1 } DROP ALL")
+        assert_raises(TypeError, prepared.bind, limit=1.5)
+
+
+class TestGeneratingBinders:
+    def setup(self):
+        self.query = Select([v.x]).where(
+            (v.x, FOAF.name, param.name), (v.x, FOAF.nick, param.nick),
+            (v.x, FOAF.mbox, param.name)
+        ).filter(v.x != param.x).limit(param.limit).offset(param.limit)
+
+    def test_function_takes_values_positionally(self):
+        prepared = self.query.prepare({FOAF: 'foaf'}, generate=True)
+        assert prepared.parameters == ['name', 'nick', 'x', 'limit']
+        values = dict(name="Alice", nick=u'al "ice"', x=FOAF.a, limit=3)
+        output = prepared.function("Alice", u'al "ice"', FOAF.a, 3)
+        assert output == prepared.bind(**values)
+        assert output == self.query.prepare({FOAF: 'foaf'}).bind(**values)
+
+    def test_queries_of_the_same_shape_share_code(self):
+        a = self.query.prepare().generate()
+        b = self.query.filter(v.x != 1).prepare().generate()
+        c = self.query.prepare({FOAF: 'foaf'}).generate()
+        d = self.query.filter(v.x != param.y).prepare().generate()
+        assert a.__code__ is b.__code__ is c.__code__
+        assert a.__code__ is not d.__code__
+        assert a(1, 2, 3, 4) != c(1, 2, 3, 4)
+
+    def test_query_without_parameters(self):
+        prepared = named("Alice").prepare(generate=True)
+        assert prepared.function() == named("Alice").compile()
+
+
+class TestRegisteringQueries:
+    def setup(self):
+        self.queries = QueryRegistry({FOAF: 'foaf'})
+        self.built = []
+
+    def factory(self):
+        self.built.append(True)
+        return named(param.name)
+
+    def test_query_is_built_on_first_use(self):
+        self.queries.register('named', self.factory)
+        assert not self.built
+        output = self.queries.compile('named', name="Alice")
+        assert output == named("Alice").compile({FOAF: 'foaf'})
+        self.queries.compile('named', name="Bob")
+        assert len(self.built) == 1
+
+    def test_decorator_registers_query(self):
+        @self.queries.query('named')
+        def query():
+            return named(param.name)
+        assert 'named' in self.queries
+        assert list(self.queries) == ['named']
+        assert self.queries['named'].query.__class__ is Select
+
+    def test_query_is_prepared_once_by_concurrent_threads(self):
+        self.queries.register('named', self.factory)
+        threads = [threading.Thread(target=self.queries.compile,
+                                    args=('named',), kwargs={'name': "A"})
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(self.built) == 1
+        assert self.queries['named'].calls == 8
+
+    def test_duplicate_and_missing_names_raise_error(self):
+        self.queries.register('named', self.factory)
+        assert_raises(InvalidRequestError, self.queries.register, 'named',
+                      self.factory)
+        assert_raises(InvalidRequestError, self.queries.compile, 'missing')
+
+    def test_stats_count_calls(self):
+        self.queries.register('named', named(param.name))
+        self.queries.compile('named', name="Alice")
+        self.queries.compile('named', name="Bob")
+        stats = self.queries.stats()['named']
+        assert stats['calls'] == 2
+        assert stats['compile_time'] > 0
+
+
+class TestExecutingRegisteredQueries:
+    def setup(self):
+        self.graph = helpers.graph('foaf-01.rdf')
+        self.queries = QueryRegistry()
+        self.queries.register('named', named(param.name))
+
+    def test_execute_binds_parameters(self):
+        results = self.queries.execute('named', self.graph,
+                                       name="Peter Parker")
+        assert len(results) == 1
+        assert not self.queries.execute('named', self.graph, name="Nobody")
+
+    def test_update_query_invalidates_cached_results(self):
+        cache = ResultCache()
+        query = named("Mary Jane")
+        assert not query.execute(self.graph, cache=cache)
+        self.queries.register('insert', SPARQLUpdateQuery().insert(
+            [(param.subject, FOAF.name, param.name)]))
+        self.queries.execute('insert', self.graph, name="Mary Jane",
+                             subject=URIRef('http://example.org/mj'))
+        assert len(query.execute(self.graph, cache=cache)) == 1
@@ -0,0 +1,202 @@
+from nose.tools import assert_raises
+from rdflib import Graph
+from sparqlquery import Namespace, URIRef, Literal
+from sparqlquery.exceptions import InvalidRequestError
+from sparqlquery.mapper import mapper
+from sparqlquery.mapper.properties import Property, Relationship
+from sparqlquery.mapper.session import Session
+from sparqlquery.mapper.declarative import Subject
+from sparqlquery.sparql.helpers import is_a
+import helpers
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+EX = Namespace('http://example.org/')
+
+
+class UpdateCountingGraph(Graph):
+    """A graph keeping the updates it runs."""
+
+    def __init__(self, *args, **kwargs):
+        super(UpdateCountingGraph, self).__init__(*args, **kwargs)
+        self.updates = []
+
+    def update(self, update, *args, **kwargs):
+        self.updates.append(update)
+        return super(UpdateCountingGraph, self).update(update, *args, **kwargs)
+
+
+class LookupOnlyDict(dict):
+    """A dict failing when its items are iterated over."""
+
+    def __iter__(self):
+        raise AssertionError("The identity map was iterated over.")
+
+    iterkeys = itervalues = iteritems = keys = values = items = __iter__
+
+
+class TestFlushingSessions:
+    def setup(self):
+        class Person(object):
+            pass
+        mapper(Person, FOAF.Person, properties={
+            'name': Property(FOAF.name),
+            'age': Property(FOAF.age),
+            'knows': Relationship(Person, FOAF.knows, 'joined')
+        })
+        self.Person = Person
+        self.graph = UpdateCountingGraph()
+        for name, age in (('alice', 30), ('bob', 40)):
+            self.graph.add((EX[name], is_a, FOAF.Person))
+            self.graph.add((EX[name], FOAF.name, Literal(name.title())))
+            self.graph.add((EX[name], FOAF.age, Literal(age)))
+        self.graph.add((EX.alice, FOAF.knows, EX.bob))
+        self.session = Session(self.graph)
+
+    def persons(self, session=None):
+        query = (session or self.session).query(self.Person)
+        return dict((person.name, person) for person in query)
+
+    def new_person(self, name, age):
+        person = self.Person()
+        person._id = EX[name.lower()]
+        person.name = name
+        person.age = age
+        person.knows = []
+        return person
+
+    def test_loading_records_no_changes(self):
+        self.persons()
+        assert self.session.dirty == []
+        assert self.session.changes() == ([], [])
+
+    def test_changed_values_are_replaced(self):
+        persons = self.persons()
+        persons["Alice"].age = 31
+        persons["Bob"].age = 40
+        assert self.session.dirty == [persons["Alice"]]
+        self.session.flush()
+        assert len(self.graph.updates) == 1
+        assert set(self.graph.objects(EX.alice, FOAF.age)) == \
+            set([Literal(31)])
+        assert self.session.dirty == []
+        persons = self.persons(Session(self.graph))
+        assert persons["Alice"].age == 31
+
+    def test_changes_are_found_without_scanning_the_identity_map(self):
+        persons = self.persons()
+        other = Session(self.graph)
+        other_persons = self.persons(other)
+        persons["Alice"].age = 31
+        other_persons["Bob"].age = 41
+        self.session.identity_map = LookupOnlyDict(self.session.identity_map)
+        assert self.session.dirty == [persons["Alice"]]
+        self.session.flush()
+        assert self.session.dirty == []
+        assert other.dirty == [other_persons["Bob"]]
+
+    def test_relationship_changes_are_minimal(self):
+        persons = self.persons()
+        carol = self.new_person("Carol", 20)
+        self.session.add(carol)
+        persons["Alice"].knows = [persons["Bob"], carol]
+        deleted, inserted = self.session.changes()
+        assert deleted == []
+        assert (EX.alice, FOAF.knows, EX.carol) in inserted
+        assert (EX.alice, FOAF.knows, EX.bob) not in inserted
+        self.session.flush()
+        assert set(self.graph.objects(EX.alice, FOAF.knows)) == \
+            set([EX.bob, EX.carol])
+
+    def test_new_instances_are_inserted(self):
+        self.session.add(self.new_person("Carol", 20))
+        self.session.flush()
+        persons = self.persons(Session(self.graph))
+        assert persons["Carol"].age == 20
+        assert_raises(InvalidRequestError, self.session.add, self.Person())
+
+    def test_deleted_instances_lose_their_values(self):
+        persons = self.persons()
+        persons["Bob"].age = 41
+        self.session.delete(persons["Bob"])
+        self.session.flush()
+        assert not list(self.graph.triples((EX.bob, None, None)))
+        assert list(self.session.query(self.Person)) == [persons["Alice"]]
+
+    def test_instances_added_and_deleted_are_not_written(self):
+        carol = self.new_person("Carol", 20)
+        self.session.add(carol)
+        self.session.delete(carol)
+        assert self.session.changes() == ([], [])
+
+    def test_adding_loaded_instances_writes_only_their_changes(self):
+        persons = self.persons()
+        persons["Alice"].age = 31
+        self.session.add(persons["Alice"])
+        assert self.session.new == {}
+        self.session.flush()
+        assert set(self.graph.objects(EX.alice, FOAF.age)) == \
+            set([Literal(31)])
+
+    def test_instances_deleted_and_added_replace_their_values(self):
+        persons = self.persons()
+        alice = persons["Alice"]
+        self.session.delete(alice)
+        alice.age = 31
+        self.session.add(alice)
+        assert self.session.changes() == (
+            [(EX.alice, FOAF.age, Literal(30))],
+            [(EX.alice, FOAF.age, Literal(31))])
+        self.session.flush()
+        assert set(self.graph.objects(EX.alice, FOAF.age)) == \
+            set([Literal(31)])
+        assert set(self.graph.objects(EX.alice, FOAF.name)) == \
+            set([Literal("Alice")])
+        assert self.session.identity_map[(self.Person, EX.alice)] is alice
+
+    def test_deferred_values_are_loaded_before_they_change(self):
+        alice = self.session.query(self.Person).defer('age') \
+            .filter(name="Alice").execute().next()
+        alice.age = 31
+        assert self.session.changes() == (
+            [(EX.alice, FOAF.age, Literal(30))],
+            [(EX.alice, FOAF.age, Literal(31))])
+
+    def test_updates_have_at_most_max_triples(self):
+        session = Session(self.graph, max_triples=4)
+        for i in range(3):
+            session.add(self.new_person("Person%d" % (i,), i))
+        session.delete(self.persons(session)["Bob"])
+        session.flush()
+        request, = self.graph.updates
+        updates = request.split(' ;\n')
+        assert len(updates) == 4
+        assert [update.split()[0] for update in updates].count('DELETE') == 1
+        assert all(update.count('\n') <= 4 + 3 for update in updates)
+        assert len(self.persons(Session(self.graph))) == 4
+
+    def test_blank_nodes_cannot_be_deleted(self):
+        session = Session(helpers.graph('foaf-01.rdf'))
+        class Person(object):
+            pass
+        mapper(Person, FOAF.Person, properties={'name': Property(FOAF.name)})
+        person, = session.query(Person)
+        person.name = "Spider-Man"
+        assert_raises(InvalidRequestError, session.flush)
+
+
+class TestFlushingDeclarativeInstances:
+    def test_slotted_instances_record_changes(self):
+        class Person(Subject):
+            RDF_TYPE = FOAF.Person
+            name = Property(FOAF.name)
+        graph = Graph()
+        session = Session(graph)
+        person = Person()
+        person._id = EX.alice
+        person.name = "Alice"
+        session.add(person)
+        session.flush()
+        person.name = "Alicia"
+        assert session.dirty == [person]
+        session.flush()
+        assert list(graph.objects(EX.alice, FOAF.name)) == [Literal("Alicia")]
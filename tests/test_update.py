@@ -1,6 +1,7 @@
 from rdflib.namespace import DC
-from rdflib import URIRef, Literal
+from rdflib import Graph, URIRef, Literal
 from sparqlquery.sparql.query import SPARQLUpdateQuery
+from sparqlquery.sparql.batch import UpdateBatch
 from sparqlquery.exceptions import InvalidRequestError
 from sparqlquery import v
 from nose.tools import raises
@@ -93,3 +94,98 @@ FILTER (?price <= 20)
 }"""
         sparql = q.compile(prefix_map={DC: 'dc'})
         assert sparql == oracle_sparql
+
+
+
+class RequestCountingGraph(Graph):
+    """A graph keeping the update requests it runs."""
+
+    def __init__(self, *args, **kwargs):
+        super(RequestCountingGraph, self).__init__(*args, **kwargs)
+        self.requests = []
+
+    def update(self, update, *args, **kwargs):
+        self.requests.append(update)
+        return super(RequestCountingGraph, self).update(update, *args,
+                                                        **kwargs)
+
+
+def insert_title(n):
+    book = URIRef('http://example/book%d' % (n,))
+    return SPARQLUpdateQuery().insert([(book, DC.title, Literal(n))])
+
+
+class FailingGraph(RequestCountingGraph):
+    """A graph failing its first `failures` update requests."""
+
+    def __init__(self, failures, *args, **kwargs):
+        super(FailingGraph, self).__init__(*args, **kwargs)
+        self.failures = failures
+
+    def update(self, update, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("The update failed.")
+        return super(FailingGraph, self).update(update, *args, **kwargs)
+
+
+class TestUpdateBatch(object):
+    def setup(self):
+        self.graph = RequestCountingGraph()
+
+    def test_operations_share_prefixes(self):
+        batch = UpdateBatch(self.graph, {DC: 'dc'})
+        batch.add(insert_title(1)).add(insert_title(2))
+        batch.add(SPARQLUpdateQuery([(v.x, DC.title, 2)]).delete())
+        assert len(batch) == 3
+        compiled = batch.compile()
+        assert compiled.startswith(u'PREFIX dc: <http://purl.org/dc/elements/1.1/>\n'
+                                   u'INSERT DATA\n')
+        assert compiled.count('PREFIX') == 1
+        assert compiled.count(' ;\n') == 2
+        batch.flush()
+        assert self.graph.requests == [compiled]
+        assert len(batch) == 0
+        assert list(self.graph.objects(None, DC.title)) == [Literal(1)]
+
+    def test_batch_flushes_when_full(self):
+        with UpdateBatch(self.graph, max_operations=3) as batch:
+            for n in range(7):
+                batch.add(insert_title(n))
+            assert batch.requests == 2
+        assert batch.requests == 3
+        assert len(self.graph) == 7
+
+    def test_size_cap(self):
+        size = len(insert_title(1).compile())
+        batch = UpdateBatch(self.graph, max_size=size * 2 + 6)
+        for n in range(4):
+            batch.add(insert_title(n))
+        assert len(self.graph.requests) == 1
+        assert self.graph.requests[0].count(' ;\n') == 1
+
+    def test_batch_is_not_sent_after_an_exception(self):
+        try:
+            with UpdateBatch(self.graph) as batch:
+                batch.add(insert_title(1))
+                raise ValueError
+        except ValueError:
+            pass
+        assert not self.graph.requests
+
+    def test_failed_requests_are_sent_again(self):
+        graph = FailingGraph(1)
+        batch = UpdateBatch(graph, max_operations=2)
+        batch.add(insert_title(1)).add(insert_title(2))
+        compiled = batch.compile()
+        try:
+            batch.add(insert_title(3))
+        except IOError:
+            pass
+        assert len(batch) == 2
+        assert batch.requests == 0
+        assert batch.compile() == compiled
+        batch.flush()
+        assert graph.requests == [compiled]
+        assert batch.requests == 1
+        assert len(graph) == 2
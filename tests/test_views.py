@@ -0,0 +1,125 @@
+from nose.tools import assert_raises
+from rdflib import Graph, ConjunctiveGraph, Namespace, Literal, URIRef
+from sparqlquery.exceptions import NotSupportedError
+from sparqlquery.sparql.queryforms import Select
+from sparqlquery.sparql.query import SPARQLUpdateQuery
+from sparqlquery.sparql.views import materialize
+from sparqlquery.sparql.helpers import *
+
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+EX = Namespace('http://example.org/')
+
+FRIENDS = Select([v.name, v.friend]).where(
+    (v.x, FOAF.name, v.name),
+    (v.x, FOAF.knows, v.y),
+    (v.y, FOAF.name, v.friend)
+)
+
+
+def rows(query, graph):
+    return sorted(tuple(row) for row in query.execute(graph))
+
+
+class TestMaterializingSelect:
+    def setup(self):
+        self.graph = Graph()
+        self.graph.add((EX.alice, FOAF.name, Literal("Alice")))
+        self.graph.add((EX.bob, FOAF.name, Literal("Bob")))
+        self.graph.add((EX.alice, FOAF.knows, EX.bob))
+        self.view = materialize(FRIENDS, self.graph)
+
+    def assert_up_to_date(self):
+        assert sorted(self.view.rows) == rows(FRIENDS, self.graph)
+
+    def test_view_holds_results(self):
+        assert self.view.rows == [(Literal("Alice"), Literal("Bob"))]
+        self.assert_up_to_date()
+
+    def test_adding_triples_updates_view(self):
+        self.graph.add((EX.bob, FOAF.knows, EX.alice))
+        self.graph.add((EX.carol, FOAF.name, Literal("Carol")))
+        self.graph.add((EX.carol, FOAF.knows, EX.carol))
+        assert len(self.view) == 3
+        self.assert_up_to_date()
+
+    def test_adding_existing_triple_does_not_change_view(self):
+        self.graph.add((EX.alice, FOAF.knows, EX.bob))
+        assert len(self.view) == 1
+
+    def test_removing_triples_updates_view(self):
+        self.graph.add((EX.bob, FOAF.knows, EX.alice))
+        self.graph.remove((EX.alice, FOAF.knows, EX.bob))
+        self.assert_up_to_date()
+        self.graph.remove((EX.bob, None, None))
+        assert self.view.rows == []
+        self.assert_up_to_date()
+
+    def test_self_joins_are_counted_once(self):
+        self.graph.add((EX.carol, FOAF.name, Literal("Carol")))
+        self.graph.add((EX.carol, FOAF.knows, EX.carol))
+        self.graph.remove((EX.carol, FOAF.knows, EX.carol))
+        self.assert_up_to_date()
+        self.graph.add((EX.carol, FOAF.knows, EX.carol))
+        self.graph.remove((EX.carol, FOAF.name, None))
+        self.assert_up_to_date()
+
+    def test_adding_graphs_updates_view(self):
+        self.graph += [(EX.bob, FOAF.knows, EX.alice),
+                       (EX.bob, FOAF.knows, EX.bob)]
+        self.assert_up_to_date()
+
+    def test_update_queries_update_view(self):
+        SPARQLUpdateQuery().insert([(EX.bob, FOAF.knows, EX.alice)]) \
+            .execute(self.graph)
+        assert len(self.view) == 2
+        SPARQLUpdateQuery().delete([(EX.alice, FOAF.knows, EX.bob)]) \
+            .execute(self.graph)
+        self.assert_up_to_date()
+
+    def test_filters_apply_to_changes(self):
+        view = materialize(FRIENDS.filter(v.friend != "Bob"), self.graph)
+        self.graph.add((EX.bob, FOAF.knows, EX.alice))
+        assert view.rows == [(Literal("Bob"), Literal("Alice"))]
+
+    def test_distinct_view_holds_each_row_once(self):
+        select = Select([v.name]).where((v.x, FOAF.name, v.name),
+                                        (v.x, FOAF.knows, v.y))
+        view = materialize(select.distinct(), self.graph)
+        self.graph.add((EX.alice, FOAF.knows, EX.carol))
+        assert view.rows == [(Literal("Alice"),)]
+        assert len(materialize(select, self.graph)) == 2
+
+    def test_closed_view_is_not_updated(self):
+        self.view.close()
+        self.graph.add((EX.bob, FOAF.knows, EX.alice))
+        assert len(self.view) == 1
+
+    def test_other_graphs_on_the_same_store_are_ignored(self):
+        graph = ConjunctiveGraph()
+        a = graph.get_context(EX.a)
+        b = graph.get_context(EX.b)
+        view = materialize(Select([v.x]).where((v.x, FOAF.knows, v.y)), a)
+        b.add((EX.alice, FOAF.knows, EX.bob))
+        assert len(view) == 0
+        a.add((EX.alice, FOAF.knows, EX.bob))
+        assert len(view) == 1
+        union = materialize(Select([v.x]).where((v.x, FOAF.knows, v.y)),
+                            graph)
+        b.remove((EX.alice, FOAF.knows, EX.bob))
+        assert (len(view), len(union)) == (1, 1)
+
+
+class TestMaterializingUnsupportedQueries:
+    def test_unsupported_queries_raise_error(self):
+        graph = Graph()
+        queries = [
+            Select('*').where((v.x, FOAF.name, v.name)),
+            FRIENDS.limit(1),
+            FRIENDS.order_by(v.name),
+            Select([v.x]).where(optional((v.x, FOAF.name, v.name))),
+            Select([v.x]).where(union([(v.x, FOAF.name, v.name)],
+                                      [(v.x, FOAF.nick, v.name)])),
+            Select([op.count(v.x).as_('n')]).where((v.x, FOAF.name, v.n)),
+        ]
+        for query in queries:
+            assert_raises(NotSupportedError, materialize, query, graph)